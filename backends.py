@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from openai import AsyncOpenAI
+
+from config import BackendConfig, OpenAIConfig
+from metrics import BACKEND_OUTSTANDING, HEDGED_REQUESTS
+from resilience import is_retryable
+
+logger = logging.getLogger("xunity.backends")
+
+# Completion latencies kept per backend for the hedging delay.
+LATENCY_WINDOW = 200
+# Weight of the latest latency in the moving average used by the latency balancer.
+EWMA_ALPHA = 0.2
+# Consecutive retryable failures after which a backend is taken out until its health check passes, or
+# without health checks until a probe request after the cool-down succeeds.
+UNHEALTHY_AFTER = 3
+
+
+@dataclass
+class Backend:
+    """
+    One OpenAI-compatible endpoint and its load and latency.
+
+    Attributes:
+        config (BackendConfig): URL, model, API key and weight of the endpoint.
+        client (AsyncOpenAI): Client of the endpoint.
+        outstanding (int): Requests currently sent to the endpoint.
+        latencies (deque): Latest completion latencies in seconds.
+        ewma (Optional[float]): Moving average of the completion latency, None before the first completion.
+        healthy (bool): Whether the endpoint receives requests.
+        unhealthy_since (Optional[float]): Monotonic time the endpoint was taken out or its last probe failed.
+        probing (bool): Whether a probe request is outstanding on the unhealthy endpoint.
+        consecutive_failures (int): Retryable failures since the last success.
+        requests (int): Completions requested from the endpoint.
+        failures (int): Completions that failed.
+    """
+    config: BackendConfig
+    client: AsyncOpenAI
+    outstanding: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    ewma: Optional[float] = None
+    healthy: bool = True
+    unhealthy_since: Optional[float] = None
+    probing: bool = False
+    consecutive_failures: int = 0
+    requests: int = 0
+    failures: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.config.base_url
+
+    def quantile(self, q: float, min_samples: int) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.ewma = latency if self.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma
+        self.consecutive_failures = 0
+        if not self.healthy:
+            logger.info("Backend answered again", extra={"fields": {"backend": self.name}})
+        self.mark_healthy()
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        self.probing = False
+        if is_retryable(error):
+            self.consecutive_failures += 1
+            if not self.healthy:
+                self.unhealthy_since = time.monotonic()
+            elif self.consecutive_failures >= UNHEALTHY_AFTER:
+                self.mark_unhealthy()
+                logger.warning("Backend marked unhealthy", extra={"fields": {"backend": self.name, "error": repr(error)}})
+
+    def mark_healthy(self):
+        self.healthy = True
+        self.unhealthy_since = None
+        self.probing = False
+
+    def mark_unhealthy(self):
+        self.healthy = False
+        self.unhealthy_since = time.monotonic()
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "model": self.config.model_name, "weight": self.config.weight,
+                "healthy": self.healthy, "outstanding": self.outstanding, "requests": self.requests,
+                "failures": self.failures, "ewma_s": round(self.ewma, 4) if self.ewma is not None else None}
+
+
+@dataclass
+class BackendPool:
+    """
+    Spreads completions over several OpenAI-compatible endpoints.
+
+    The balancer picks the healthy backend with the fewest outstanding requests per weight
+    ("least_outstanding"), or additionally scaled by its average latency ("latency"). With hedging,
+    a completion that hasn't finished within the hedge_quantile latency of its backend is sent to a
+    second backend as well; the first answer wins and the other request is cancelled. Backends
+    failing repeatedly are taken out until a health check of their model list passes. Without health
+    checks (health_check_interval 0 or a single backend), a backend taken out gets a single probe
+    request once recovery_timeout seconds have passed, like a half-open circuit breaker, and is put
+    back if it succeeds.
+
+    Attributes:
+        backends (list): The backends.
+        balancer (str): "least_outstanding" or "latency".
+        hedge (bool): Whether slow completions are hedged on a second backend.
+        hedge_quantile (float): Latency quantile of a backend after which a completion is hedged.
+        hedge_min_samples (int): Completions a backend needs before its completions are hedged.
+        health_check_interval (float): Seconds between health checks, 0 to disable them.
+        recovery_timeout (float): Seconds a backend is taken out before a probe request without health checks.
+        health_task (asyncio.Task): Background task running the health checks.
+        hedges (int): Completions sent to a second backend.
+        hedge_wins (int): Hedged completions answered first by the second backend.
+    """
+    backends: list
+    balancer: str = "least_outstanding"
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    health_check_interval: float = 10.0
+    recovery_timeout: float = 30.0
+    health_task: Optional[asyncio.Task] = None
+    hedges: int = 0
+    hedge_wins: int = 0
+
+    @classmethod
+    def from_config(cls, openai_config: OpenAIConfig):
+        """
+        Create a BackendPool of the configured backends, or of base_url and model_name if there are none.
+        """
+        backend_configs = openai_config.backends or [BackendConfig(base_url=openai_config.base_url,
+                                                                   model_name=openai_config.model_name)]
+        backends = [Backend(config=backend_config,
+                            client=AsyncOpenAI(base_url=backend_config.base_url,
+                                               api_key=backend_config.api_key or openai_config.api_key,
+                                               timeout=openai_config.request_timeout,
+                                               max_retries=0))
+                    for backend_config in backend_configs]
+        return cls(backends=backends,
+                   balancer=openai_config.balancer,
+                   hedge=openai_config.hedge,
+                   hedge_quantile=openai_config.hedge_quantile,
+                   hedge_min_samples=openai_config.hedge_min_samples,
+                   health_check_interval=openai_config.health_check_interval,
+                   recovery_timeout=openai_config.breaker_reset)
+
+    def pick(self, exclude: Optional[Backend] = None) -> Optional[Backend]:
+        """
+        Returns the backend with the lowest score among the healthy ones, or among all if none is healthy.
+        Without health checks, a backend whose cool-down is over counts as healthy for one probe request.
+        """
+        candidates = [backend for backend in self.backends if backend is not exclude]
+        candidates = [backend for backend in candidates if backend.healthy or self.may_probe(backend)] or \
+            (candidates if exclude is None else [])
+        if not candidates:
+            return None
+        known = [backend.ewma for backend in candidates if backend.ewma is not None]
+        default_latency = min(known) if known else 1.0
+
+        def score(backend: Backend) -> float:
+            load = (backend.outstanding + 1) / max(backend.config.weight, 1e-9)
+            if self.balancer == "latency":
+                return load * (backend.ewma if backend.ewma is not None else default_latency)
+            return load
+
+        best = min(score(backend) for backend in candidates)
+        picked = random.choice([backend for backend in candidates if score(backend) == best])
+        if not picked.healthy and self.may_probe(picked):
+            picked.probing = True
+        return picked
+
+    def may_probe(self, backend: Backend) -> bool:
+        return (not backend.healthy and not backend.probing and not self.health_checks_enabled()
+                and time.monotonic() - backend.unhealthy_since >= self.recovery_timeout)
+
+    async def request(self, func: Callable[[Backend], Awaitable]):
+        """
+        Runs a completion on the picked backend, hedged on a second one if it is slow.
+
+        Args:
+            func (Callable[[Backend], Awaitable]): Requests the completion from the given backend.
+
+        Returns:
+            The result of the first backend that answered.
+        """
+        self.start_health_checks()
+        primary = self.pick()
+        delay = primary.quantile(self.hedge_quantile, self.hedge_min_samples) if self.hedge and len(self.backends) > 1 else None
+        if delay is None:
+            return await self.run(primary, func)
+        tasks = [asyncio.ensure_future(self.run(primary, func))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            secondary = self.pick(exclude=primary)
+            if secondary is None:
+                return await tasks[0]
+            self.hedges += 1
+            HEDGED_REQUESTS.labels("sent").inc()
+            tasks.append(asyncio.ensure_future(self.run(secondary, func)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                            HEDGED_REQUESTS.labels("won").inc()
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, backend: Backend, func: Callable[[Backend], Awaitable]):
+        backend.outstanding += 1
+        backend.requests += 1
+        BACKEND_OUTSTANDING.labels(backend.name).inc()
+        start = time.perf_counter()
+        try:
+            result = await func(backend)
+        except asyncio.CancelledError:
+            backend.probing = False
+            raise
+        except Exception as e:
+            backend.record_failure(e)
+            raise
+        finally:
+            backend.outstanding -= 1
+            BACKEND_OUTSTANDING.labels(backend.name).dec()
+        backend.record_success(time.perf_counter() - start)
+        return result
+
+    def health_checks_enabled(self) -> bool:
+        return self.health_check_interval > 0 and len(self.backends) > 1
+
+    def start_health_checks(self):
+        if self.health_task is None and self.health_checks_enabled():
+            self.health_task = asyncio.ensure_future(self.check_health())
+
+    async def check_health(self):
+        """
+        Lists the models of every backend each health_check_interval seconds, taking out the backends
+        that fail and putting back the ones that answer.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for backend in self.backends:
+                try:
+                    await asyncio.wait_for(backend.client.models.list(), timeout=self.health_check_interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if backend.healthy:
+                        logger.warning("Backend failed its health check",
+                                       extra={"fields": {"backend": backend.name, "error": repr(e)}})
+                        backend.mark_unhealthy()
+                    continue
+                if not backend.healthy:
+                    logger.info("Backend passed its health check", extra={"fields": {"backend": backend.name}})
+                backend.mark_healthy()
+                backend.consecutive_failures = 0
+
+    async def close(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+        for backend in self.backends:
+            await backend.client.close()
+
+    def stats(self) -> dict:
+        return {"hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "backends": [backend.stats() for backend in self.backends]}
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config import Config
+from examples import ExampleStore
+from glossary import Glossary
+from openai_client import LLMClient
+from rate_limit import Priority
+from resilience import UpstreamError
+from session import Session
+from tokens import estimate_tokens
+
+logger = logging.getLogger("xunity.batching")
+
+
+@dataclass
+class Batch:
+    """
+    Texts of one session waiting to be sent in a single completion.
+
+    Attributes:
+        session (Session): The session whose chat history is used as context.
+        texts (list): The pending source texts.
+        futures (list): Futures resolved with the translation of the text at the same index.
+        tokens (int): Estimated number of source tokens in the batch.
+        priority (Priority): Highest rate limiter priority of the texts in the batch.
+        timer (asyncio.TimerHandle): Sends the batch once the wait window is over.
+    """
+    session: Session
+    texts: list = field(default_factory=list)
+    futures: list = field(default_factory=list)
+    tokens: int = 0
+    priority: Priority = Priority.BULK
+    timer: asyncio.TimerHandle = None
+
+
+@dataclass
+class BatchScheduler:
+    """
+    Gathers pending translations per session and sends them as one completion with indexed tags.
+
+    A batch is sent when the wait window is over, max_batch_size texts are pending or the
+    estimated source tokens reach max_batch_tokens.
+
+    Attributes:
+        config (Config): Application configuration.
+        client (LLMClient): Client used to request completions.
+        glossary (Glossary): Glossary whose terms found in the texts of a batch are sent with it.
+        examples (ExampleStore): Past translations most similar to the texts of a batch, sent with it as examples.
+        batches (dict): Pending batches by session.
+        sending (set): Batches being sent, kept referenced until they are done.
+        batches_sent (int): Number of batch completions requested.
+        texts_batched (int): Number of texts translated through a batch.
+        fallbacks (int): Number of texts the model dropped or garbled.
+        failures (int): Number of batch completions the upstream API refused or didn't answer.
+    """
+    config: Config
+    client: LLMClient
+    glossary: Optional[Glossary] = None
+    examples: Optional[ExampleStore] = None
+    batches: dict = field(default_factory=dict)
+    sending: set = field(default_factory=set)
+    batches_sent: int = 0
+    texts_batched: int = 0
+    fallbacks: int = 0
+    failures: int = 0
+
+    async def submit(self, session: Session, text: str, priority: Priority = Priority.TEXT) -> Optional[str]:
+        """
+        Adds a text to the pending batch of a session and waits for its translation.
+
+        Args:
+            session (Session): The session whose chat history is used as context.
+            text (str): The text to be translated.
+            priority (Priority): Rate limiter priority of the text; the batch is queued at the highest one.
+
+        Returns:
+            Optional[str]: The translated text, or None if the text has to be translated on its own.
+
+        Raises:
+            UpstreamError: If the batch completion failed, so the text isn't sent on its own right after.
+        """
+        batch_config = self.config.batch_config
+        tokens = estimate_tokens(text)
+        batch = self.batches.get(id(session))
+        if batch is not None and batch.tokens + tokens > batch_config.max_batch_tokens:
+            self.flush(id(session))
+            batch = None
+        if batch is None:
+            batch = Batch(session)
+            self.batches[id(session)] = batch
+            batch.timer = asyncio.get_running_loop().call_later(batch_config.max_batch_wait_ms / 1000, self.flush, id(session))
+        future = asyncio.get_running_loop().create_future()
+        batch.texts.append(text)
+        batch.futures.append(future)
+        batch.tokens += tokens
+        batch.priority = min(batch.priority, priority)
+        if len(batch.texts) >= batch_config.max_batch_size or batch.tokens >= batch_config.max_batch_tokens:
+            self.flush(id(session))
+        return await future
+
+    def flush(self, key: int):
+        batch = self.batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self.send(batch))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, batch: Batch):
+        """
+        Sends a batch and resolves each future with its translation, or None if it is missing. If the
+        upstream API refused the batch, e.g. with the circuit open, a rate limit or retries used up,
+        every future gets the UpstreamError instead of falling back to a completion per text.
+
+        Args:
+            batch (Batch): The batch to send.
+        """
+        results = {}
+        if len(batch.texts) > 1:
+            template = self.config.prompt.template
+            self.batches_sent += 1
+            try:
+                session = batch.session
+                terms = self.glossary.match(session.src_lang, session.tgt_lang, batch.texts) if self.glossary is not None else None
+                src_prompt = template.get_batch_src_filled_prompt(batch.texts, terms)
+                example_turns = session.example_turns(self.examples.search(session.src_lang, session.tgt_lang, batch.texts)
+                                                      if self.examples is not None else [])
+                completion_res = await self.client.request_completion(
+                    session.get_messages(src_prompt, example_turns),
+                    prompt_tokens=session.prompt_tokens(src_prompt, example_turns), priority=batch.priority)
+                if isinstance(completion_res, str):
+                    results = template.get_batch_translated_texts(completion_res)
+            except UpstreamError as e:
+                self.failures += 1
+                logger.warning("Batch completion failed", extra={"fields": {"texts": len(batch.texts), "error": str(e)}})
+                for future in batch.futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            except Exception as e:
+                logger.warning("Error in batch completion", extra={"fields": {"texts": len(batch.texts), "error": str(e)}})
+            self.texts_batched += sum(1 for index in range(len(batch.texts)) if index in results)
+            self.fallbacks += sum(1 for index in range(len(batch.texts)) if index not in results)
+        for index, future in enumerate(batch.futures):
+            if not future.done():
+                future.set_result(results.get(index))
+
+    def stats(self) -> dict:
+        return {"batches_sent": self.batches_sent, "texts_batched": self.texts_batched, "fallbacks": self.fallbacks,
+                "failures": self.failures}
@@ -0,0 +1,40 @@
+"""
+Benchmark: throughput of cache misses against batch size.
+
+Starts a mock OpenAI server with a limited number of parallel slots and fires a burst of unique
+short strings at the proxy for each batch size, like a scene load. Reports wall time, texts per
+second and upstream completions. Batch size 1 disables batching.
+
+    python -m benchmark.batch_throughput --texts 256 --sizes 1 4 8 16 32
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from benchmark.harness import mock_server, proxy_server, translate, upstream_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=256, help="Number of unique texts per run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="Batch sizes to measure")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock completion latency in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Mock latency per completion token")
+    parser.add_argument("--slots", type=int, default=4, help="Completions the mock server serves in parallel")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent clients")
+    args = parser.parse_args()
+
+    print(f"{'batch':>5} {'wall s':>8} {'texts/s':>8} {'upstream':>9}")
+    for size in args.sizes:
+        with mock_server(latency=args.latency, token_latency=args.token_latency, max_concurrency=args.slots) as base_url, \
+             proxy_server(base_url, batch={"use_batching": size > 1, "max_batch_size": size, "max_batch_tokens": 100000},
+                          history={"use_history": False}) as proxy_url:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                start = time.perf_counter()
+                list(pool.map(lambda i: translate(proxy_url, f"Item {i} description"), range(args.texts)))
+                wall = time.perf_counter() - start
+            print(f"{size:>5} {wall:>8.2f} {args.texts / wall:>8.1f} {upstream_calls(base_url):>9}")
+
+
+if __name__ == "__main__":
+    main()
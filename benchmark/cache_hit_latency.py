@@ -0,0 +1,60 @@
+"""
+Load test: latency of cache hits while slow cache misses are outstanding.
+
+Seeds the translation cache, starts a mock OpenAI server with a long completion latency and
+fires a burst of misses at the proxy. While those are in flight, cache hits are sent and their
+p50/p99 latency is reported. With a blocking handler the hits queue behind the misses.
+
+    python -m benchmark.cache_hit_latency --misses 20 --hits 200 --latency 3
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.harness import mock_server, percentile, proxy_server, translate
+
+
+def seed_cache(db_path: str, count: int) -> None:
+    connector = sqlite3.connect(db_path)
+    connector.execute("CREATE TABLE translations (src_lang TEXT, tgt_lang TEXT, src_text TEXT, tgt_text TEXT)")
+    connector.executemany("INSERT INTO translations VALUES (?, ?, ?, ?)",
+                          [("ja", "en", f"hit {i}", f"cached {i}") for i in range(count)])
+    connector.commit()
+    connector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--misses", type=int, default=20, help="Number of concurrent cache misses")
+    parser.add_argument("--hits", type=int, default=200, help="Number of cache hits sent while misses are outstanding")
+    parser.add_argument("--latency", type=float, default=3.0, help="Mock completion latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent cache-hit clients")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        seed_cache(db_path, args.hits)
+        with mock_server(latency=args.latency) as base_url, proxy_server(base_url, db_path) as proxy_url:
+            translate(proxy_url, "hit 0")
+            with ThreadPoolExecutor(max_workers=args.misses) as miss_pool, \
+                 ThreadPoolExecutor(max_workers=args.concurrency) as hit_pool:
+                misses = [miss_pool.submit(translate, proxy_url, f"miss {i}") for i in range(args.misses)]
+                time.sleep(0.2)
+                start = time.perf_counter()
+                hits = list(hit_pool.map(lambda i: translate(proxy_url, f"hit {i}"), range(args.hits)))
+                hit_wall = time.perf_counter() - start
+                outstanding = sum(not miss.done() for miss in misses)
+                miss_latencies = [miss.result() for miss in misses]
+
+    print(f"cache hits : n={len(hits)} p50={percentile(hits, 50) * 1000:.1f}ms "
+          f"p99={percentile(hits, 99) * 1000:.1f}ms wall={hit_wall:.2f}s "
+          f"(misses still outstanding when hits finished: {outstanding}/{args.misses})")
+    print(f"cache misses: n={len(miss_latencies)} p50={percentile(miss_latencies, 50):.2f}s "
+          f"p99={percentile(miss_latencies, 99):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
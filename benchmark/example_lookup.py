@@ -0,0 +1,78 @@
+"""
+Benchmark: memory, build time and lookup latency of the few-shot example index at the size of a
+long-running game's translations table.
+
+Texts are sentences of Zipf-distributed words over kana and a few hundred kanji, like game dialogue;
+the lookups are for new sentences drawn the same way. Memory is that of the index without the texts
+it references, whose UTF-8 size is shown next to it.
+
+    python -m benchmark.example_lookup --rows 300000
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from config import ExamplesConfig
+from examples import ExampleStore
+
+KANA = [chr(code) for code in range(0x3041, 0x3097)] + [chr(code) for code in range(0x30A1, 0x30FB)]
+KANJI = [chr(code) for code in range(0x4E00, 0x4E00 + 600)]
+
+
+def vocabulary(rng: random.Random, size: int) -> list:
+    words = []
+    for _ in range(size):
+        chars = KANJI if rng.random() < 0.5 else KANA
+        words.append("".join(rng.choice(chars) for _ in range(rng.randint(1, 4))))
+    return words
+
+
+def sentence(rng: random.Random, words: list, weights: list) -> str:
+    return "".join(rng.choices(words, weights, k=rng.randint(3, 15))) + rng.choice("。！？…")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300000, help="Translations in the index")
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups timed")
+    parser.add_argument("--max-examples", type=int, default=5, help="Examples per lookup")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the texts")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = vocabulary(rng, 5000)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    texts = [sentence(rng, words, weights) for _ in range(args.rows)]
+    queries = [sentence(rng, words, weights) for _ in range(args.lookups)]
+    translations = [f"Translation {number}" for number in range(args.rows)]
+    config = ExamplesConfig(use_examples=True, max_examples=args.max_examples)
+    tracemalloc.start()
+    store = ExampleStore(config=config)
+    for text, translation in zip(texts, translations):
+        store.add("ja", "en", text, translation)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    store = ExampleStore(config=config)
+    start = time.perf_counter()
+    for text, translation in zip(texts, translations):
+        store.add("ja", "en", text, translation)
+    build = time.perf_counter() - start
+    text_memory = sum(len(text.encode("utf-8")) + len(translation) for text, translation in zip(texts, translations))
+
+    latencies = []
+    found = 0
+    for query in queries:
+        start = time.perf_counter()
+        found += len(store.search("ja", "en", [query]))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"rows={args.rows} build={build:.1f}s memory={memory / 2 ** 20:.0f}MiB "
+          f"({memory / args.rows:.0f} B/row, texts {text_memory / args.rows:.0f} B/row in UTF-8)")
+    print(f"lookup p50={statistics.median(latencies) * 1000:.3f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms examples/lookup={found / len(queries):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+import toml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def proxy_config(base_url: str, port: int, db_path: str, **overrides) -> dict:
+    """
+    Build a proxy configuration pointing at a mock OpenAI server.
+
+    Args:
+        base_url (str): Base URL of the mock server.
+        port (int): Port the proxy listens on.
+        db_path (str): Path of the SQLite database.
+        overrides: Sections to update, e.g. history={"use_history": False}.
+
+    Returns:
+        dict: Configuration in the layout of config.toml.
+    """
+    config = {
+        "openai": {"base_url": base_url, "api_key": "mock", "model_name": "mock"},
+        "server": {"host": "127.0.0.1", "port": port},
+        "database": {"db_type": "sqlite", "cache_translation": True, "use_cached_translation": True,
+                     "use_latest_records": True, "init_latest_records": 30,
+                     "sqlite_config": {"db_path": db_path},
+                     "postgres_config": {"host": "", "port": 5432, "user": "", "password": "", "db": ""}},
+        "batch": {"use_batching": False, "max_batch_size": 16, "max_batch_wait_ms": 20, "max_batch_tokens": 1024},
+        "rate_limit": {"rpm": 0, "tpm": 0, "ui_max_tokens": 16},
+        "segment": {"use_segmentation": False, "segment_by": "lines"},
+        # The workloads send English texts as Japanese, which script detection would pass through untranslated.
+        "passthrough": {"detect_script": False},
+        "history": {"use_history": True, "max_history": 30, "use_latest_history": True},
+        "logging": {"log_level": "WARNING", "log_file": ""},
+        "model": {"stream": False, "temperature": 0.0, "max_tokens": 256, "frequency_penalty": 0.0, "presence_penalty": 0.0},
+        "prompt": {
+            "system_prompt": {"use_system_prompt": True, "system_prompt": "You are a translator."},
+            "template": {"task_template": "Translate {src_start}{src_end} into {tgt_start}{tgt_end}.",
+                         "specify_language": True,
+                         "language_template": "Source language : {src_lang}\nTarget language : {tgt_lang}",
+                         "tag": {"src_start": "<r>", "src_end": "</r>", "tgt_start": "<t>", "tgt_end": "</t>"}},
+        },
+    }
+    for section, values in overrides.items():
+        config[section].update(values)
+    return config
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{url} did not come up within {timeout}s")
+
+
+@contextmanager
+def mock_server(latency: float = 0.0, jitter: float = 0.0, token_latency: float = 0.0, max_concurrency: int = 0,
+                chatter_tokens: int = 0, error_rate: float = 0.0, seed: int = None):
+    """
+    Run the mock OpenAI server in a subprocess and yield its base URL.
+    """
+    port = free_port()
+    command = [sys.executable, "-m", "benchmark.mock_openai", "--port", str(port),
+               "--latency", str(latency), "--jitter", str(jitter),
+               "--token-latency", str(token_latency), "--max-concurrency", str(max_concurrency),
+               "--chatter-tokens", str(chatter_tokens), "--error-rate", str(error_rate)]
+    if seed is not None:
+        command += ["--seed", str(seed)]
+    process = subprocess.Popen(command, cwd=ROOT)
+    try:
+        wait_for(f"http://127.0.0.1:{port}/calls")
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def proxy_server(base_url: str, db_path: str = None, **overrides):
+    """
+    Run main.py in a subprocess against the given OpenAI base URL and yield its root URL.
+    """
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, "config.toml")
+        with open(config_path, "w") as config_file:
+            toml.dump(proxy_config(base_url, port, db_path or os.path.join(tmp_dir, "bench.db"), **overrides), config_file)
+        process = subprocess.Popen([sys.executable, "main.py", "--api-key", "mock", "--config", config_path],
+                                   cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"http://127.0.0.1:{port}/status")
+            yield f"http://127.0.0.1:{port}"
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def translate(proxy_url: str, text: str, src_lang: str = "ja", tgt_lang: str = "en") -> float:
+    """
+    Send one /translate request and return its latency in seconds.
+    """
+    query = urllib.parse.urlencode({"from": src_lang, "to": tgt_lang, "text": text})
+    start = time.perf_counter()
+    urllib.request.urlopen(f"{proxy_url}/translate?{query}", timeout=120).read()
+    return time.perf_counter() - start
+
+
+def proxy_stats(proxy_url: str) -> dict:
+    return json.loads(urllib.request.urlopen(f"{proxy_url}/stats").read())
+
+
+def mock_stats(base_url: str) -> dict:
+    """
+    Return the counters of the mock server: completions answered and tokens streamed.
+    """
+    return json.loads(urllib.request.urlopen(f"{base_url[:-len('/v1')]}/calls").read())
+
+
+def upstream_calls(base_url: str) -> int:
+    return mock_stats(base_url)["calls"]
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,62 @@
+"""
+Benchmark: rate of saving new translations, one commit per row against write-behind batches.
+
+Runs against a fresh SQLite database in a temporary directory, through the same async paths
+the request handler uses.
+
+    python -m benchmark.insert_rate --rows 2000 --batch-rows 64
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from config import DatabaseConfig, PostgresConfig, SQLiteConfig
+from db import DB
+from write_behind import WriteBehind
+
+
+def database_config(db_path: str) -> DatabaseConfig:
+    return DatabaseConfig(db_type="sqlite", cache_translation=True, use_cached_translation=True,
+                          use_latest_records=False, init_latest_records=0,
+                          sqlite_config=SQLiteConfig(db_path=db_path),
+                          postgres_config=PostgresConfig(host="", port=5432, user="", password="", db=""))
+
+
+async def per_row(db: DB, rows: int) -> float:
+    start = time.perf_counter()
+    for i in range(rows):
+        await db.asave_translation("ja", "en", f"row {i}", f"translated {i}")
+    return time.perf_counter() - start
+
+
+async def write_behind(db: DB, rows: int, batch_rows: int) -> float:
+    writer = WriteBehind(db=db, max_rows=batch_rows, interval_ms=500)
+    start = time.perf_counter()
+    for i in range(rows):
+        writer.save("ja", "en", f"row {i}", f"translated {i}")
+        await asyncio.sleep(0)
+    await writer.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="Number of translations to save")
+    parser.add_argument("--batch-rows", type=int, default=64, help="Rows per write-behind transaction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, run in [("per-row commit", lambda db: per_row(db, args.rows)),
+                          (f"write-behind ({args.batch_rows} rows)", lambda db: write_behind(db, args.rows, args.batch_rows))]:
+            db = DB.from_config(database_config(os.path.join(tmp_dir, f"{name.split()[0]}.db")))
+            elapsed = asyncio.run(run(db))
+            with db.connection() as connector:
+                saved = connector.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            print(f"{name:>26}: {args.rows / elapsed:>10.0f} rows/s ({saved} rows saved)")
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
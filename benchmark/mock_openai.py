@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+@dataclass
+class MockSettings:
+    """
+    Behaviour of the mock OpenAI-compatible server.
+
+    Attributes:
+        latency (float): Seconds to wait before answering a completion.
+        jitter (float): Maximum random seconds added to the latency.
+        token_latency (float): Seconds added per completion token, like a decoding step.
+        max_concurrency (int): Completions served in parallel, like the slots of an inference server. 0 is unlimited.
+        chatter_tokens (int): Tokens of commentary a chatty model appends after the target end tag.
+        error_rate (float): Probability of answering a completion with a 500 error.
+        seed (int): Seed of the latency jitter and errors, so runs are repeatable. None for a random seed.
+        src_start (str): Start tag of the source text in user messages.
+        src_end (str): End tag of the source text in user messages.
+        tgt_start (str): Start tag wrapped around the echoed text.
+        tgt_end (str): End tag wrapped around the echoed text.
+        cache_block_tokens (int): Block size of the simulated prefix cache. The prompt tokens shared with one of the
+            latest prompts, in whole blocks, are reported as cached_tokens. 0 reports no cached tokens.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    token_latency: float = 0.0
+    max_concurrency: int = 0
+    chatter_tokens: int = 0
+    error_rate: float = 0.0
+    seed: int = None
+    src_start: str = "<r>"
+    src_end: str = "</r>"
+    tgt_start: str = "<t>"
+    tgt_end: str = "</t>"
+    cache_block_tokens: int = 16
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    """
+    Create a FastAPI app that answers /v1/chat/completions by echoing the latest source text wrapped in target tags.
+    Batches of indexed source sections such as <r id=3> are answered with matching indexed target sections.
+    Streamed requests are answered with server-sent events of about one token each.
+
+    Args:
+        settings (MockSettings): Behaviour of the mock server.
+
+    Returns:
+        FastAPI: The mock server application.
+    """
+    app = FastAPI()
+    rng = random.Random(settings.seed)
+    src_regex = re.compile(f"{re.escape(settings.src_start[:-1])}(?: id=(\\d+))?>(.*?){re.escape(settings.src_end)}", re.DOTALL)
+    slots = asyncio.Semaphore(settings.max_concurrency) if settings.max_concurrency > 0 else None
+    app.state.calls = 0
+    app.state.streamed_tokens = 0
+    app.state.errors = 0
+    recent_prompts = deque(maxlen=64)
+
+    def answer(messages: list) -> str:
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        sources = src_regex.findall(last_user)
+        indexed = [(index, text) for index, text in sources if index]
+        if indexed:
+            content = "\n".join(f"{settings.tgt_start[:-1]} id={index}>{text}{settings.tgt_end}" for index, text in indexed)
+        else:
+            content = f"{settings.tgt_start}{sources[-1][1] if sources else ''}{settings.tgt_end}"
+        return content + " Note: kept the tone." * (settings.chatter_tokens // 5)
+
+    def cached_tokens(messages: list) -> int:
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        shared = max((len(os.path.commonprefix([prompt, recent])) for recent in recent_prompts), default=0)
+        recent_prompts.append(prompt)
+        if settings.cache_block_tokens <= 0:
+            return 0
+        shared_tokens = min(shared, sum(len(m["content"]) for m in messages)) // 4
+        return shared_tokens // settings.cache_block_tokens * settings.cache_block_tokens
+
+    async def stream(content: str, model: str, usage: dict = None):
+        sent = 0
+        try:
+            await asyncio.sleep(settings.latency + rng.uniform(0, settings.jitter))
+            for start in range(0, len(content), 4):
+                await asyncio.sleep(settings.token_latency)
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                sent += 1
+            if usage is not None:
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [], "usage": usage}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            app.state.streamed_tokens += sent
+
+    async def generate(content: str):
+        await asyncio.sleep(settings.latency + rng.uniform(0, settings.jitter) + settings.token_latency * (len(content) // 4))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        if rng.random() < settings.error_rate:
+            app.state.errors += 1
+            return JSONResponse({"error": {"message": "mock upstream error", "type": "server_error"}}, status_code=500)
+        content = answer(body["messages"])
+        cached = cached_tokens(body["messages"])
+        usage = {"prompt_tokens": sum(len(m["content"]) for m in body["messages"]) // 4,
+                 "completion_tokens": len(content) // 4,
+                 "total_tokens": (sum(len(m["content"]) for m in body["messages"]) + len(content)) // 4,
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return StreamingResponse(stream(content, body.get("model", "mock"), usage if include_usage else None),
+                                     media_type="text/event-stream")
+        if slots is None:
+            await generate(content)
+        else:
+            async with slots:
+                await generate(content)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/calls")
+    async def calls():
+        return {"calls": app.state.calls, "errors": app.state.errors, "streamed_tokens": app.state.streamed_tokens}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible completion server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Server host address")
+    parser.add_argument("--port", type=int, default=5001, help="Server port")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random seconds added to the latency")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds added per completion token")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Completions served in parallel, 0 is unlimited")
+    parser.add_argument("--chatter-tokens", type=int, default=0, help="Tokens of commentary appended after the target end tag")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of answering with a 500 error")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the jitter and errors")
+    args = parser.parse_args()
+    uvicorn.run(create_app(MockSettings(latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+                                        max_concurrency=args.max_concurrency, chatter_tokens=args.chatter_tokens,
+                                        error_rate=args.error_rate, seed=args.seed)),
+                host=args.host, port=args.port, log_level="warning")
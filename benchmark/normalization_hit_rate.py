@@ -0,0 +1,87 @@
+"""
+Report: cache hit rate of exact cache keys against normalized (templated) cache keys.
+
+Replays a recorded request log through both keyings: every text is a hit if an earlier request
+left a usable entry, and is saved otherwise, the same way TranslationCache does. The log is the
+JSON log of the proxy (the "Translated" records, so record it with text_log_sample_rate = 1) or a
+plain text file with one text per line. Without a log, the seeded benchmark workload is replayed.
+
+    python -m benchmark.normalization_hit_rate app.log
+"""
+import argparse
+import json
+
+from benchmark.workload import Workload
+from normalize import TextTemplate
+
+
+def read_log(path: str) -> list:
+    """
+    Returns (original, translated) pairs from a JSON log or a text file. Plain texts are treated
+    as their own translation, like the mock server answers them.
+    """
+    requests = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                requests.append((line, line))
+                continue
+            if isinstance(record, dict) and "original" in record:
+                requests.append((record["original"], record.get("translated", record["original"])))
+    return requests
+
+
+def replay(requests: list) -> dict:
+    exact = set()
+    templated = {}
+    exact_hits = 0
+    normalized_hits = 0
+    for original, translated in requests:
+        if original in exact:
+            exact_hits += 1
+        else:
+            exact.add(original)
+        if original in templated:
+            normalized_hits += 1
+            continue
+        template = TextTemplate.from_text(original)
+        if template.key != original and template.key in templated:
+            normalized_hits += 1
+            continue
+        templated_text = template.extract(translated) if template.key != original else None
+        if templated_text is not None:
+            templated[template.key] = templated_text
+        else:
+            templated[original] = translated
+    return {"requests": len(requests),
+            "exact": {"hits": exact_hits, "hit_rate": round(exact_hits / max(1, len(requests)), 4),
+                      "entries": len(exact)},
+            "normalized": {"hits": normalized_hits, "hit_rate": round(normalized_hits / max(1, len(requests)), 4),
+                           "entries": len(templated)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", help="JSON logs of the proxy or text files with one text per line")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload replayed without logs")
+    args = parser.parse_args()
+
+    if args.logs:
+        requests = [request for path in args.logs for request in read_log(path)]
+    else:
+        requests = [(text, text) for burst in Workload.generate(seed=args.seed).bursts for text in burst]
+    report = replay(requests)
+    print(json.dumps(report, indent=2))
+    exact_misses = report["requests"] - report["exact"]["hits"]
+    normalized_misses = report["requests"] - report["normalized"]["hits"]
+    print(f"Upstream calls: {exact_misses} exact, {normalized_misses} normalized "
+          f"({exact_misses - normalized_misses} saved)")
+
+
+if __name__ == "__main__":
+    main()
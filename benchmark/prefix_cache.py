@@ -0,0 +1,35 @@
+"""
+Benchmark: share of prompt tokens an upstream prefix cache can reuse, with the history sliding one
+turn per request against prefix_stable_history evicting it in chunks.
+
+The mock server reports the prompt tokens shared with one of its latest prompts as cached_tokens,
+like vLLM/llama.cpp prefix caching and OpenAI prompt caching do.
+
+    python -m benchmark.prefix_cache --texts 200
+"""
+import argparse
+
+from benchmark.harness import mock_server, proxy_server, proxy_stats, translate
+from benchmark.workload import Workload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=200, help="Number of distinct texts translated per run")
+    parser.add_argument("--max-history", type=int, default=30, help="max_history of the proxy")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload")
+    args = parser.parse_args()
+
+    texts = list(dict.fromkeys(text for burst in Workload.generate(seed=args.seed).bursts for text in burst))[:args.texts]
+    for prefix_stable in (False, True):
+        with mock_server() as base_url, \
+             proxy_server(base_url, history={"max_history": args.max_history, "prefix_stable_history": prefix_stable}) as proxy_url:
+            for text in texts:
+                translate(proxy_url, text)
+            tokens = proxy_stats(proxy_url)["upstream"]["tokens"]
+        print(f"prefix_stable_history={str(prefix_stable):<5} prompt_tokens={tokens['prompt']:>8} "
+              f"cached={tokens['cached_prompt']:>8} ratio={tokens['cached_prompt_ratio']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
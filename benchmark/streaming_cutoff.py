@@ -0,0 +1,49 @@
+"""
+Benchmark: streamed completions cut off at the target end tag against full completions.
+
+The mock server plays a chatty model that keeps generating commentary after the end tag.
+Reports request latency, the tokens the mock server had to stream and the tokens of the usage the
+proxy counted. Streamed completions only report usage with --stream-usage, in a final chunk read
+after the cut-off, which makes the mock server stream the chatter as well.
+
+    python -m benchmark.streaming_cutoff --texts 20 --chatter-tokens 100
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+from benchmark.harness import mock_server, mock_stats, percentile, proxy_server, translate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=20, help="Number of texts per run")
+    parser.add_argument("--chatter-tokens", type=int, default=100, help="Tokens the model appends after the end tag")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Mock latency per streamed token")
+    parser.add_argument("--stream-usage", action="store_true", help="Read streamed completions to their usage")
+    args = parser.parse_args()
+
+    for stream in (False, True):
+        with mock_server(latency=0.05, token_latency=args.token_latency, chatter_tokens=args.chatter_tokens) as base_url, \
+             proxy_server(base_url, model={"stream": stream, "stream_usage": args.stream_usage},
+                          history={"use_history": False}) as proxy_url:
+            latencies = [translate(proxy_url, f"Dialogue line {i}") for i in range(args.texts)]
+            if stream and args.stream_usage:
+                # The usage of a cut off completion arrives once the rest of its stream has been read.
+                time.sleep(1 + args.chatter_tokens * args.token_latency)
+            proxy_stats = json.loads(urllib.request.urlopen(f"{proxy_url}/stats").read())
+            stats = proxy_stats["stream"]
+            tokens = proxy_stats["upstream"]["tokens"]
+            streamed = mock_stats(base_url)["streamed_tokens"]
+        line = (f"stream={str(stream):<5} p50={percentile(latencies, 50) * 1000:7.1f}ms p99={percentile(latencies, 99) * 1000:7.1f}ms"
+                f" usage_tokens={tokens['prompt'] + tokens['completion']}")
+        if stream:
+            line += (f" streamed_tokens={streamed} cut_off={stats['cut_off']}/{stats['requests']}"
+                     f" ttft={stats['first_token_s'] / max(1, stats['requests']) * 1000:.1f}ms"
+                     f" end_tag={stats['end_tag_s'] / max(1, stats['cut_off']) * 1000:.1f}ms")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
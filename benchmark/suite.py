@@ -0,0 +1,128 @@
+"""
+Benchmark suite: the proxy under XUnity-like traffic against a mock OpenAI-compatible server.
+
+Each scenario starts a mock server and a proxy with a fresh SQLite database, replays a seeded
+workload of UI bursts (with duplicates) and long dialogue lines, and reports throughput,
+p50/p95/p99 latency, upstream completions and database time. Results can be written as JSON
+and compared with a previous run.
+
+    python -m benchmark.suite --output results.json
+    python -m benchmark.suite --compare results.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.harness import mock_server, mock_stats, percentile, proxy_server, proxy_stats, translate
+from benchmark.workload import Workload
+
+SCENARIOS = {
+    "miss/history-on": {"warm": False, "overrides": {}},
+    "miss/history-off": {"warm": False, "overrides": {"history": {"use_history": False}}},
+    "hit/history-on": {"warm": True, "overrides": {}},
+    "hit/history-off": {"warm": True, "overrides": {"history": {"use_history": False}}},
+}
+
+
+def replay(proxy_url: str, workload: Workload, concurrency: int) -> tuple:
+    """
+    Send the bursts of a workload one after another, the texts of a burst concurrently.
+
+    Returns:
+        tuple: Latencies of the successful requests, number of failed requests and wall time.
+    """
+    latencies = []
+    errors = 0
+
+    def send(text):
+        try:
+            return translate(proxy_url, text)
+        except (urllib.error.URLError, OSError):
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for burst in workload.bursts:
+            for latency in pool.map(send, burst):
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_scenario(name: str, workload: Workload, args) -> dict:
+    scenario = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+         mock_server(latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+                     max_concurrency=args.slots, error_rate=args.error_rate, seed=workload.seed) as base_url, \
+         proxy_server(base_url, os.path.join(tmp_dir, "bench.db"), **scenario["overrides"]) as proxy_url:
+        if scenario["warm"]:
+            replay(proxy_url, workload, args.concurrency)
+        calls_before = mock_stats(base_url)["calls"]
+        db_before = proxy_stats(proxy_url)["db"]["busy_ms_total"]
+        latencies, errors, wall = replay(proxy_url, workload, args.concurrency)
+        stats = proxy_stats(proxy_url)
+        return {
+            "requests": workload.size,
+            "errors": errors,
+            "throughput_rps": round(workload.size / wall, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            "upstream_calls": mock_stats(base_url)["calls"] - calls_before,
+            "db_ms": round(stats["db"]["busy_ms_total"] - db_before, 2),
+        }
+
+
+def print_results(results: dict, baseline: dict = None):
+    columns = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "upstream_calls", "db_ms", "errors"]
+    print(f"{'scenario':<18}" + "".join(f"{column:>16}" for column in columns))
+    for name, result in results.items():
+        line = f"{name:<18}"
+        for column in columns:
+            value = result[column]
+            cell = "-" if value is None else f"{value:g}"
+            previous = (baseline or {}).get(name, {}).get(column)
+            if previous and value is not None:
+                cell += f" ({(value - previous) / previous * 100:+.0f}%)"
+            line += f"{cell:>16}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), help="Scenarios to run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload and the mock server")
+    parser.add_argument("--ui-bursts", type=int, default=8, help="Number of bursts of UI strings")
+    parser.add_argument("--ui-burst-size", type=int, default=40, help="Texts per UI burst")
+    parser.add_argument("--dialogue-lines", type=int, default=30, help="Number of long dialogue lines")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Mock latency jitter in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Mock latency per completion token")
+    parser.add_argument("--slots", type=int, default=8, help="Completions the mock server serves in parallel")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a mock upstream error")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, help="Compare with the results of a previous run")
+    args = parser.parse_args()
+
+    workload = Workload.generate(seed=args.seed, ui_bursts=args.ui_bursts, ui_burst_size=args.ui_burst_size,
+                                 dialogue_lines=args.dialogue_lines)
+    results = {name: run_scenario(name, workload, args) for name in args.scenarios}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"settings": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
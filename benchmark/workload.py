@@ -0,0 +1,60 @@
+import random
+from dataclasses import dataclass, field
+
+UI_LABELS = ["HP", "MP", "Attack", "Defense", "Magic", "Items", "Equipment", "Skills", "Status", "Save",
+             "Load", "Options", "Quit", "Yes", "No", "OK", "Cancel", "Back", "Confirm", "Continue",
+             "New Game", "Inventory", "Quest Log", "Map", "Settings", "Volume", "Language", "Shop", "Buy", "Sell"]
+
+WORDS = ["the", "knight", "village", "sword", "ancient", "forest", "dragon", "princess", "we", "must", "hurry",
+         "before", "night", "falls", "and", "the", "gate", "closes", "I", "never", "thought", "you", "would",
+         "come", "back", "here", "after", "everything", "that", "happened", "listen", "carefully", "to", "me"]
+
+
+@dataclass
+class Workload:
+    """
+    Seeded XUnity-like traffic: bursts of concurrent requests, as sent on scene loads.
+
+    Attributes:
+        seed (int): Seed of the generator, so the same workload can be replayed for regression comparison.
+        bursts (list): Lists of texts sent concurrently, one list per burst.
+    """
+    seed: int
+    bursts: list = field(default_factory=list)
+
+    @classmethod
+    def generate(cls, seed: int = 0, ui_bursts: int = 8, ui_burst_size: int = 40, duplicate_rate: float = 0.3,
+                 dialogue_lines: int = 30):
+        """
+        Generate a workload of UI bursts with duplicates and numbered labels, followed by long dialogue lines.
+
+        Args:
+            seed (int): Seed of the generator.
+            ui_bursts (int): Number of bursts of short UI strings.
+            ui_burst_size (int): Texts per UI burst.
+            duplicate_rate (float): Share of UI texts that repeat a text of the same burst, like one label on several objects.
+            dialogue_lines (int): Number of long dialogue lines, sent a few at a time.
+
+        Returns:
+            Workload: The generated workload.
+        """
+        rng = random.Random(seed)
+        workload = cls(seed=seed)
+        for burst in range(ui_bursts):
+            texts = []
+            for _ in range(ui_burst_size):
+                if texts and rng.random() < duplicate_rate:
+                    texts.append(rng.choice(texts))
+                elif rng.random() < 0.5:
+                    texts.append(rng.choice(UI_LABELS))
+                else:
+                    texts.append(f"{rng.choice(UI_LABELS)} {rng.randint(1, 300)}")
+            workload.bursts.append(texts)
+        for start in range(0, dialogue_lines, 3):
+            workload.bursts.append([" ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 40))).capitalize() + "."
+                                    for _ in range(min(3, dialogue_lines - start))])
+        return workload
+
+    @property
+    def size(self) -> int:
+        return sum(len(burst) for burst in self.bursts)
@@ -0,0 +1,230 @@
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from db import DB
+from normalize import TextTemplate
+from write_behind import WriteBehind
+
+ENTRY_OVERHEAD = 200
+
+
+def entry_size(key: tuple, tgt_text: str) -> int:
+    """
+    Approximates the memory held by a cache entry in bytes.
+    """
+    return sum(sys.getsizeof(part) for part in key) + sys.getsizeof(tgt_text) + ENTRY_OVERHEAD
+
+
+@dataclass
+class TranslationCache:
+    """
+    A bounded in-process LRU tier in front of the translations table.
+
+    Lookups read through to the database and keep what they find, saves write through, or
+    write behind when a WriteBehind queue is set. With normalize set, texts are saved by their
+    TextTemplate, so texts differing only in whitespace, numbers, rich-text tags or placeholders
+    share one entry, and looked up by the text itself first and by the template otherwise;
+    translations that can't be templated are kept under the text itself. Entries are evicted from
+    the least recently used end once the approximate memory used by the entries exceeds max_bytes.
+
+    Attributes:
+        db (DB): The database behind the cache.
+        max_bytes (int): Approximate memory budget of the entries. 0 disables the memory tier.
+        writer (WriteBehind): Queue that saves new translations in batches, or None to save each one directly.
+        entries (OrderedDict): Translations by (src_lang, tgt_lang, src_text), least recently used first.
+        size (int): Approximate memory used by the entries.
+        hits (int): Lookups answered from memory.
+        misses (int): Lookups that went to the database.
+        evictions (int): Entries dropped to stay within max_bytes.
+        normalize (bool): Whether texts are looked up and saved by their template.
+        template_hits (int): Lookups answered by the translation of a template.
+    """
+    db: DB
+    max_bytes: int
+    writer: Optional[WriteBehind] = None
+    entries: OrderedDict = field(default_factory=OrderedDict)
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    normalize: bool = False
+    template_hits: int = 0
+
+    @classmethod
+    def from_config(cls, db: DB):
+        """
+        Create a TranslationCache sized from the database configuration and warm it up.
+
+        Args:
+            db (DB): The database behind the cache.
+
+        Returns:
+            TranslationCache: An instance of TranslationCache.
+        """
+        cache = cls(db=db, max_bytes=int(db.db_config.memory_cache_mb * 1024 * 1024),
+                    writer=WriteBehind.from_config(db) if db.db_config.use_write_behind else None,
+                    normalize=db.db_config.normalize_cache_keys)
+        if db.db_config.memory_cache_warmup > 0:
+            for record in reversed(db.get_recent_translations(db.db_config.memory_cache_warmup)):
+                cache.put(record.src_lang, record.tgt_lang, record.src_text, record.tgt_text)
+        return cache
+
+    async def fetch(self, src_lang: str, tgt_lang: str, src_text: str) -> Optional[str]:
+        """
+        Returns the cached translation of a text, reading through to the database on a miss.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            src_text (str): The source text.
+
+        Returns:
+            Optional[str]: The cached translation, or None if there is none.
+        """
+        if self.normalize:
+            return (await self.fetch_many(src_lang, tgt_lang, [src_text])).get(src_text)
+        return await self._fetch(src_lang, tgt_lang, src_text)
+
+    async def _fetch(self, src_lang: str, tgt_lang: str, src_text: str) -> Optional[str]:
+        key = (src_lang, tgt_lang, src_text)
+        tgt_text = self.entries.get(key)
+        if tgt_text is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return tgt_text
+        self.misses += 1
+        if self.writer is not None:
+            tgt_text = self.writer.get(src_lang, tgt_lang, src_text)
+            if tgt_text is not None:
+                return tgt_text
+        tgt_text = await self.db.afetch_translation(src_lang, tgt_lang, src_text)
+        if tgt_text:
+            self.put(src_lang, tgt_lang, src_text, tgt_text)
+        return tgt_text
+
+    async def fetch_many(self, src_lang: str, tgt_lang: str, src_texts: list) -> dict:
+        """
+        Returns the cached translations of many texts of one language pair, reading the texts missing
+        from memory through from the database in bulk.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            src_texts (list): The distinct source texts.
+
+        Returns:
+            dict: Translations by source text, for the texts that have one.
+        """
+        if not self.normalize:
+            return await self._fetch_many(src_lang, tgt_lang, src_texts)
+        # The exact texts and their templates are read in one round trip, and the translation of the
+        # exact text wins, so a text translated on its own isn't shadowed by the template of a similar one.
+        templates = {src_text: TextTemplate.from_text(src_text) for src_text in src_texts}
+        keys = list(dict.fromkeys([*src_texts, *(template.key for template in templates.values())]))
+        found = await self._fetch_many(src_lang, tgt_lang, keys)
+        translations = {}
+        for src_text, template in templates.items():
+            if found.get(src_text):
+                translations[src_text] = found[src_text]
+            elif template.key != src_text and found.get(template.key):
+                self.template_hits += 1
+                translations[src_text] = template.fill(found[template.key])
+        return translations
+
+    async def _fetch_many(self, src_lang: str, tgt_lang: str, src_texts: list) -> dict:
+        translations = {}
+        missing = []
+        for src_text in src_texts:
+            key = (src_lang, tgt_lang, src_text)
+            tgt_text = self.entries.get(key)
+            if tgt_text is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                translations[src_text] = tgt_text
+                continue
+            self.misses += 1
+            if self.writer is not None:
+                tgt_text = self.writer.get(src_lang, tgt_lang, src_text)
+            if tgt_text is not None:
+                translations[src_text] = tgt_text
+            else:
+                missing.append(src_text)
+        if missing:
+            fetched = await self.db.afetch_translations(src_lang, tgt_lang, missing)
+            for src_text, tgt_text in fetched.items():
+                if tgt_text:
+                    self.put(src_lang, tgt_lang, src_text, tgt_text)
+                    translations[src_text] = tgt_text
+        return translations
+
+    async def save(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str, session_id: str = ""):
+        """
+        Stores a translation in memory and writes it through to the database.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            src_text (str): The source text.
+            tgt_text (str): The translated text.
+            session_id (str): Session the translation was made in, stored for the other workers.
+        """
+        if self.normalize:
+            template = TextTemplate.from_text(src_text)
+            if template.key != src_text:
+                templated_text = template.extract(tgt_text)
+                if templated_text is not None:
+                    await self._save(src_lang, tgt_lang, template.key, templated_text, session_id)
+                    return
+        await self._save(src_lang, tgt_lang, src_text, tgt_text, session_id)
+
+    async def _save(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str, session_id: str = ""):
+        if self.entries.get((src_lang, tgt_lang, src_text)) == tgt_text:
+            return
+        if self.writer is not None:
+            self.writer.save(src_lang, tgt_lang, src_text, tgt_text, session_id)
+        else:
+            await self.db.asave_translation(src_lang, tgt_lang, src_text, tgt_text, session_id)
+        self.put(src_lang, tgt_lang, src_text, tgt_text)
+
+    async def close(self):
+        if self.writer is not None:
+            await self.writer.close()
+
+    def put(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str):
+        key = (src_lang, tgt_lang, src_text)
+        size = entry_size(key, tgt_text)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= entry_size(key, self.entries.pop(key))
+        self.entries[key] = tgt_text
+        self.size += size
+        while self.size > self.max_bytes:
+            evicted_key, evicted_text = self.entries.popitem(last=False)
+            self.size -= entry_size(evicted_key, evicted_text)
+            self.evictions += 1
+
+    def refresh(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str) -> bool:
+        """
+        Replaces the translation of a text if it is in memory, e.g. after another process overwrote it in the database.
+
+        Returns:
+            bool: Whether the text was in memory.
+        """
+        key = (src_lang, tgt_lang, src_text)
+        if key not in self.entries:
+            return False
+        if self.entries[key] != tgt_text:
+            self.size -= entry_size(key, self.entries[key])
+            self.entries[key] = tgt_text
+            self.size += entry_size(key, tgt_text)
+        return True
+
+    def stats(self) -> dict:
+        stats = {"hits": self.hits, "misses": self.misses, "template_hits": self.template_hits, "evictions": self.evictions,
+                 "entries": len(self.entries), "bytes": self.size}
+        if self.writer is not None:
+            stats["write_behind"] = self.writer.stats()
+        return stats
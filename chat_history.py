@@ -1,45 +1,97 @@
+from collections import deque
 from dataclasses import dataclass, field
 
+from tokens import estimate_tokens
+
 @dataclass
 class ChatHistory:
     """
     A dataclass to store the chat history along with system and task prompts, and source and target languages.
-    
+
+    The history is split into a fixed prefix (system prompt, task template and language prompt) and
+    a deque of translation turns, so the oldest turn can be evicted in O(1). The estimated token count
+    of every message is computed once when it is added.
+
     Attributes:
-    - chat_history (list): A list of dictionaries where each dictionary represents a message in the chat history.
+    - prefix (list): Messages sent in front of every request, as dictionaries with role and content.
+    - turns (deque): Translation turns as (user_content, assistant_content, tokens) tuples, oldest first.
+    - prefix_tokens (int): Estimated tokens of the prefix.
+    - turn_tokens (int): Estimated tokens of all turns.
     - src_lang (str): A string representing the source language.
     - tgt_lang (str): A string representing the target language.
     """
 
-    chat_history: list = field(default_factory=list)
+    prefix: list = field(default_factory=list)
+    turns: deque = field(default_factory=deque)
+    prefix_tokens: int = 0
+    turn_tokens: int = 0
     src_lang: str = field(default='')
     tgt_lang: str = field(default='')
 
+    @property
+    def chat_history(self) -> list:
+        """
+        The messages of the history, merging consecutive messages of the same role.
+        """
+        messages = [dict(message) for message in self.prefix]
+        for user_content, assistant_content, _ in self.turns:
+            self._append(messages, "user", user_content)
+            self._append(messages, "assistant", assistant_content)
+        return messages
+
+    @property
+    def token_count(self) -> int:
+        return self.prefix_tokens + self.turn_tokens
+
+    @staticmethod
+    def _append(messages: list, role: str, content: str):
+        if messages and messages[-1]["role"] == role:
+            messages[-1] = {"role": role, "content": f"{messages[-1]['content']}\n{content}"}
+        else:
+            messages.append({"role": role, "content": content})
+
     def reset_history(self):
-        self.chat_history = []
-    
+        self.prefix = []
+        self.turns = deque()
+        self.prefix_tokens = 0
+        self.turn_tokens = 0
+
     def add_message(self, role: str, content: str):
-        if self.chat_history:
-            latest_message = self.chat_history.pop()
-            if latest_message["role"] == role:
-                self.chat_history.append({"role": role, "content": f"{latest_message['content']}\n{content}"})
-            else:
-                self.chat_history.append(latest_message)
-                self.chat_history.append({"role": role, "content": content})
-        else:
-            self.chat_history.append({"role": role, "content": content})
-    
-    def delete_latest_turns(self, turns: int):
-        self.chat_history.reverse()
-        self.chat_history = self.chat_history[turns+1:]
-        self.chat_history.reverse()
-        
+        self._append(self.prefix, role, content)
+        self.prefix_tokens += estimate_tokens(content)
+
+    def get_messages_with(self, role: str, content: str, turns: list = ()) -> list:
+        """
+        Returns a copy of the chat history with a message appended the same way as add_message,
+        leaving the history itself untouched so it can be sent while other requests are in flight.
+        Extra (user_content, assistant_content) turns, such as few-shot examples, go in front of the message.
+        """
+        messages = self.chat_history
+        for user_content, assistant_content in turns:
+            self._append(messages, "user", user_content)
+            self._append(messages, "assistant", assistant_content)
+        self._append(messages, role, content)
+        return messages
+
+    def add_turn(self, user_content: str, assistant_content: str):
+        tokens = estimate_tokens(user_content) + estimate_tokens(assistant_content)
+        self.turns.append((user_content, assistant_content, tokens))
+        self.turn_tokens += tokens
+
+    def pop_oldest_turn(self):
+        _, _, tokens = self.turns.popleft()
+        self.turn_tokens -= tokens
+
+    def pop_latest_turn(self):
+        _, _, tokens = self.turns.pop()
+        self.turn_tokens -= tokens
+
     def set_system_prompt(self, system_prompt: str):
         self.system_prompt = system_prompt
 
     def set_task_prompt(self, task_prompt: str):
         self.task_prompt = task_prompt
-    
+
     def set_src_lang(self, src_lang: str):
         self.src_lang = src_lang
 
@@ -51,6 +103,3 @@ class ChatHistory:
 
     def add_system_prompt(self, system_prompt: str):
         self.add_message("system", system_prompt)
-
-    def add_assistant_content(self, assistant_content: str):
-        self.chat_history.append({"role": "assistant", "content": assistant_content})
\ No newline at end of file
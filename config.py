@@ -1,8 +1,39 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import logging
 import toml
 import argparse
 from prompt import Prompt
 
+@dataclass
+class BackendConfig:
+    """
+    One OpenAI-compatible endpoint of a multi-backend setup.
+
+    Attributes:
+        base_url (str): The base URL of the endpoint.
+        model_name (str): The model name to request from the endpoint.
+        api_key (str): The API key of the endpoint, the api_key of the [openai] section if empty.
+        weight (float): Relative share of the requests the endpoint receives.
+    """
+    base_url: str
+    model_name: str
+    api_key: str = ""
+    weight: float = 1.0
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+    @classmethod
+    def from_arg(cls, arg: str, model_name: str):
+        """
+        Create a BackendConfig from a command-line value of the form base_url[,model_name[,weight]].
+        """
+        parts = arg.split(",")
+        return cls(base_url=parts[0],
+                   model_name=parts[1] if len(parts) > 1 and parts[1] else model_name,
+                   weight=float(parts[2]) if len(parts) > 2 else 1.0)
+
 @dataclass
 class OpenAIConfig:
     """
@@ -12,11 +43,40 @@ class OpenAIConfig:
         base_url (str): The base URL for the OpenAI API.
         api_key (str): The API key for authentication with the OpenAI API.
         model_name (str): The name of the OpenAI model to be used for requests.
+        request_timeout (float): Seconds one attempt of a completion may take.
+        request_deadline (float): Seconds a completion may take including all retries.
+        max_retries (int): Retries of timeouts, connection errors, 429 and 5xx responses.
+        backoff_base (float): Seconds of the first retry delay, doubled on every retry and randomized (full jitter).
+        backoff_max (float): Maximum retry delay in seconds, unless the response asks for longer with Retry-After.
+        breaker_failures (int): Consecutive failed attempts after which requests fail fast. 0 disables the circuit breaker.
+        breaker_reset (float): Seconds requests fail fast before one is let through to probe the API.
+        backends (list[BackendConfig]): Endpoints to spread requests over. If empty, base_url and model_name are used.
+        balancer (str): "least_outstanding" picks the backend with the fewest outstanding requests per weight,
+            "latency" also scales that by its average latency.
+        hedge (bool): Whether a completion slower than the hedge_quantile latency of its backend is also
+            sent to a second backend, using the answer that arrives first.
+        hedge_quantile (float): Latency quantile after which a completion is hedged.
+        hedge_min_samples (int): Completions a backend needs before its completions are hedged.
+        health_check_interval (float): Seconds between health checks of the backends, 0 to disable them
+            and probe a backend taken out with one request after breaker_reset seconds instead.
     """
     
     base_url: str
     api_key: str
     model_name: str
+    request_timeout: float = 30.0
+    request_deadline: float = 90.0
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 10.0
+    breaker_failures: int = 5
+    breaker_reset: float = 30.0
+    backends: list = field(default_factory=list)
+    balancer: str = "least_outstanding"
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    health_check_interval: float = 10.0
     
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -26,6 +86,8 @@ class OpenAIConfig:
         Args:
             config_dict (dict): A dictionary containing the configuration for the OpenAI API.
         """
+        config_dict = dict(config_dict)
+        config_dict['backends'] = [BackendConfig.from_dict(backend) for backend in config_dict.get('backends', [])]
         return cls(**config_dict)
 
 @dataclass
@@ -38,11 +100,16 @@ class ModelConfig:
         max_tokens (int): The maximum number of tokens to generate in the completion.
         frequency_penalty (float): Penalizes new tokens based on their frequency in the text so far.
         presence_penalty (float): Penalizes new tokens based on whether they appear in the text so far.
+        stream (bool): Streams completions and closes them as soon as the target end tag appears.
+        stream_usage (bool): Asks for the usage of streamed completions and reads completions cut off at
+            the end tag to it in the background, which lets the model generate to its end.
     """
     temperature: float
     max_tokens: int
     frequency_penalty: float
     presence_penalty: float
+    stream: bool = False
+    stream_usage: bool = False
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -65,9 +132,13 @@ class ServerConfig:
     Attributes:
         host: The server's host address.
         port: The port on which the server will listen.
+        workers: Number of server processes. Several workers share translations through the database.
+        sync_interval: Seconds between polls for translations saved by other workers, 0 to disable.
     """
     host: str
     port: str
+    workers: int = 1
+    sync_interval: float = 1.0
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -118,7 +189,18 @@ class PostgresConfig:
 
 @dataclass
 class DatabaseConfig:
-    """Dataclass to store the configuration for the database, including the file path."""
+    """Dataclass to store the configuration for the database, including the file path.
+
+    memory_cache_mb bounds the in-process translation cache in front of the database, and
+    memory_cache_warmup is the number of most recent translations loaded into it at startup.
+    With use_write_behind, new translations are saved in one transaction every
+    write_behind_rows rows or write_behind_ms milliseconds.
+    pool_min_size and pool_max_size bound the Postgres connection pool and the number of
+    database threads, pool_timeout is the seconds to wait for a connection (or a SQLite lock),
+    and pool_max_idle the seconds after which idle pooled connections are closed.
+    With normalize_cache_keys, translations are also cached by the text with collapsed whitespace and
+    numbers, rich-text tags and placeholders lifted into slots, which are filled back in on a hit.
+    """
     db_type: str
     cache_translation: bool
     use_cached_translation: bool
@@ -126,6 +208,16 @@ class DatabaseConfig:
     init_latest_records: int
     sqlite_config: SQLiteConfig
     postgres_config: PostgresConfig
+    memory_cache_mb: float = 64.0
+    memory_cache_warmup: int = 0
+    use_write_behind: bool = True
+    write_behind_rows: int = 64
+    write_behind_ms: float = 500.0
+    pool_min_size: int = 1
+    pool_max_size: int = 4
+    pool_timeout: float = 30.0
+    pool_max_idle: float = 600.0
+    normalize_cache_keys: bool = False
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -145,15 +237,160 @@ class DatabaseConfig:
             use_latest_records=config_dict['use_latest_records'],
             init_latest_records=config_dict['init_latest_records'],
             sqlite_config = SQLiteConfig.from_dict(config_dict['sqlite_config']),
-            postgres_config = PostgresConfig.from_dict(config_dict['postgres_config'])
+            postgres_config = PostgresConfig.from_dict(config_dict['postgres_config']),
+            memory_cache_mb=config_dict.get('memory_cache_mb', cls.memory_cache_mb),
+            memory_cache_warmup=config_dict.get('memory_cache_warmup', cls.memory_cache_warmup),
+            use_write_behind=config_dict.get('use_write_behind', cls.use_write_behind),
+            write_behind_rows=config_dict.get('write_behind_rows', cls.write_behind_rows),
+            write_behind_ms=config_dict.get('write_behind_ms', cls.write_behind_ms),
+            pool_min_size=config_dict.get('pool_min_size', cls.pool_min_size),
+            pool_max_size=config_dict.get('pool_max_size', cls.pool_max_size),
+            pool_timeout=config_dict.get('pool_timeout', cls.pool_timeout),
+            pool_max_idle=config_dict.get('pool_max_idle', cls.pool_max_idle),
+            normalize_cache_keys=config_dict.get('normalize_cache_keys', cls.normalize_cache_keys)
         )
 
 
 @dataclass
 class HistoryConfig:
+    """
+    Configuration for context-aware translation.
+
+    Attributes:
+        use_history (bool): Whether previous turns are kept in the prompt.
+        max_history (int): Maximum number of history messages per session, -1 for unlimited.
+        max_history_tokens (int): Maximum estimated tokens of the history turns per session, -1 for unlimited.
+        use_latest_history (bool): Whether the oldest turns are dropped to make room for new ones.
+        max_sessions (int): Maximum number of sessions (language pair and session id) kept in memory.
+        session_idle_timeout (float): Seconds after which an unused session is dropped, -1 to keep sessions until evicted.
+        prefix_stable_history (bool): Whether a full history evicts its oldest turns in one chunk instead of one
+            turn per request, so the prompt stays an append-only extension of the previous one and upstream
+            prompt/prefix caches can reuse it.
+        history_keep_ratio (float): Fraction of max_history and max_history_tokens kept after a chunk eviction.
+    """
     use_history: bool
     max_history: int
     use_latest_history: bool
+    max_history_tokens: int = -1
+    max_sessions: int = 16
+    session_idle_timeout: float = 1800.0
+    prefix_stable_history: bool = False
+    history_keep_ratio: float = 0.5
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class BatchConfig:
+    """
+    Configuration for packing pending translations into one completion.
+
+    Attributes:
+        use_batching (bool): Whether cache misses are batched.
+        max_batch_size (int): Maximum number of texts in one completion.
+        max_batch_wait_ms (float): Milliseconds to wait for more texts after the first one arrives.
+        max_batch_tokens (int): Estimated source tokens after which a batch is sent right away.
+        bulk_concurrency (int): Cache misses of one POST /translate/batch request translated at the same time.
+    """
+    use_batching: bool = False
+    max_batch_size: int = 16
+    max_batch_wait_ms: float = 20.0
+    max_batch_tokens: int = 1024
+    bulk_concurrency: int = 8
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class RateLimitConfig:
+    """
+    Configuration for staying within the rate limits of the upstream API.
+
+    Attributes:
+        rpm (int): Completions per minute, 0 for no limit.
+        tpm (int): Estimated prompt and completion tokens per minute, 0 for no limit.
+        ui_max_tokens (int): Texts up to this many estimated tokens are queued as UI strings, ahead of longer texts.
+    """
+    rpm: int = 0
+    tpm: int = 0
+    ui_max_tokens: int = 16
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class SegmentConfig:
+    """
+    Configuration for translating multi-line texts segment by segment.
+
+    Attributes:
+        use_segmentation (bool): Whether texts with several segments are split, translated and cached per segment.
+        segment_by (str): "lines" to split at line breaks, "sentences" to also split after sentence-ending punctuation.
+    """
+    use_segmentation: bool = False
+    segment_by: str = "lines"
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class PassthroughConfig:
+    """
+    Configuration for returning texts that need no translation without a completion.
+
+    Attributes:
+        use_passthrough (bool): Whether texts without letters (numbers, punctuation, percentages, timers, symbols) are returned as they are.
+        detect_script (bool): Whether texts whose letters are all in the script of the target language are returned as
+            they are, for language pairs whose scripts don't overlap.
+        scripts (dict): Script names by language code, overriding the built-in table of passthrough.LANGUAGE_SCRIPTS.
+    """
+    use_passthrough: bool = True
+    detect_script: bool = True
+    scripts: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class GlossaryConfig:
+    """
+    Configuration for the glossary of fixed term translations.
+
+    Attributes:
+        use_glossary (bool): Whether texts are matched against the glossary table.
+        max_terms (int): Maximum number of matching terms put into one prompt.
+    """
+    use_glossary: bool = True
+    max_terms: int = 20
+
+    @classmethod
+    def from_dict(cls, config_dict: dict):
+        return cls(**config_dict)
+
+@dataclass
+class ExamplesConfig:
+    """
+    Configuration for the few-shot examples retrieved from past translations.
+
+    Attributes:
+        use_examples (bool): Whether the past translations most similar to a text are sent with it as examples.
+        max_examples (int): Maximum number of examples sent with one prompt.
+        min_similarity (float): Minimum BM25 score of an example relative to the score the text would have itself, from 0 to 1.
+        ngram (int): Characters per n-gram of the index.
+        bucket_bits (int): The n-grams are hashed into 2 ** bucket_bits buckets.
+        max_postings (int): Postings scored per lookup at most, skipping the most common n-grams beyond it.
+    """
+    use_examples: bool = False
+    max_examples: int = 5
+    min_similarity: float = 0.2
+    ngram: int = 2
+    bucket_bits: int = 18
+    max_postings: int = 2000
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -167,9 +404,11 @@ class LoggingConfig:
     Attributes:
         log_file (str): The path to the log file where logs will be written.
         log_level (str): The level of logging (e.g., "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL").
+        text_log_sample_rate (float): Share of requests whose original and translated text is logged, from 0 to 1.
     """
     log_file: str
     log_level: str
+    text_log_sample_rate: float = 0.1
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -185,6 +424,12 @@ class Config:
         model_config: Configuration for the model parameters.
         server_config: Configuration for the server settings.
         database_config: Configuration for the database.
+        batch_config: Configuration for batching translations.
+        segment_config: Configuration for translating multi-line texts per segment.
+        passthrough_config: Configuration for returning texts that need no translation as they are.
+        glossary_config: Configuration for the glossary of fixed term translations.
+        examples_config: Configuration for the few-shot examples retrieved from past translations.
+        rate_limit_config: Configuration for the rate limits of the upstream API.
         logging_config: Configuration for logging settings.
     """
     openai_config: OpenAIConfig
@@ -192,6 +437,12 @@ class Config:
     server_config: ServerConfig
     history_config: HistoryConfig
     database_config: DatabaseConfig
+    batch_config: BatchConfig
+    segment_config: SegmentConfig
+    passthrough_config: PassthroughConfig
+    glossary_config: GlossaryConfig
+    examples_config: ExamplesConfig
+    rate_limit_config: RateLimitConfig
     logging_config: LoggingConfig
     prompt: Prompt
 
@@ -212,7 +463,7 @@ class Config:
         try:
             config_dict = toml.load(config_file)
         except Exception as e:
-            print(f"Error loading config file: {e}")
+            logging.getLogger("xunity.config").error("Error loading config file", extra={"fields": {"error": str(e)}})
             raise
         return cls(
             openai_config=OpenAIConfig.from_dict(config_dict['openai']),
@@ -220,6 +471,12 @@ class Config:
             server_config=ServerConfig.from_dict(config_dict['server']),
             history_config=HistoryConfig.from_dict(config_dict['history']),
             database_config=DatabaseConfig.from_dict(config_dict['database']),
+            batch_config=BatchConfig.from_dict(config_dict.get('batch', {})),
+            segment_config=SegmentConfig.from_dict(config_dict.get('segment', {})),
+            passthrough_config=PassthroughConfig.from_dict(config_dict.get('passthrough', {})),
+            glossary_config=GlossaryConfig.from_dict(config_dict.get('glossary', {})),
+            examples_config=ExamplesConfig.from_dict(config_dict.get('examples', {})),
+            rate_limit_config=RateLimitConfig.from_dict(config_dict.get('rate_limit', {})),
             logging_config=LoggingConfig.from_dict(config_dict['logging']),
             prompt=Prompt.from_dict(config_dict=config_dict['prompt'])
         )
@@ -239,22 +496,44 @@ class Config:
             openai_config=OpenAIConfig.from_dict({
                 "base_url": args.base_url,
                 "api_key": args.api_key,
-                "model_name": args.model_name
+                "model_name": args.model_name,
+                "request_timeout": args.request_timeout,
+                "request_deadline": args.request_deadline,
+                "max_retries": args.max_retries,
+                "backoff_base": args.backoff_base,
+                "backoff_max": args.backoff_max,
+                "breaker_failures": args.breaker_failures,
+                "breaker_reset": args.breaker_reset,
+                "backends": [vars(BackendConfig.from_arg(backend, args.model_name)) for backend in args.backend],
+                "balancer": args.balancer,
+                "hedge": args.hedge,
+                "hedge_quantile": args.hedge_quantile,
+                "hedge_min_samples": args.hedge_min_samples,
+                "health_check_interval": args.health_check_interval
             }),
             model_config=ModelConfig.from_dict({
                 "temperature": args.temperature,
                 "max_tokens": args.max_tokens,
                 "frequency_penalty": args.frequency_penalty,
-                "presence_penalty": args.presence_penalty
+                "presence_penalty": args.presence_penalty,
+                "stream": args.stream,
+                "stream_usage": args.stream_usage
             }),
             server_config=ServerConfig.from_dict({
                 "host": args.host,
-                "port": args.port
+                "port": args.port,
+                "workers": args.workers,
+                "sync_interval": args.sync_interval
             }),
             history_config=HistoryConfig.from_dict({
                 "use_history": args.use_history,
                 "max_history": args.max_history,
-                "use_latest_history": args.use_latest_history
+                "use_latest_history": args.use_latest_history,
+                "max_history_tokens": args.max_history_tokens,
+                "max_sessions": args.max_sessions,
+                "session_idle_timeout": args.session_idle_timeout,
+                "prefix_stable_history": args.prefix_stable_history,
+                "history_keep_ratio": args.history_keep_ratio
             }),
             database_config=DatabaseConfig.from_dict({
                 "db_type": args.db_type,
@@ -262,6 +541,16 @@ class Config:
                 "use_cached_translation": args.use_cached_translation,
                 "use_latest_records": args.use_latest_records,
                 "init_latest_records": args.init_latest_records,
+                "memory_cache_mb": args.memory_cache_mb,
+                "memory_cache_warmup": args.memory_cache_warmup,
+                "use_write_behind": not args.no_write_behind,
+                "write_behind_rows": args.write_behind_rows,
+                "write_behind_ms": args.write_behind_ms,
+                "pool_min_size": args.pool_min_size,
+                "pool_max_size": args.pool_max_size,
+                "pool_timeout": args.pool_timeout,
+                "pool_max_idle": args.pool_max_idle,
+                "normalize_cache_keys": args.normalize_cache_keys,
                 "sqlite_config": {
                     "db_path": args.sqlite_db_path
                 },
@@ -273,15 +562,47 @@ class Config:
                     "db": args.postgres_db
                 }
             }),
+            batch_config=BatchConfig.from_dict({
+                "use_batching": args.use_batching,
+                "max_batch_size": args.max_batch_size,
+                "max_batch_wait_ms": args.max_batch_wait_ms,
+                "max_batch_tokens": args.max_batch_tokens,
+                "bulk_concurrency": args.bulk_concurrency
+            }),
+            segment_config=SegmentConfig.from_dict({
+                "use_segmentation": args.use_segmentation,
+                "segment_by": args.segment_by
+            }),
+            passthrough_config=PassthroughConfig.from_dict({
+                "use_passthrough": args.use_passthrough,
+                "detect_script": args.detect_script
+            }),
+            glossary_config=GlossaryConfig.from_dict({
+                "use_glossary": args.use_glossary,
+                "max_terms": args.max_glossary_terms
+            }),
+            examples_config=ExamplesConfig.from_dict({
+                "use_examples": args.use_examples,
+                "max_examples": args.max_examples,
+                "min_similarity": args.min_example_similarity
+            }),
+            rate_limit_config=RateLimitConfig.from_dict({
+                "rpm": args.rpm,
+                "tpm": args.tpm,
+                "ui_max_tokens": args.ui_max_tokens
+            }),
             logging_config=LoggingConfig.from_dict({
                 "log_file": args.log_file,
-                "log_level": args.log_level
+                "log_level": args.log_level,
+                "text_log_sample_rate": args.text_log_sample_rate
             }),
             prompt=Prompt.from_dict({
             "template": {
                 "task_template": args.task_template,
                 "specify_language": args.specify_language,
                 "language_template": args.language_template,
+                "batch_template": args.batch_template,
+                "glossary_template": args.glossary_template,
                 "tag": {
                     "src_start": args.src_start,
                     "src_end": args.src_end,
@@ -303,21 +624,43 @@ def parse_args():
     parser.add_argument("--base-url", type=str, default="https://api.openai.com/v1", help="Base URL for OpenAI API")
     parser.add_argument("--api-key", type=str, required=True, help="openai")
     parser.add_argument("--model-name", type=str, default="gpt-3.5-turbo", help="OpenAI model name")
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="Seconds one attempt of a completion may take")
+    parser.add_argument("--request-deadline", type=float, default=90.0, help="Seconds a completion may take including retries")
+    parser.add_argument("--max-retries", type=int, default=3, help="Retries of timeouts, connection errors, 429 and 5xx responses")
+    parser.add_argument("--backoff-base", type=float, default=0.5, help="Seconds of the first retry delay")
+    parser.add_argument("--backoff-max", type=float, default=10.0, help="Maximum retry delay in seconds")
+    parser.add_argument("--breaker-failures", type=int, default=5, help="Consecutive failures after which requests fail fast, 0 to disable")
+    parser.add_argument("--breaker-reset", type=float, default=30.0, help="Seconds requests fail fast before the API is probed again")
+    parser.add_argument("--backend", type=str, action="append", default=[], help="Backend as base_url[,model_name[,weight]], repeat for several")
+    parser.add_argument("--balancer", type=str, choices=["least_outstanding", "latency"], default="least_outstanding", help="How a backend is picked")
+    parser.add_argument("--hedge", action="store_true", help="Send slow completions to a second backend as well")
+    parser.add_argument("--hedge-quantile", type=float, default=0.95, help="Latency quantile after which a completion is hedged")
+    parser.add_argument("--hedge-min-samples", type=int, default=20, help="Completions of a backend before its completions are hedged")
+    parser.add_argument("--health-check-interval", type=float, default=10.0, help="Seconds between health checks of the backends, 0 to disable")
     
     # Model Config
     parser.add_argument("--temperature", type=float, default=0.0, help="Model temperature (randomness control)")
     parser.add_argument("--max-tokens", type=int, default=2048, help="Maximum number of tokens to generate")
     parser.add_argument("--frequency-penalty", type=float, default=0.0, help="Penalty for repeated tokens")
     parser.add_argument("--presence-penalty", type=float, default=0.0, help="Penalty for new tokens")
+    parser.add_argument("--stream", action="store_true", help="Stream completions and stop at the target end tag")
+    parser.add_argument("--stream-usage", action="store_true", help="Read streamed completions to their usage after the end tag")
     
     # Server Config
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Server host address")
     parser.add_argument("--port", type=int, default=5000, help="Server port")
+    parser.add_argument("--workers", type=int, default=1, help="Number of server processes")
+    parser.add_argument("--sync-interval", type=float, default=1.0, help="Seconds between polls for translations saved by other workers (0 to disable)")
     
     # History Config
     parser.add_argument("--use-history", action="store_true", help="Enable history usage")
     parser.add_argument("--max-history", type=int, default=20, help="Maximum number of history records")
     parser.add_argument("--use-latest-history", action="store_true", help="Use latest history records")
+    parser.add_argument("--max-history-tokens", type=int, default=-1, help="Maximum estimated tokens of the history (-1 for unlimited)")
+    parser.add_argument("--max-sessions", type=int, default=16, help="Maximum number of chat sessions kept in memory")
+    parser.add_argument("--session-idle-timeout", type=float, default=1800.0, help="Seconds after which an idle session is dropped (-1 to disable)")
+    parser.add_argument("--prefix-stable-history", action="store_true", help="Evict full histories in chunks so upstream prompt caches can reuse the prompt")
+    parser.add_argument("--history-keep-ratio", type=float, default=0.5, help="Fraction of the history limits kept after a chunk eviction")
     
     # Database Config
     parser.add_argument("--db-type", type=str, default="sqlite", help="Database type to use")
@@ -325,6 +668,16 @@ def parse_args():
     parser.add_argument("--use-cached-translation", action="store_true", help="Use cached translations if available")
     parser.add_argument("--use-latest-records", action="store_true", help="Use latest database records")
     parser.add_argument("--init-latest-records", type=int, default=20, help="Number of initial latest records")
+    parser.add_argument("--memory-cache-mb", type=float, default=64.0, help="Memory budget of the in-process translation cache in MiB (0 to disable)")
+    parser.add_argument("--memory-cache-warmup", type=int, default=0, help="Number of most recent translations loaded into the memory cache at startup")
+    parser.add_argument("--no-write-behind", action="store_true", help="Save every translation in its own transaction")
+    parser.add_argument("--write-behind-rows", type=int, default=64, help="Number of new translations saved per transaction")
+    parser.add_argument("--write-behind-ms", type=float, default=500.0, help="Milliseconds after which pending translations are saved")
+    parser.add_argument("--pool-min-size", type=int, default=1, help="Minimum number of pooled PostgreSQL connections")
+    parser.add_argument("--pool-max-size", type=int, default=4, help="Maximum number of pooled connections and database threads")
+    parser.add_argument("--pool-timeout", type=float, default=30.0, help="Seconds to wait for a database connection or lock")
+    parser.add_argument("--pool-max-idle", type=float, default=600.0, help="Seconds after which idle pooled connections are closed")
+    parser.add_argument("--normalize-cache-keys", action="store_true", help="Cache translations by a template of the text")
 
     # PostgreSQL Configs
     parser.add_argument("--postgres-host", type=str, default="localhost", help="PostgreSQL server host")
@@ -336,14 +689,46 @@ def parse_args():
     # SQLite Config 
     parser.add_argument("--sqlite-db-path", type=str, default="translated_texts.db", help="Path to the SQLite database file")
     
+    # Batch Config
+    parser.add_argument("--use-batching", action="store_true", help="Pack pending translations into one completion")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Maximum number of texts in one batch")
+    parser.add_argument("--max-batch-wait-ms", type=float, default=20.0, help="Milliseconds to wait for more texts before sending a batch")
+    parser.add_argument("--max-batch-tokens", type=int, default=1024, help="Estimated source tokens after which a batch is sent")
+    parser.add_argument("--bulk-concurrency", type=int, default=8, help="Cache misses of one bulk request translated at the same time")
+
+    # Segment Config
+    parser.add_argument("--use-segmentation", action="store_true", help="Translate and cache multi-line texts per segment")
+    parser.add_argument("--segment-by", type=str, choices=["lines", "sentences"], default="lines", help="Split texts at line breaks or also after sentences")
+
+    # Passthrough Config
+    parser.add_argument("--no-passthrough", dest="use_passthrough", action="store_false", help="Send texts without letters to the model too")
+    parser.add_argument("--no-detect-script", dest="detect_script", action="store_false", help="Send texts already in the target script to the model too")
+
+    # Glossary Config
+    parser.add_argument("--no-glossary", dest="use_glossary", action="store_false", help="Don't match texts against the glossary table")
+    parser.add_argument("--max-glossary-terms", type=int, default=20, help="Maximum number of glossary terms put into one prompt")
+
+    # Examples Config
+    parser.add_argument("--use-examples", action="store_true", help="Send the past translations most similar to a text with it as examples")
+    parser.add_argument("--max-examples", type=int, default=5, help="Maximum number of examples sent with one prompt")
+    parser.add_argument("--min-example-similarity", type=float, default=0.2, help="Minimum BM25 score of an example relative to that of the text itself, from 0 to 1")
+
+    # Rate Limit Config
+    parser.add_argument("--rpm", type=int, default=0, help="Completions per minute allowed by the API, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute allowed by the API, 0 for no limit")
+    parser.add_argument("--ui-max-tokens", type=int, default=16, help="Texts up to this many tokens are sent ahead of longer texts")
+
     # Logging Config
     parser.add_argument("--log-file", type=str, help="Log file path")
     parser.add_argument("--log-level", type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO", help="Logging level")
+    parser.add_argument("--text-log-sample-rate", type=float, default=0.1, help="Share of requests whose original and translated text is logged")
 
     # Prompt Config
     parser.add_argument("--task-template", type=str, default="Translate text in the {src_start}{src_end} section to the target language as naturally as possible, considering the context in the translation history and ensuring consistency and cultural relevance. Translated text must be enclosed in the {tgt_start}{tgt_end} section. You must respond with only the {tgt_end} section.", help="Template for the translation task")
     parser.add_argument("--specify-language", action="store_true", help="Specify source and target languages in the prompt")
     parser.add_argument("--language-template", type=str, default="Source language : {src_lang}\nTarget language : {tgt_lang}", help="Template for specifying languages")
+    parser.add_argument("--batch-template", type=str, default="", help="Instruction sent in front of a batch of source sections")
+    parser.add_argument("--glossary-template", type=str, default="", help="Instruction in front of the glossary terms matching a text, with a {terms} field")
 
     # Tag Config
     parser.add_argument("--src-start", type=str, default="<src>", help="Start tag for the source language")
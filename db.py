@@ -1,43 +1,173 @@
+import asyncio
+import logging
+import os
+import socket
 import sqlite3
-import psycopg
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Union
+from typing import Iterable, Iterator, Optional
+from psycopg_pool import ConnectionPool
 from config import DatabaseConfig
 
+logger = logging.getLogger("xunity.db")
+
+SCHEMA_VERSION = 4
+
+# Texts looked up per query by fetch_translations, below the SQLite limit of bound parameters.
+FETCH_CHUNK = 500
+
+# Advisory lock serializing the writers of a Postgres database, so revisions are committed in order.
+REVISION_LOCK = 0x78756E69
+
+UPSERT_QUERY = """
+            INSERT INTO translations (src_lang, tgt_lang, src_text, tgt_text, origin, session_id, revision)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {next_revision})
+            ON CONFLICT (src_lang, tgt_lang, {src_key})
+            DO UPDATE SET tgt_text = excluded.tgt_text, updated_at = {now},
+                          origin = excluded.origin, session_id = excluded.session_id, revision = excluded.revision
+            """
+
+GLOSSARY_UPSERT_QUERY = """
+            INSERT INTO glossary (src_lang, tgt_lang, src_term, tgt_term)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})
+            ON CONFLICT (src_lang, tgt_lang, src_term)
+            DO UPDATE SET tgt_term = excluded.tgt_term
+            """
+
+GLOSSARY_INSERT_IF_ABSENT_QUERY = """
+            INSERT INTO glossary (src_lang, tgt_lang, src_term, tgt_term)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})
+            ON CONFLICT (src_lang, tgt_lang, src_term)
+            DO NOTHING
+            """
+
+INSERT_IF_ABSENT_QUERY = """
+            INSERT INTO translations (src_lang, tgt_lang, src_text, tgt_text, origin, session_id, revision)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {next_revision})
+            ON CONFLICT (src_lang, tgt_lang, {src_key})
+            DO NOTHING
+            """
+
 @dataclass
 class DB:
-    connector: Union[sqlite3.Connection, psycopg.Connection]
-    cursor: Union[sqlite3.Cursor, psycopg.Cursor]
+    """
+    Translation storage on SQLite or Postgres.
+
+    Postgres connections come from a psycopg_pool ConnectionPool. SQLite uses one connection per
+    thread in WAL mode, so readers don't block each other or the writer. Async methods run the
+    blocking calls on an executor with as many threads as the pool has connections.
+
+    Every write stamps its rows with the next revision, the origin of the writing process and the
+    session the translation was made in, and writes are serialized (by SQLite itself, by an advisory
+    lock on Postgres), so processes sharing the database can follow each other's changes in order
+    with get_changes.
+
+    Attributes:
+        db_config (DatabaseConfig): The database configuration.
+        pool (ConnectionPool): The Postgres connection pool, None for SQLite.
+        local (threading.local): Holds the SQLite connection of each thread.
+        executor (ThreadPoolExecutor): Threads running the blocking database calls.
+        waits (int): Number of async calls that waited for a database thread and connection.
+        wait_time (float): Total seconds async calls waited for a database thread and connection.
+        max_wait_time (float): Longest wait in seconds.
+        busy_time (float): Total seconds spent running async calls on the database threads.
+        origin (str): Host and process id stamped on the rows written by this process.
+    """
     db_config: DatabaseConfig
+    pool: Optional[ConnectionPool] = None
+    local: threading.local = field(default_factory=threading.local)
+    executor: ThreadPoolExecutor = field(init=False)
+    waits: int = 0
+    wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    busy_time: float = 0.0
+    origin: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}")
+
+    def __post_init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.db_config.pool_max_size, thread_name_prefix="db")
 
     @classmethod
     def from_config(cls, db_config: DatabaseConfig):
-        match db_config.db_type:
-            case "sqlite":
-                connector = sqlite3.connect(db_config.sqlite_config.db_path)
-            case "postgres":
-                connector = psycopg.connect("""host={}
-                                            port={}
-                                            dbname={}
-                                            user={}
-                                            password={}
-                                             """.format(db_config.postgres_config.host,
-                                                        db_config.postgres_config.port,
-                                                        db_config.postgres_config.db,
-                                                        db_config.postgres_config.user,
-                                                        db_config.postgres_config.password)
-                                            )
-        cls.db_config = db_config
-        cls.connector = connector
-        cls.cursor = connector.cursor()
-        if "translations" not in cls.get_table_list():
-            cls.init_table()
-
-        return cls(cls.connector, cls.cursor, cls.db_config)
-        
-    @classmethod
-    def get_table_list(cls) -> list:
-        match cls.db_config.db_type:
+        pool = None
+        if db_config.db_type == "postgres":
+            pool = ConnectionPool("""host={}
+                                  port={}
+                                  dbname={}
+                                  user={}
+                                  password={}
+                                  """.format(db_config.postgres_config.host,
+                                             db_config.postgres_config.port,
+                                             db_config.postgres_config.db,
+                                             db_config.postgres_config.user,
+                                             db_config.postgres_config.password),
+                                  min_size=db_config.pool_min_size,
+                                  max_size=db_config.pool_max_size,
+                                  timeout=db_config.pool_timeout,
+                                  max_idle=db_config.pool_max_idle,
+                                  open=True)
+        db = cls(db_config=db_config, pool=pool)
+        db.migrate()
+
+        return db
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields a connection of the calling thread, committing when the block succeeds and rolling back otherwise.
+        """
+        if self.pool is not None:
+            with self.pool.connection() as connector:
+                yield connector
+            return
+        connector = getattr(self.local, "connector", None)
+        if connector is None:
+            # Writes begin IMMEDIATE, so a writer waits for the lock instead of failing on a stale snapshot.
+            connector = sqlite3.connect(self.db_config.sqlite_config.db_path, timeout=self.db_config.pool_timeout,
+                                        isolation_level="IMMEDIATE")
+            connector.execute("PRAGMA journal_mode=WAL")
+            connector.execute("PRAGMA synchronous=NORMAL")
+            self.local.connector = connector
+        try:
+            yield connector
+            connector.commit()
+        except Exception:
+            connector.rollback()
+            raise
+
+    @contextmanager
+    def migration_transaction(self):
+        """
+        Yields a connection whose statements, schema changes included, are committed together when the
+        block succeeds and rolled back otherwise. The sqlite3 module would run CREATE, ALTER and DROP
+        statements outside of its implicit transactions, so SQLite gets an autocommit connection with
+        an explicit BEGIN IMMEDIATE.
+        """
+        if self.pool is not None:
+            with self.connection() as connector:
+                yield connector
+            return
+        connector = sqlite3.connect(self.db_config.sqlite_config.db_path, timeout=self.db_config.pool_timeout,
+                                    isolation_level=None)
+        try:
+            connector.execute("BEGIN IMMEDIATE")
+            try:
+                yield connector
+            except Exception:
+                connector.execute("ROLLBACK")
+                raise
+            connector.execute("COMMIT")
+        finally:
+            connector.close()
+
+    def get_table_list(self) -> list:
+        with self.connection() as connector:
+            return self._table_list(connector)
+
+    def _table_list(self, connector) -> list:
+        match self.db_config.db_type:
             case "sqlite":
                 query = """SELECT name FROM sqlite_master
                         WHERE type = 'table'
@@ -48,79 +178,439 @@ class DB:
                         WHERE schemaname
                         NOT IN ('pg_catalog', 'information_schema')
                         """
+        return [t[0] for t in connector.execute(query).fetchall()]
 
-        cls.cursor.execute(query)
-        return [t[0] for t in cls.cursor.fetchall()]
+    def _column_list(self, connector, table: str) -> list:
+        match self.db_config.db_type:
+            case "sqlite":
+                return [row[1] for row in connector.execute(f"PRAGMA table_info({table})").fetchall()]
+            case "postgres":
+                return [row[0] for row in connector.execute("""SELECT column_name FROM information_schema.columns
+                                                            WHERE table_schema = current_schema() AND table_name = %s
+                                                            """, (table,)).fetchall()]
 
-    @classmethod
-    def init_table(cls) -> None:
-        cls.cursor.execute("""CREATE TABLE translations (
-                            src_lang TEXT,
-                            tgt_lang TEXT,
-                            src_text TEXT,
-                            tgt_text TEXT)
+    def _schema_version(self, connector) -> int:
+        if "schema_version" not in self._table_list(connector):
+            connector.execute("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+            connector.execute("INSERT INTO schema_version VALUES (0)")
+        return connector.execute("SELECT version FROM schema_version").fetchone()[0]
+
+    def get_schema_version(self) -> int:
+        with self.migration_transaction() as connector:
+            return self._schema_version(connector)
+
+    def migrate(self) -> None:
+        """
+        Brings the database schema up to SCHEMA_VERSION, one migration per transaction: a migration
+        that fails is rolled back as a whole together with its version, so the next start retries it.
+        """
+        migrations = [self._migrate_to_v1, self._migrate_to_v2, self._migrate_to_v3, self._migrate_to_v4]
+        while True:
+            with self.migration_transaction() as connector:
+                version = self._schema_version(connector)
+                if version >= len(migrations):
+                    return
+                migrations[version](connector, self._table_list(connector))
+                connector.execute(self._fill_placeholder("UPDATE schema_version SET version = {placeholder}"), (version + 1,))
+            logger.info("Database schema migrated", extra={"fields": {"version": version + 1}})
+
+    def init_table(self, connector, table: str = "translations") -> None:
+        match self.db_config.db_type:
+            case "sqlite":
+                connector.execute(f"""CREATE TABLE {table} (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    src_lang TEXT NOT NULL,
+                                    tgt_lang TEXT NOT NULL,
+                                    src_text TEXT NOT NULL,
+                                    tgt_text TEXT NOT NULL,
+                                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)
+                                   """)
+            case "postgres":
+                connector.execute(f"""CREATE TABLE {table} (
+                                    id BIGSERIAL PRIMARY KEY,
+                                    src_lang TEXT NOT NULL,
+                                    tgt_lang TEXT NOT NULL,
+                                    src_text TEXT NOT NULL,
+                                    tgt_text TEXT NOT NULL,
+                                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+                                   """)
+
+    def _migrate_to_v1(self, connector, tables: list) -> None:
+        """
+        Rebuilds the legacy four-column table with an id, timestamps and a unique key on
+        (src_lang, tgt_lang, src_text), keeping the most recent row of each duplicate.
+        Postgres keys on md5(src_text) because btree entries are limited to about 2.7 kB.
+        """
+        if "translations" in tables:
+            legacy_order = "rowid" if self.db_config.db_type == "sqlite" else "ctid"
+            self.init_table(connector, "translations_v1")
+            connector.execute(f"""
+                INSERT INTO translations_v1 (src_lang, tgt_lang, src_text, tgt_text)
+                SELECT src_lang, tgt_lang, src_text, tgt_text FROM (
+                    SELECT src_lang, tgt_lang, src_text, tgt_text, {legacy_order} AS row_order,
+                           ROW_NUMBER() OVER (PARTITION BY src_lang, tgt_lang, src_text ORDER BY {legacy_order} DESC) AS duplicate
+                    FROM translations
+                    WHERE src_lang IS NOT NULL AND tgt_lang IS NOT NULL
+                    AND src_text IS NOT NULL AND tgt_text IS NOT NULL
+                ) AS deduplicated
+                WHERE duplicate = 1
+                ORDER BY row_order
+                """)
+            connector.execute("DROP TABLE translations")
+            connector.execute("ALTER TABLE translations_v1 RENAME TO translations")
+        else:
+            self.init_table(connector)
+        connector.execute(self._fill_placeholder(
+            "CREATE UNIQUE INDEX IF NOT EXISTS translations_key ON translations (src_lang, tgt_lang, {src_key})"))
+
+    def _migrate_to_v2(self, connector, tables: list) -> None:
+        """
+        Adds the revision and origin of the last write of every row, so processes sharing the database
+        can poll for the changes made by others. Columns already there are kept, so the migration can be
+        repeated on a database repaired by hand.
+        """
+        columns = self._column_list(connector, "translations")
+        if "revision" not in columns:
+            connector.execute("ALTER TABLE translations ADD COLUMN revision BIGINT NOT NULL DEFAULT 0")
+        if "origin" not in columns:
+            connector.execute("ALTER TABLE translations ADD COLUMN origin TEXT NOT NULL DEFAULT ''")
+        connector.execute("UPDATE translations SET revision = id")
+        connector.execute("CREATE INDEX IF NOT EXISTS translations_revision ON translations (revision)")
+
+    def _migrate_to_v3(self, connector, tables: list) -> None:
+        """
+        Adds the glossary of fixed term translations, such as character, skill and item names.
+        """
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT" if self.db_config.db_type == "sqlite" else "id BIGSERIAL PRIMARY KEY"
+        connector.execute(f"""CREATE TABLE IF NOT EXISTS glossary (
+                            {id_column},
+                            src_lang TEXT NOT NULL,
+                            tgt_lang TEXT NOT NULL,
+                            src_term TEXT NOT NULL,
+                            tgt_term TEXT NOT NULL)
                            """)
-        cls.cursor.connection.commit()
-        
-    def save_translation(cls, src_lang:str, tgt_lang:str, src_text:str, tgt_text:str) -> None:
+        connector.execute("CREATE UNIQUE INDEX IF NOT EXISTS glossary_key ON glossary (src_lang, tgt_lang, src_term)")
+
+    def _migrate_to_v4(self, connector, tables: list) -> None:
+        """
+        Adds the session id of the last write of every row, so other processes add it to the history of that session only.
+        """
+        if "session_id" not in self._column_list(connector, "translations"):
+            connector.execute("ALTER TABLE translations ADD COLUMN session_id TEXT NOT NULL DEFAULT ''")
+
+    def _lock_revisions(self, connector) -> None:
+        """
+        Serializes the writes of Postgres transactions until they commit. SQLite serializes writers itself.
+        """
+        if self.pool is not None:
+            connector.execute("SELECT pg_advisory_xact_lock(%s)", (REVISION_LOCK,))
+
+    def save_translation(self, src_lang:str, tgt_lang:str, src_text:str, tgt_text:str, session_id: str = "") -> None:
+        with self.connection() as connector:
+            self._lock_revisions(connector)
+            connector.execute(self._fill_placeholder(UPSERT_QUERY), (src_lang, tgt_lang, src_text, tgt_text, self.origin, session_id))
+
+    def save_translations(self, records: list) -> None:
+        """
+        Upserts many translations in a single transaction.
+
+        Args:
+            records (list[TranslationRecord]): The translations to save.
+        """
+        with self.connection() as connector:
+            self._lock_revisions(connector)
+            connector.cursor().executemany(self._fill_placeholder(UPSERT_QUERY),
+                                           [(r.src_lang, r.tgt_lang, r.src_text, r.tgt_text, self.origin, r.session_id)
+                                            for r in records])
+
+    def import_translations(self, records: Iterable, overwrite: bool = False, chunk_size: int = 1000) -> int:
+        """
+        Bulk loads translations in transactions of chunk_size rows, keeping existing rows unless overwrite
+        is set. Postgres loads each chunk with COPY into a temporary table and merges it from there.
+
+        Args:
+            records (Iterable[TranslationRecord]): The translations to load, without duplicate keys.
+            overwrite (bool): Whether to replace the translation of rows that exist already.
+            chunk_size (int): Rows per transaction.
+
+        Returns:
+            int: The number of rows inserted or replaced.
+        """
+        written = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                written += self._import_chunk(chunk, overwrite)
+                chunk = []
+        if chunk:
+            written += self._import_chunk(chunk, overwrite)
+        return written
+
+    def _import_chunk(self, records: list, overwrite: bool) -> int:
+        rows = [(r.src_lang, r.tgt_lang, r.src_text, r.tgt_text) for r in records]
+        with self.connection() as connector:
+            if self.pool is None:
+                cursor = connector.cursor()
+                cursor.executemany(self._fill_placeholder(UPSERT_QUERY if overwrite else INSERT_IF_ABSENT_QUERY),
+                                   [row + (self.origin, "") for row in rows])
+                return cursor.rowcount
+            self._lock_revisions(connector)
+            connector.execute("""
+                CREATE TEMPORARY TABLE translations_import
+                (src_lang TEXT, tgt_lang TEXT, src_text TEXT, tgt_text TEXT) ON COMMIT DROP
+            """)
+            with connector.cursor().copy("COPY translations_import (src_lang, tgt_lang, src_text, tgt_text) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            conflict = ("DO UPDATE SET tgt_text = excluded.tgt_text, updated_at = {now}, "
+                        "origin = excluded.origin, session_id = excluded.session_id, revision = excluded.revision") if overwrite else "DO NOTHING"
+            return connector.execute(self._fill_placeholder(f"""
+                INSERT INTO translations (src_lang, tgt_lang, src_text, tgt_text, origin, session_id, revision)
+                SELECT src_lang, tgt_lang, src_text, tgt_text, {{placeholder}}, '', {{next_revision}} FROM translations_import
+                ON CONFLICT (src_lang, tgt_lang, {{src_key}})
+                {conflict}
+            """), (self.origin,)).rowcount
+
+    def import_glossary(self, records: Iterable, overwrite: bool = False, chunk_size: int = 1000) -> int:
+        """
+        Bulk loads glossary terms in transactions of chunk_size rows, keeping existing terms unless overwrite is set.
+
+        Args:
+            records (Iterable[TranslationRecord]): The terms to load, with the term in src_text and its translation in tgt_text.
+            overwrite (bool): Whether to replace the translation of terms that exist already.
+            chunk_size (int): Rows per transaction.
+
+        Returns:
+            int: The number of terms inserted or replaced.
+        """
+        query = self._fill_placeholder(GLOSSARY_UPSERT_QUERY if overwrite else GLOSSARY_INSERT_IF_ABSENT_QUERY)
+        written = 0
+        rows = [(r.src_lang, r.tgt_lang, r.src_text, r.tgt_text) for r in records]
+        for start in range(0, len(rows), chunk_size):
+            with self.connection() as connector:
+                cursor = connector.cursor()
+                cursor.executemany(query, rows[start:start + chunk_size])
+                written += cursor.rowcount
+        return written
+
+    def get_glossary(self) -> list:
+        """
+        Returns all glossary terms as TranslationRecords with the term in src_text and its translation in tgt_text.
+        """
+        with self.connection() as connector:
+            rows = connector.execute("SELECT src_lang, tgt_lang, src_term, tgt_term FROM glossary ORDER BY id").fetchall()
+        return [TranslationRecord(row[0], row[1], row[2], row[3]) for row in rows]
+
+    def get_language_pairs(self) -> list:
+        """
+        Returns the (src_lang, tgt_lang) pairs of the translations.
+        """
+        with self.connection() as connector:
+            rows = connector.execute("SELECT DISTINCT src_lang, tgt_lang FROM translations").fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def iter_translations(self, src_lang: str, tgt_lang: str, chunk_size: int = 1000) -> Iterator:
+        """
+        Yields the translations of a language pair oldest first, fetching chunk_size rows at a time so the
+        table is never loaded into memory. Postgres reads them through a server-side cursor.
+        """
         query = """
-                INSERT INTO translations
-                VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})
+                SELECT src_lang, tgt_lang, src_text, tgt_text FROM translations
+                WHERE src_lang = {placeholder}
+                AND tgt_lang = {placeholder}
+                ORDER BY {order_by}
                 """
-        cls.cursor.execute(cls._fill_placeholder(query), (src_lang, tgt_lang, src_text, tgt_text))
-        cls.connector.commit()
+        with self.connection() as connector:
+            cursor = connector.cursor() if self.pool is None else connector.cursor(name="translations_export")
+            cursor.execute(self._fill_placeholder(query), (src_lang, tgt_lang))
+            while rows := cursor.fetchmany(chunk_size):
+                for row in rows:
+                    yield TranslationRecord(row[0], row[1], row[2], row[3])
+            cursor.close()
 
-    def fetch_translation(cls, src_lang:str, tgt_lang:str, src_text:str) -> str:
+    def fetch_translation(self, src_lang:str, tgt_lang:str, src_text:str) -> str:
         query = """
-            SELECT tgt_text FROM translations 
+            SELECT tgt_text FROM translations
             WHERE src_lang = {placeholder}
-            AND tgt_lang = {placeholder} 
-            AND src_text = {placeholder}
+            AND tgt_lang = {placeholder}
+            AND {src_key} = {src_value}
         """
 
-        cls.cursor.execute(cls._fill_placeholder(query), (src_lang, tgt_lang, src_text))
-        result = cls.cursor.fetchone()
+        with self.connection() as connector:
+            result = connector.execute(self._fill_placeholder(query), (src_lang, tgt_lang, src_text)).fetchone()
         return result[0] if result else None
 
-    def delete_translation(cls, src_lang:str , tgt_lang:str, src_text:str) -> None:
+    def fetch_translations(self, src_lang: str, tgt_lang: str, src_texts: list) -> dict:
+        """
+        Looks up many texts of one language pair with one query per FETCH_CHUNK texts.
+
+        Returns:
+            dict: Translations by source text, for the texts that have one.
+        """
+        translations = {}
+        with self.connection() as connector:
+            for start in range(0, len(src_texts), FETCH_CHUNK):
+                chunk = src_texts[start:start + FETCH_CHUNK]
+                query = f"""
+                    SELECT src_text, tgt_text FROM translations
+                    WHERE src_lang = {{placeholder}}
+                    AND tgt_lang = {{placeholder}}
+                    AND {{src_key}} IN ({", ".join(["{src_value}"] * len(chunk))})
+                """
+                for src_text, tgt_text in connector.execute(self._fill_placeholder(query), (src_lang, tgt_lang, *chunk)).fetchall():
+                    translations[src_text] = tgt_text
+        return translations
+
+    def delete_translation(self, src_lang:str , tgt_lang:str, src_text:str) -> None:
         query = """
                 DELETE FROM translations
                 WHERE src_lang={placeholder}
                 AND tgt_lang={placeholder}
-                AND src_text={placeholder}
+                AND {src_key}={src_value}
                 """
 
-        cls.cursor.execute(cls._fill_placeholder(query), (src_lang, tgt_lang, src_text))
-        cls.connector.commit()
+        with self.connection() as connector:
+            connector.execute(self._fill_placeholder(query), (src_lang, tgt_lang, src_text))
 
-    def get_latest_translations(cls, src_lang: str, tgt_lang: str, index: int):
+    def get_latest_translations(self, src_lang: str, tgt_lang: str, index: int):
         query = """
-                SELECT * FROM translations 
-                WHERE src_lang = {placeholder} AND tgt_lang = {placeholder} 
-                ORDER BY {order_by} DESC 
+                SELECT src_lang, tgt_lang, src_text, tgt_text FROM translations
+                WHERE src_lang = {placeholder} AND tgt_lang = {placeholder}
+                ORDER BY {order_by} DESC
                 LIMIT {placeholder}
                 """
-                
-        cls.cursor.execute(cls._fill_placeholder(query), (src_lang, tgt_lang, index))
-        records = cls.cursor.fetchall()
+
+        with self.connection() as connector:
+            records = connector.execute(self._fill_placeholder(query), (src_lang, tgt_lang, index)).fetchall()
 
         return [TranslationRecord(record[0], record[1], record[2], record[3]) for record in records]
-    
-    @classmethod
-    def _fill_placeholder(cls, target_str: str):
-        match cls.db_config.db_type:
+
+    def get_recent_translations(self, index: int):
+        query = """
+                SELECT src_lang, tgt_lang, src_text, tgt_text FROM translations
+                ORDER BY {order_by} DESC
+                LIMIT {placeholder}
+                """
+
+        with self.connection() as connector:
+            records = connector.execute(self._fill_placeholder(query), (index,)).fetchall()
+
+        return [TranslationRecord(record[0], record[1], record[2], record[3]) for record in records]
+
+    def get_revision(self) -> int:
+        """
+        Returns the revision of the latest write.
+        """
+        with self.connection() as connector:
+            return connector.execute("SELECT COALESCE(MAX(revision), 0) FROM translations").fetchone()[0]
+
+    def get_changes(self, after_revision: int) -> list:
+        """
+        Returns the rows written after a revision, oldest first.
+
+        Returns:
+            list: (revision, origin, TranslationRecord) tuples.
+        """
+        query = """
+                SELECT revision, origin, src_lang, tgt_lang, src_text, tgt_text, session_id FROM translations
+                WHERE revision > {placeholder}
+                ORDER BY revision
+                """
+        with self.connection() as connector:
+            rows = connector.execute(self._fill_placeholder(query), (after_revision,)).fetchall()
+        return [(row[0], row[1], TranslationRecord(row[2], row[3], row[4], row[5], row[6])) for row in rows]
+
+    async def _run(self, func, *args):
+        """
+        Runs a blocking database call on a database thread so it doesn't block the event loop,
+        recording how long it waited for a free thread and how long it ran.
+        """
+        submitted = time.perf_counter()
+        timings = []
+
+        def timed():
+            timings.append(time.perf_counter())
+            try:
+                return func(*args)
+            finally:
+                timings.append(time.perf_counter())
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            if timings:
+                wait = timings[0] - submitted
+                self.waits += 1
+                self.wait_time += wait
+                self.max_wait_time = max(self.max_wait_time, wait)
+                self.busy_time += timings[-1] - timings[0]
+
+    async def asave_translation(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str, session_id: str = "") -> None:
+        await self._run(self.save_translation, src_lang, tgt_lang, src_text, tgt_text, session_id)
+
+    async def asave_translations(self, records: list) -> None:
+        await self._run(self.save_translations, records)
+
+    async def afetch_translation(self, src_lang: str, tgt_lang: str, src_text: str) -> str:
+        return await self._run(self.fetch_translation, src_lang, tgt_lang, src_text)
+
+    async def afetch_translations(self, src_lang: str, tgt_lang: str, src_texts: list) -> dict:
+        return await self._run(self.fetch_translations, src_lang, tgt_lang, src_texts)
+
+    async def adelete_translation(self, src_lang: str, tgt_lang: str, src_text: str) -> None:
+        await self._run(self.delete_translation, src_lang, tgt_lang, src_text)
+
+    async def aget_latest_translations(self, src_lang: str, tgt_lang: str, index: int):
+        return await self._run(self.get_latest_translations, src_lang, tgt_lang, index)
+
+    async def aget_revision(self) -> int:
+        return await self._run(self.get_revision)
+
+    async def aget_changes(self, after_revision: int) -> list:
+        return await self._run(self.get_changes, after_revision)
+
+    def stats(self) -> dict:
+        """
+        Returns how long calls waited for a database thread and ran on it and, on Postgres, the pool
+        statistics, which include the time spent waiting for a connection (requests_wait_ms).
+        """
+        stats = {"waits": self.waits,
+                 "wait_ms_total": round(self.wait_time * 1000, 3),
+                 "wait_ms_max": round(self.max_wait_time * 1000, 3),
+                 "busy_ms_total": round(self.busy_time * 1000, 3)}
+        if self.pool is not None:
+            stats["pool"] = self.pool.get_stats()
+        return stats
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        if self.pool is not None:
+            self.pool.close()
+
+    def _fill_placeholder(self, target_str: str):
+        match self.db_config.db_type:
             case "sqlite":
                 placeholder = "?"
-                order_by = "rowid"
+                src_key = "src_text"
+                src_value = "?"
+                now = "CURRENT_TIMESTAMP"
             case "postgres":
                 placeholder = "%s"
-                order_by = "ctid"
+                src_key = "md5(src_text)"
+                src_value = "md5(%s)"
+                now = "now()"
 
-        return target_str.format(placeholder=placeholder, order_by=order_by)
+        next_revision = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM translations)"
+        return target_str.format(placeholder=placeholder, order_by="id", src_key=src_key, src_value=src_value, now=now,
+                                 next_revision=next_revision)
 
 @dataclass
 class TranslationRecord:
     src_lang: str
     tgt_lang: str
     src_text: str
-    tgt_text: str
\ No newline at end of file
+    tgt_text: str
+    session_id: str = ""
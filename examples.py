@@ -0,0 +1,197 @@
+import heapq
+import logging
+import math
+from array import array
+from dataclasses import dataclass, field
+from operator import itemgetter
+
+from config import ExamplesConfig
+from db import DB
+from normalize import collapse_whitespace, is_template
+
+logger = logging.getLogger("xunity.examples")
+
+# BM25 parameters. Every n-gram counts once per text, so the length normalization of a text applies to its score as a whole.
+K1 = 1.2
+B = 0.75
+# Candidates per example, by the sum of their n-gram weights, that are ranked by their length-normalized score.
+RERANK = 4
+
+
+@dataclass
+class ExampleIndex:
+    """
+    A BM25 index over the character n-grams of the source texts of one language pair.
+
+    N-grams are hashed into a fixed number of buckets, each holding the ids of the texts containing
+    them in an array of 4-byte integers, so the index grows with the number of texts and not with
+    the vocabulary. A query scores the postings of its rarest n-grams first and stops after
+    max_postings postings, skipping n-grams so common that they hardly tell texts apart, and only the
+    best candidates are length-normalized and ranked.
+
+    Attributes:
+        ngram (int): Characters per n-gram.
+        buckets (int): Number of hash buckets of the n-grams, a power of two.
+        max_postings (int): Postings scored per query at most.
+        postings (dict): Per bucket, the ids of the texts containing an n-gram of the bucket.
+        sources (list): Source texts by id.
+        targets (list): Translations by id.
+        lengths (array): Number of distinct n-grams by id.
+        ids (dict): Ids by source text, so a translation saved again replaces the previous one.
+        total_length (int): Sum of lengths.
+    """
+    ngram: int = 2
+    buckets: int = 1 << 18
+    max_postings: int = 2000
+    postings: dict = field(default_factory=dict)
+    sources: list = field(default_factory=list)
+    targets: list = field(default_factory=list)
+    lengths: array = field(default_factory=lambda: array("H"))
+    ids: dict = field(default_factory=dict)
+    total_length: int = 0
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def grams(self, text: str) -> set:
+        """
+        Returns the buckets of the distinct n-grams of a case-folded text with collapsed whitespace.
+        """
+        text = collapse_whitespace(text).casefold()
+        mask = self.buckets - 1
+        if len(text) <= self.ngram:
+            return {hash(text) & mask} if text else set()
+        return {hash(text[start:start + self.ngram]) & mask for start in range(len(text) - self.ngram + 1)}
+
+    def add(self, src_text: str, tgt_text: str):
+        doc = self.ids.get(src_text)
+        if doc is not None:
+            self.targets[doc] = tgt_text
+            return
+        grams = self.grams(src_text)
+        if not grams:
+            return
+        doc = len(self.sources)
+        self.ids[src_text] = doc
+        self.sources.append(src_text)
+        self.targets.append(tgt_text)
+        self.lengths.append(min(len(grams), 0xFFFF))
+        self.total_length += len(grams)
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                self.postings[gram] = array("I", (doc,))
+            else:
+                postings.append(doc)
+
+    def idf(self, df: int) -> float:
+        return math.log(1 + (len(self.sources) - df + 0.5) / (df + 0.5))
+
+    def length_norm(self, length: int) -> float:
+        return (K1 + 1) / (1 + K1 * (1 - B) + K1 * B * length * len(self.sources) / self.total_length)
+
+    def search(self, text: str, k: int, min_similarity: float = 0.0) -> list:
+        """
+        Returns up to k (src_text, tgt_text) pairs of the texts most similar to a text, best first,
+        leaving out the text itself.
+
+        Args:
+            text (str): The text to find examples for.
+            k (int): Number of examples.
+            min_similarity (float): Minimum score of an example relative to the score the text would have itself, from 0 to 1.
+
+        Returns:
+            list: The examples.
+        """
+        count = len(self.sources)
+        grams = self.grams(text)
+        if not count or not grams or k <= 0:
+            return []
+        terms = sorted((len(postings), postings) for gram in grams if (postings := self.postings.get(gram)) is not None)
+        scores = {}
+        budget = self.max_postings
+        for df, postings in terms:
+            if df > budget:
+                break
+            budget -= df
+            idf = self.idf(df)
+            get = scores.get
+            for doc in postings:
+                scores[doc] = get(doc, 0.0) + idf
+        candidates = heapq.nlargest(RERANK * (k + 1), scores.items(), key=itemgetter(1))
+        best = heapq.nlargest(k + 1, ((score * self.length_norm(self.lengths[doc]), doc) for doc, score in candidates))
+        ideal = (sum(self.idf(df) for df, _ in terms) + self.idf(0) * (len(grams) - len(terms))) * self.length_norm(len(grams))
+        return [(self.sources[doc], self.targets[doc]) for score, doc in best
+                if score >= min_similarity * ideal and self.sources[doc] != text][:k]
+
+
+@dataclass
+class ExampleStore:
+    """
+    Past translations most similar to a text, sent with it as few-shot examples.
+
+    Every saved translation goes into the ExampleIndex of its language pair, loaded from the
+    translations table on startup, so each completion shows the model how texts like the one at
+    hand were translated before, rather than whatever was translated last.
+
+    Attributes:
+        config (ExamplesConfig): Example retrieval configuration.
+        indexes (dict): ExampleIndex per (src_lang, tgt_lang).
+        lookups (int): Texts examples were retrieved for.
+        examples_sent (int): Examples sent in prompts.
+    """
+    config: ExamplesConfig
+    indexes: dict = field(default_factory=dict)
+    lookups: int = 0
+    examples_sent: int = 0
+
+    @classmethod
+    def from_db(cls, config: ExamplesConfig, db: DB):
+        """
+        Create an ExampleStore indexing the translations table.
+        """
+        store = cls(config=config)
+        if config.use_examples:
+            for src_lang, tgt_lang in db.get_language_pairs():
+                index = store.index(src_lang, tgt_lang)
+                for record in db.iter_translations(src_lang, tgt_lang):
+                    if not is_template(record.src_text):
+                        index.add(record.src_text, record.tgt_text)
+                logger.info("Examples indexed", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang,
+                                                                  "records": len(index), "buckets": len(index.postings)}})
+        return store
+
+    def index(self, src_lang: str, tgt_lang: str) -> ExampleIndex:
+        index = self.indexes.get((src_lang, tgt_lang))
+        if index is None:
+            index = ExampleIndex(ngram=self.config.ngram, buckets=1 << self.config.bucket_bits,
+                                 max_postings=self.config.max_postings)
+            self.indexes[(src_lang, tgt_lang)] = index
+        return index
+
+    def add(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str):
+        if self.config.use_examples and src_text and tgt_text and not is_template(src_text):
+            self.index(src_lang, tgt_lang).add(src_text, tgt_text)
+
+    def search(self, src_lang: str, tgt_lang: str, texts: list) -> list:
+        """
+        Returns the (src_text, tgt_text) examples for texts, the best ones of each text in turn and at most
+        max_examples of them.
+        """
+        index = self.indexes.get((src_lang, tgt_lang)) if self.config.use_examples else None
+        if index is None or self.config.max_examples <= 0:
+            return []
+        self.lookups += len(texts)
+        per_text = [index.search(text, self.config.max_examples, self.config.min_similarity) for text in texts]
+        examples = {}
+        for rank in range(self.config.max_examples):
+            for found in per_text:
+                if rank < len(found) and found[rank][0] not in texts:
+                    examples.setdefault(found[rank][0], found[rank][1])
+        examples = list(examples.items())[:self.config.max_examples]
+        self.examples_sent += len(examples)
+        return examples
+
+    def stats(self) -> dict:
+        return {"indexed": sum(len(index) for index in self.indexes.values()), "lookups": self.lookups,
+                "examples_sent": self.examples_sent}
@@ -0,0 +1,190 @@
+import logging
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config import GlossaryConfig
+from db import DB
+from passthrough import SCRIPT_CHARS
+
+logger = logging.getLogger("xunity.glossary")
+
+# Scripts written without spaces between words, or with particles attached to them, whose terms match
+# anywhere in a text.
+UNSPACED_SCRIPTS = ("thai", "hangul", "hiragana", "katakana", "han")
+UNSPACED_REGEX = re.compile("[" + "".join(SCRIPT_CHARS[script] for script in UNSPACED_SCRIPTS) + "]")
+
+
+def is_word_char(char: str) -> bool:
+    """
+    Whether a character belongs to a word of a script written with spaces, so a term can't start or end next to it.
+    """
+    return char.isalnum() and not UNSPACED_REGEX.match(char)
+
+
+@dataclass
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton finding every occurrence of a set of terms in one pass over a text.
+
+    A term starting or ending with a word character only matches at a word boundary there, so "ash"
+    isn't found in "wash" or "ashes". Terms in scripts written without spaces match anywhere.
+
+    Attributes:
+        terms (list): The terms, matched by their index.
+        goto (list): Per state, the next state by character.
+        fail (list): Per state, the state of the longest proper suffix that is also a prefix of a term.
+        output (list): Per state, the indexes of the terms ending there, longest first.
+    """
+    terms: list
+    goto: list = field(default_factory=lambda: [{}])
+    fail: list = field(default_factory=lambda: [0])
+    output: list = field(default_factory=lambda: [[]])
+
+    def __post_init__(self):
+        for index, term in enumerate(self.terms):
+            state = 0
+            for char in term:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(index)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text: str) -> list:
+        """
+        Returns the non-overlapping occurrences of the terms in a text, preferring the leftmost and then the
+        longest term, as (start, term index) pairs.
+
+        >>> AhoCorasick(["ash", "ポーション"]).find("wash the ashes, ash and ポーションを")
+        [(16, 0), (24, 1)]
+        """
+        matches = []
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for index in self.output[state]:
+                term = self.terms[index]
+                start = end - len(term)
+                if is_word_char(term[0]) and start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if is_word_char(term[-1]) and end < len(text) and is_word_char(text[end]):
+                    continue
+                matches.append((start, -len(term), index))
+        matches.sort()
+        found = []
+        covered = 0
+        for start, negative_length, index in matches:
+            if start >= covered:
+                found.append((start, index))
+                covered = start - negative_length
+        return found
+
+
+@dataclass
+class Glossary:
+    """
+    Fixed translations of terms such as character, skill and item names, per language pair.
+
+    The terms of each language pair are compiled into an Aho-Corasick automaton over their case-folded
+    form, so a text is scanned for all terms in time linear in its length. Only the terms found in a
+    text are sent with it. A text that is a term as a whole, compared case-folded as well, is answered
+    with its translation.
+
+    Attributes:
+        config (GlossaryConfig): Glossary configuration.
+        terms (dict): Per (src_lang, tgt_lang), translations by term.
+        folded (dict): Per (src_lang, tgt_lang), (term, translation) pairs by case-folded term.
+        automata (dict): Per (src_lang, tgt_lang), the automaton and the (term, translation) pairs it matches.
+        exact_hits (int): Texts answered with the translation of a term.
+        prompts (int): Prompts sent with glossary terms.
+        terms_sent (int): Glossary terms sent in prompts.
+    """
+    config: GlossaryConfig
+    terms: dict = field(default_factory=dict)
+    folded: dict = field(default_factory=dict)
+    automata: dict = field(default_factory=dict)
+    exact_hits: int = 0
+    prompts: int = 0
+    terms_sent: int = 0
+
+    @classmethod
+    def from_db(cls, config: GlossaryConfig, db: DB):
+        """
+        Create a Glossary of the terms in the glossary table.
+        """
+        glossary = cls(config=config)
+        if config.use_glossary:
+            glossary.add(db.get_glossary())
+            if glossary.terms:
+                logger.info("Glossary loaded", extra={"fields": {"pairs": len(glossary.terms),
+                                                                 "terms": sum(len(terms) for terms in glossary.terms.values())}})
+        return glossary
+
+    def add(self, records: list):
+        """
+        Adds terms, given as TranslationRecords with the term in src_text, and recompiles the language pairs they belong to.
+        """
+        pairs = set()
+        for record in records:
+            if record.src_text:
+                self.terms.setdefault((record.src_lang, record.tgt_lang), {})[record.src_text] = record.tgt_text
+                pairs.add((record.src_lang, record.tgt_lang))
+        for pair in pairs:
+            folded = {}
+            for term, translation in self.terms[pair].items():
+                folded.setdefault(term.casefold(), (term, translation))
+            self.folded[pair] = folded
+            self.automata[pair] = (AhoCorasick(list(folded)), list(folded.values()))
+
+    def lookup(self, src_lang: str, tgt_lang: str, text: str) -> Optional[str]:
+        """
+        Returns the translation of a text that is a glossary term as a whole, or None.
+        """
+        if not self.config.use_glossary:
+            return None
+        found = self.folded.get((src_lang, tgt_lang), {}).get(text.casefold())
+        if found is None:
+            return None
+        self.exact_hits += 1
+        return found[1]
+
+    def match(self, src_lang: str, tgt_lang: str, texts: list) -> list:
+        """
+        Returns the (term, translation) pairs of the glossary terms found in texts, in order of first
+        occurrence and at most max_terms of them.
+        """
+        automaton = self.automata.get((src_lang, tgt_lang)) if self.config.use_glossary else None
+        if automaton is None:
+            return []
+        automaton, pairs = automaton
+        found = {}
+        for text in texts:
+            for _, index in automaton.find(text.casefold()):
+                found.setdefault(index, pairs[index])
+        terms = list(found.values())[:self.config.max_terms]
+        if terms:
+            self.prompts += 1
+            self.terms_sent += len(terms)
+        return terms
+
+    def stats(self) -> dict:
+        return {"terms": sum(len(terms) for terms in self.terms.values()), "exact_hits": self.exact_hits,
+                "prompts": self.prompts, "terms_sent": self.terms_sent}
@@ -0,0 +1,103 @@
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LoggingConfig
+
+# Id of the request being handled, attached to every record logged while handling it.
+request_id: ContextVar[str] = ContextVar("request_id", default="")
+
+# Logger of the per-request text logs (original, translated and raw completion), which are sampled.
+TRANSLATION_LOGGER = "xunity.translation"
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records with the request id of the current context. Runs in the logging thread of the
+    caller, before the record is handed to the background writer.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through the records of a share of the requests, so text logs of every request don't dominate
+    the output. The decision is derived from the request id, so a sampled request keeps all of its records.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0:
+            return True
+        rid = request_id.get()
+        if not rid:
+            return random.random() < self.rate
+        return zlib.crc32(rid.encode()) % 10000 < self.rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Structured fields are passed as extra={"fields": {...}}.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "msg": record.getMessage()}
+        if getattr(record, "request_id", ""):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(logging_config: LoggingConfig) -> QueueListener:
+    """
+    Routes the application logs through a queue to a background thread that writes them as JSON lines
+    to stdout and, if configured, to the log file, so request handlers never block on log output.
+
+    Args:
+        logging_config (LoggingConfig): Logging configuration.
+
+    Returns:
+        QueueListener: The started background writer, to be stopped on shutdown to flush the queue.
+    """
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if logging_config.log_file:
+        handlers.append(logging.FileHandler(logging_config.log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger("xunity")
+    root.handlers = [queue_handler]
+    root.setLevel(logging_config.log_level or "INFO")
+    root.propagate = False
+    translation_logger = logging.getLogger(TRANSLATION_LOGGER)
+    translation_logger.filters = [SamplingFilter(logging_config.text_log_sample_rate)]
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
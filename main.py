@@ -1,98 +1,192 @@
-from fastapi import FastAPI, Query
-from fastapi.responses import PlainTextResponse
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import APIRouter, Body, FastAPI, Header, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
 import uvicorn
 
 from config import Config, parse_args
-from openai_client import LLMClient
 from db import DB
+from log import new_request_id, request_id, setup_logging
+from metrics import REQUEST_SECONDS, REQUESTS, CacheHitRatioCollector, format_server_timing, server_timings
+from resilience import UpstreamError
+from translator import Translator
+
+
+def load_config() -> Config:
+    """
+    Load the configuration from the TOML file given with --config, or from the command line arguments.
+    """
+    args = parse_args()
+    if args.config:
+        return Config.from_toml(args.config)
+    return Config.from_args(args)
+
+
+def create_app(config: Optional[Config] = None) -> FastAPI:
+    """
+    Create the proxy application. Every worker process calls this once, and builds its own translation
+    pipeline, database connections and upstream clients on startup.
+
+    Args:
+        config (Optional[Config]): Application configuration. Loaded from the command line if None.
+
+    Returns:
+        FastAPI: The proxy application.
+    """
+    if config is None:
+        config = load_config()
+    log_listener = setup_logging(config.logging_config)
 
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        translator = Translator.from_config(config)
+        collector = CacheHitRatioCollector()
+        REGISTRY.register(collector)
+        app.state.translator = translator
+        await translator.start()
+        yield
+        await translator.close()
+        REGISTRY.unregister(collector)
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            multiprocess.mark_process_dead(os.getpid())
+        log_listener.stop()
 
-proxy_server = FastAPI()
-args = parse_args()
-if args.config:
-    config = Config.from_toml(args.config)
-else:
-    config = Config.from_args(args)
-client = LLMClient.from_config(config)
-db = DB.from_config(config.database_config)
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(timing_middleware)
+    app.exception_handler(UpstreamError)(upstream_error_handler)
+    app.include_router(router)
+    return app
 
-@proxy_server.get("/translate", response_class=PlainTextResponse)
+
+router = APIRouter()
+
+async def timing_middleware(request: Request, call_next):
+    """
+    Record the latency of every request and report the pipeline stages it went through
+    in the Server-Timing header, unless its body is streamed. The request id, taken from the X-Request-Id header or generated,
+    is attached to the logs of the request and returned in the same header.
+    """
+    start = time.perf_counter()
+    timings = []
+    rid = request.headers.get("X-Request-Id") or new_request_id()
+    timing_token = server_timings.set(timings)
+    rid_token = request_id.set(rid)
+    try:
+        response = await call_next(request)
+    finally:
+        server_timings.reset(timing_token)
+        request_id.reset(rid_token)
+    elapsed = time.perf_counter() - start
+    # Label by route template, so paths no route matched can't grow the label set without bound.
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.labels(path).observe(elapsed)
+    REQUESTS.labels(path, str(response.status_code)).inc()
+    # The headers of a streamed body go out before it is produced, so its stages can't be reported.
+    if "content-length" in response.headers:
+        response.headers["Server-Timing"] = format_server_timing(timings + [("total", elapsed)])
+    response.headers["X-Request-Id"] = rid
+    return response
+
+async def upstream_error_handler(request: Request, error: UpstreamError):
+    """
+    Answer 503 when no translation could be obtained from the upstream API, with Retry-After if it is known,
+    so clients retry later instead of showing an error as the translation.
+    """
+    headers = {"Retry-After": str(max(1, round(error.retry_after)))} if error.retry_after is not None else None
+    return PlainTextResponse(str(error), status_code=503, headers=headers)
+
+@router.get("/translate", response_class=PlainTextResponse)
 async def translation_handler(
+    request: Request,
     text: str,
     tgt_lang: str = Query(..., alias="to"),
-    src_lang: str = Query(..., alias="from")
+    src_lang: str = Query(..., alias="from"),
+    session_id: str = Query("", alias="session"),
+    session_header: str = Header("", alias="X-Session-Id")
 ):
     """
     Handle translation requests between specified languages.
 
     This function translates a piece of text from a source language to a target language.
-    It checks if the current chat history's source and target languages differ from the provided
-    ones and updates them if necessary. Then, it sends a completion request to the language model
-    client and returns the translated text.
+    Each language pair and optional session id gets its own chat history, so clients using
+    different pairs against one server don't reset each other's context. Database and completion
+    calls are awaited, so other requests keep being served while a completion is outstanding.
 
     Args:
         to (str): The target language code.
         text (str): The text to be translated.
         from (str): The source language code.
+        session (str): Optional session id, also accepted as the X-Session-Id header.
 
     Returns:
         str: The translated text.
     """
-    if "" in [client.chat_history.src_lang, client.chat_history.tgt_lang] or client.chat_history.src_lang != src_lang or client.chat_history.tgt_lang != tgt_lang:
-        client.reset_history()
-        client.set_language_targets(src_lang, tgt_lang)
-        if client.config.database_config.use_latest_records:
-            translation_records = db.get_latest_translations(src_lang, tgt_lang, client.config.database_config.init_latest_records)
-            if translation_records:
-                client.apply_latest_translations(translation_records)
-                print("Latest translation Applied.")
-    client.chat_history.add_user_content(client.prompt.template.get_src_filled_prompt(text))
-    if client.config.database_config.use_cached_translation:
-        translated_text = db.fetch_translation(src_lang, tgt_lang, text)
-        if translated_text:
-            print("Got cached translation!")
-            completion_res = f"{client.prompt.template.tag.tgt_start}{translated_text}{client.prompt.template.tag.tgt_end}"
-        else:
-            completion_res = client.request_completion()
-    else:
-        completion_res = client.request_completion()
-    if client.config.history_config.use_history:
-        client.chat_history.add_assistant_content(completion_res)
-        if client.config.history_config.max_history > -1 :
-            if len(client.chat_history.chat_history)-(1+(1 if client.prompt.system_prompt.use_system_prompt else 0)) >= client.config.history_config.max_history:
-                if client.config.history_config.use_latest_history:
-                    chat_history = client.chat_history.chat_history[2+(1 if client.prompt.system_prompt.use_system_prompt else 0):]
-                    client.reset_history()
-                    client.set_language_targets(src_lang, tgt_lang)
-                    for turn in chat_history:
-                        client.chat_history.add_message(turn['role'], turn['content'])
-                else:
-                    client.chat_history.delete_latest_turns(2)
-    else:
-        client.set_language_targets("","")
-    translated_text = client.prompt.template.get_translated_text(completion_res)
-    if client.config.database_config.cache_translation:
-        if not db.fetch_translation(src_lang, tgt_lang, text):
-            db.save_translation(src_lang, tgt_lang, text, translated_text)
-    print(f"Original: {text}\nTranslated: {translated_text}")
-    return translated_text
+    translator = request.app.state.translator
+    return await translator.translate(src_lang, tgt_lang, text, session_id or session_header)
+
+@router.post("/translate/batch")
+async def batch_translation_handler(
+    request: Request,
+    texts: list[str] = Body(...),
+    tgt_lang: str = Query(..., alias="to"),
+    src_lang: str = Query(..., alias="from"),
+    session_id: str = Query("", alias="session"),
+    session_header: str = Header("", alias="X-Session-Id")
+):
+    """
+    Handle bulk translation requests for one language pair.
+
+    The body is a JSON array of texts. Cached translations are looked up in bulk and the distinct
+    cache misses are translated concurrently, so a whole text dump can be sent in one request.
+
+    Args:
+        texts (list[str]): The texts to be translated.
+        to (str): The target language code.
+        from (str): The source language code.
+        session (str): Optional session id, also accepted as the X-Session-Id header.
 
-@proxy_server.get("/reset")
-async def reset_handler():
+    Returns:
+        StreamingResponse: One JSON object per line (NDJSON) in the order of the texts, with the index,
+        the text and either its translation or the error translating it.
+    """
+    translator = request.app.state.translator
+
+    async def lines():
+        index = 0
+        async for text, result in translator.translate_many(src_lang, tgt_lang, texts, session_id or session_header):
+            line = {"index": index, "text": text}
+            if isinstance(result, Exception):
+                line["error"] = str(result)
+            else:
+                line["translation"] = result
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+            index += 1
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/reset")
+async def reset_handler(request: Request):
     """
     Reset the chat history.
 
-    This function resets the chat history to its initial state, optionally using the system prompt
-    based on the configuration.
+    This function drops every session, so the next request of each language pair starts
+    from a fresh chat history.
 
     Returns:
         str: A success message indicating that the reset was successful.
     """
-    client.reset_history()
+    request.app.state.translator.sessions.clear()
     return "Reset successful"
 
 
-@proxy_server.get("/status")
+@router.get("/status")
 async def status_handler():
     """
     Get the status of the server.
@@ -105,5 +199,63 @@ async def status_handler():
     return "Server is running"
 
 
+@router.get("/stats")
+async def stats_handler(request: Request):
+    """
+    Get the counters of the translation pipeline.
+
+    Returns:
+        dict: Counters of the in-flight request coalescing, where calls is the number of
+        translations requested and coalesced the number of requests that shared one, of the
+        batching stage, of the in-memory translation cache, of the database connections, of the
+        upstream attempts, retries, failures and circuit breaker state, of streamed completions, of the
+        texts returned as they are because they need no translation, of the glossary, of the few-shot
+        examples, and of the translations followed from other workers.
+    """
+    translator = request.app.state.translator
+    return {"inflight": translator.inflight.stats(),
+            "upstream": translator.client.stats(),
+            "rate_limit": translator.client.limiter.stats(),
+            "stream": translator.client.stream_stats,
+            "passthrough": translator.passthrough.stats(),
+            "glossary": translator.glossary.stats(),
+            "examples": translator.examples.stats(),
+            "batch": translator.batcher.stats(),
+            "cache": translator.cache.stats(),
+            "db": translator.db.stats(),
+            "sync": translator.sync.stats() if translator.sync is not None else None}
+
+
+@router.get("/metrics")
+async def metrics_handler():
+    """
+    Get the metrics of the translation pipeline in the Prometheus text format.
+
+    Returns:
+        Response: Request and stage latency histograms, cache lookups and hit ratio, upstream
+        completions in flight, upstream token usage and history length per session.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(CacheHitRatioCollector())
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
-    uvicorn.run(proxy_server, host=config.server_config.host, port=config.server_config.port)
\ No newline at end of file
+    config = load_config()
+    server_config = config.server_config
+    if server_config.workers > 1:
+        # Migrate the schema once before the workers start, instead of in every worker at the same time.
+        log_listener = setup_logging(config.logging_config)
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            logging.getLogger("xunity.server").warning(
+                "PROMETHEUS_MULTIPROC_DIR is not set, so /metrics only reports the worker that answers the scrape",
+                extra={"fields": {"workers": server_config.workers}})
+        DB.from_config(config.database_config).close()
+        log_listener.stop()
+        uvicorn.run("main:create_app", factory=True, workers=server_config.workers,
+                    host=server_config.host, port=server_config.port)
+    else:
+        uvicorn.run(create_app(config), host=server_config.host, port=server_config.port)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+REQUESTS = Counter("xunity_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("xunity_request_seconds", "HTTP request latency by endpoint", ["endpoint"])
+STAGE_SECONDS = Histogram("xunity_stage_seconds", "Latency of the translation pipeline stages", ["stage"],
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+CACHE_LOOKUPS = Counter("xunity_cache_lookups_total", "Translation cache lookups by result", ["result"])
+UPSTREAM_IN_FLIGHT = Gauge("xunity_upstream_in_flight", "Completions currently requested from the upstream API",
+                           multiprocess_mode="livesum")
+UPSTREAM_ATTEMPTS = Counter("xunity_upstream_attempts_total",
+                            "Upstream completion attempts by result: ok, retry, error or rejected by the circuit breaker",
+                            ["result"])
+RATE_LIMIT_QUEUE_DEPTH = Gauge("xunity_rate_limit_queue_depth", "Completions waiting for the RPM/TPM limits", ["priority"],
+                               multiprocess_mode="livesum")
+RATE_LIMIT_WAIT_SECONDS = Histogram("xunity_rate_limit_wait_seconds", "Time completions waited for the RPM/TPM limits",
+                                    ["priority"], buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+BACKEND_OUTSTANDING = Gauge("xunity_backend_outstanding", "Completions outstanding per backend", ["backend"],
+                            multiprocess_mode="livesum")
+HEDGED_REQUESTS = Counter("xunity_hedged_requests_total", "Hedged completions sent to a second backend, and won by it",
+                          ["result"])
+PASSTHROUGH = Counter("xunity_passthrough_total", "Texts returned without a completion because they need no translation, by reason",
+                      ["reason"])
+UPSTREAM_TOKENS = Counter("xunity_upstream_tokens_total", "Tokens reported in the usage of upstream completions", ["kind"])
+# A session can be open in several workers, each with its own history; the longest one is reported.
+SESSION_HISTORY_TURNS = Gauge("xunity_session_history_turns", "History turns per session", ["src_lang", "tgt_lang", "session"],
+                              multiprocess_mode="livemax")
+SESSION_HISTORY_TOKENS = Gauge("xunity_session_history_tokens", "Estimated history tokens per session",
+                               ["src_lang", "tgt_lang", "session"], multiprocess_mode="livemax")
+
+# Totals of CACHE_LOOKUPS, kept as plain ints for the hit ratio computed at scrape time.
+cache_lookups = {"hit": 0, "miss": 0}
+
+# Stage timings of the current request, rendered as its Server-Timing header.
+server_timings: ContextVar[list] = ContextVar("server_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage into the stage histogram and the Server-Timing header of the current request.
+
+    Args:
+        name (str): The stage name, e.g. cache, history, upstream, extract or save.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        timings = server_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def record_cache_lookup(hit: bool):
+    result = "hit" if hit else "miss"
+    cache_lookups[result] += 1
+    CACHE_LOOKUPS.labels(result).inc()
+
+
+def record_history(session):
+    """
+    Sets the history gauges of a session after its history changed.
+    """
+    labels = (session.src_lang, session.tgt_lang, session.session_id)
+    SESSION_HISTORY_TURNS.labels(*labels).set(len(session.chat_history.turns))
+    SESSION_HISTORY_TOKENS.labels(*labels).set(session.chat_history.token_count)
+
+
+def forget_history(session):
+    """
+    Drops the history gauges of a session that was closed. In multiprocess mode its series stay at 0
+    until the worker exits, since values written to the shared files can't be removed.
+    """
+    labels = (session.src_lang, session.tgt_lang, session.session_id)
+    for gauge in (SESSION_HISTORY_TURNS, SESSION_HISTORY_TOKENS):
+        gauge.labels(*labels).set(0)
+        gauge.remove(*labels)
+
+
+def cache_lookup_totals() -> dict:
+    """
+    Returns the cache lookups by result, of all workers in multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return cache_lookups
+    totals = {"hit": 0, "miss": 0}
+    for metric in multiprocess.MultiProcessCollector(None).collect():
+        if metric.name == "xunity_cache_lookups":
+            for sample in metric.samples:
+                if sample.name == "xunity_cache_lookups_total":
+                    totals[sample.labels["result"]] += sample.value
+    return totals
+
+
+def record_usage(usage):
+    """
+    Counts the tokens of a completion usage object, including prompt tokens served from the provider's cache.
+    """
+    if usage is None:
+        return
+    UPSTREAM_TOKENS.labels("prompt").inc(usage.prompt_tokens or 0)
+    UPSTREAM_TOKENS.labels("completion").inc(usage.completion_tokens or 0)
+    cached = cached_tokens(usage)
+    if cached:
+        UPSTREAM_TOKENS.labels("cached_prompt").inc(cached)
+
+
+def cached_tokens(usage) -> int:
+    """
+    Returns the prompt tokens of a completion usage object served from the provider's prompt or prefix cache.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def format_server_timing(timings: list) -> str:
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in timings)
+
+
+class CacheHitRatioCollector:
+    """
+    Collects the cache hit ratio at scrape time, over all workers in multiprocess mode.
+    """
+
+    def collect(self):
+        totals = cache_lookup_totals()
+        hits, misses = totals["hit"], totals["miss"]
+        hit_ratio = GaugeMetricFamily("xunity_cache_hit_ratio", "Share of translation cache lookups that were hits")
+        hit_ratio.add_metric([], hits / (hits + misses) if hits + misses else 0.0)
+        yield hit_ratio
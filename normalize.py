@@ -0,0 +1,83 @@
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Slots are written with private use characters, which don't occur in game text.
+SLOT_START = "\ue000"
+SLOT_END = "\ue001"
+
+RICH_TEXT_TAGS = ("align", "alpha", "b", "color", "cspace", "font", "i", "indent", "line-height", "link", "lowercase",
+                  "margin", "mark", "material", "nobr", "noparse", "pos", "quad", "rotate", "s", "size", "smallcaps",
+                  "space", "sprite", "strikethrough", "style", "sub", "sup", "u", "uppercase", "voffset", "width")
+
+# Unity rich-text tags, XUnity placeholders ({{A}}, [[A]], {0}) and numbers, in order of precedence.
+VALUE_REGEX = re.compile(
+    r"</?(?:" + "|".join(re.escape(tag) for tag in RICH_TEXT_TAGS) + r")(?:[= ][^<>]*)?>"
+    r"|\{\{[A-Z]+\}\}|\[\[[A-Z]+\]\]|\{\d+\}"
+    r"|\d+(?:[.,]\d+)*",
+    re.IGNORECASE)
+WHITESPACE_REGEX = re.compile(r"[ \t\u3000]+")
+SLOT_REGEX = re.compile(f"{SLOT_START}(\\d+){SLOT_END}")
+
+
+def collapse_whitespace(text: str) -> str:
+    """
+    Collapses runs of spaces and tabs and strips every line, keeping the line breaks.
+    """
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\n".join(WHITESPACE_REGEX.sub(" ", line).strip() for line in lines).strip("\n")
+
+
+def is_template(text: str) -> bool:
+    return SLOT_START in text
+
+
+@dataclass
+class TextTemplate:
+    """
+    A text whose numbers, rich-text tags and placeholders are lifted out into numbered slots, so texts
+    that only differ in those, or in whitespace, share one cache entry.
+
+    Attributes:
+        text (str): The templated text, with the whitespace of the original.
+        key (str): The templated text with collapsed whitespace, used as the cache key.
+        values (list): The lifted values, by slot number.
+    """
+    text: str
+    key: str
+    values: list = field(default_factory=list)
+
+    @classmethod
+    def from_text(cls, text: str):
+        values = []
+
+        def lift(match: re.Match) -> str:
+            values.append(match.group(0))
+            return f"{SLOT_START}{len(values) - 1}{SLOT_END}"
+
+        text = VALUE_REGEX.sub(lift, text)
+        return cls(text=text, key=collapse_whitespace(text), values=values)
+
+    def extract(self, translated_text: str) -> Optional[str]:
+        """
+        Turns the translation of the original text into the translation of the template, by replacing the
+        lifted values in it with their slots.
+
+        Returns:
+            Optional[str]: The templated translation, or None if the values can't be mapped to slots
+            unambiguously, e.g. because the translation spells a number out or a value repeats.
+        """
+        if is_template(translated_text) or len(set(self.values)) != len(self.values):
+            return None
+        translated = TextTemplate.from_text(translated_text)
+        if sorted(translated.values) != sorted(self.values):
+            return None
+        slots = {value: index for index, value in enumerate(self.values)}
+        return SLOT_REGEX.sub(lambda match: f"{SLOT_START}{slots[translated.values[int(match.group(1))]]}{SLOT_END}",
+                              translated.text)
+
+    def fill(self, templated_text: str) -> str:
+        """
+        Re-inserts the values of this text into a templated translation.
+        """
+        return SLOT_REGEX.sub(lambda match: self.values[int(match.group(1))], templated_text)
@@ -1,9 +1,18 @@
-from openai import OpenAI
+import asyncio
+import logging
+import time
+from backends import Backend, BackendPool
 from config import Config
+from metrics import UPSTREAM_ATTEMPTS, UPSTREAM_IN_FLIGHT, cached_tokens, record_usage
 from prompt import Prompt
-from chat_history import ChatHistory
-from db import TranslationRecord
+from rate_limit import Priority, RateLimiter
+from resilience import CircuitBreaker, UpstreamError, backoff, is_retryable, retry_after
 from dataclasses import dataclass, field
+from typing import Optional
+
+from tokens import estimate_tokens
+
+logger = logging.getLogger("xunity.openai")
 
 @dataclass
 class LLMClient:
@@ -13,12 +22,26 @@ class LLMClient:
     Args:
         config (Config): Configuration settings for the client including OpenAI API and model configurations.
         prompt (Prompt): The prompt to be used for interactions with the language model.
-        chat_history (ChatHistory): The history of the chat between the user and the language model. Defaults to an empty ChatHistory.
+        backends (BackendPool): The OpenAI-compatible endpoints completions are spread over.
+        stream_stats (dict): Totals of the streamed completions: seconds to the first token, number of
+            completions cut off at the end tag and seconds to the end tag of those.
+        breaker (CircuitBreaker): Fails requests fast while the upstream API is down.
+        upstream_stats (dict): Totals of the upstream requests: attempts, retries and requests that failed.
+        token_stats (dict): Totals of the usage reported for answered completions: prompt tokens, prompt
+            tokens served from the upstream prompt cache and completion tokens.
+        limiter (RateLimiter): Queues completions to stay within the RPM/TPM limits of the API.
+        draining (set): Tasks reading streamed completions cut off at the end tag to their final usage
+            chunk, with stream_usage.
     """
     config: Config
-    client: OpenAI = field(init=False)
+    backends: BackendPool = field(init=False)
     prompt: Prompt
-    chat_history: ChatHistory = field(default_factory=ChatHistory)
+    stream_stats: dict = field(default_factory=lambda: {"requests": 0, "first_token_s": 0.0, "cut_off": 0, "end_tag_s": 0.0})
+    breaker: CircuitBreaker = field(init=False)
+    upstream_stats: dict = field(default_factory=lambda: {"attempts": 0, "retries": 0, "failures": 0})
+    token_stats: dict = field(default_factory=lambda: {"prompt": 0, "cached_prompt": 0, "completion": 0})
+    limiter: RateLimiter = field(init=False)
+    draining: set = field(default_factory=set)
 
     @classmethod
     def from_config(cls, config: Config):
@@ -36,57 +59,215 @@ class LLMClient:
     
     def __post_init__(self):
         """
-        Initializes the OpenAI client and sets up the system and task prompts in the chat history.
+        Initializes the OpenAI clients of the backends. Retries are done by request_completion, so the clients don't retry themselves.
         """
-        self.client = OpenAI(base_url=self.config.openai_config.base_url,
-                             api_key=self.config.openai_config.api_key)
-        self.chat_history.set_system_prompt(self.prompt.system_prompt.system_prompt)
-        self.chat_history.set_task_prompt(self.prompt.template.task_template)
+        openai_config = self.config.openai_config
+        self.backends = BackendPool.from_config(openai_config)
+        self.breaker = CircuitBreaker(failure_threshold=openai_config.breaker_failures,
+                                      reset_timeout=openai_config.breaker_reset)
+        self.limiter = RateLimiter(rpm=self.config.rate_limit_config.rpm, tpm=self.config.rate_limit_config.tpm)
 
-    def request_completion(self):
+    async def request_completion(self, messages: list, stop_at: Optional[str] = None,
+                                 prompt_tokens: Optional[int] = None, priority: Priority = Priority.TEXT):
         """
-        Requests a completion from the language model based on the chat history.
+        Requests a completion from the language model based on a session's chat history.
+
+        With streaming enabled the completion is read incrementally, and the upstream stream is
+        closed as soon as stop_at appears instead of letting the model keep generating.
+
+        Every attempt is limited to request_timeout seconds. Timeouts, connection errors, 429 and 5xx
+        responses are retried up to max_retries times after the delay of their Retry-After header, or a
+        jittered exponential backoff, as long as request_deadline isn't exceeded. Failed attempts count
+        towards the circuit breaker, which rejects requests while it is open.
+
+        With RPM/TPM limits configured, every attempt first waits its turn in the rate limiter queue,
+        by priority. Its tokens are estimated as the prompt tokens plus as many completion tokens as
+        the last message has, and corrected with the usage of the completion, or for streamed
+        completions without stream_usage with the estimated tokens of the content read.
+
+        Args:
+            messages (list): The messages to send, usually from Session.get_messages.
+            stop_at (Optional[str]): Text after which a streamed completion is cut off, usually the target end tag.
+            prompt_tokens (Optional[int]): Estimated prompt tokens, e.g. from the ChatHistory. Estimated from the messages if None.
+            priority (Priority): Priority in the rate limiter queue.
 
         Returns:
             str: The content of the response message from the language model.
-            Exception: An exception if an error occurs during the API call.
+
+        Raises:
+            UpstreamError: If no completion could be obtained, CircuitOpenError while the breaker is open.
+        """
+        openai_config = self.config.openai_config
+        deadline = time.monotonic() + openai_config.request_deadline
+        if prompt_tokens is None:
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        estimated_tokens = prompt_tokens + estimate_tokens(messages[-1]["content"])
+        attempt = 0
+        while True:
+            try:
+                async with asyncio.timeout(max(0.0, deadline - time.monotonic())):
+                    await self.limiter.acquire(estimated_tokens, priority)
+            except TimeoutError:
+                UPSTREAM_ATTEMPTS.labels("rejected").inc()
+                raise UpstreamError("Completion waited for the rate limit beyond its deadline")
+            try:
+                self.breaker.before_request()
+            except UpstreamError:
+                UPSTREAM_ATTEMPTS.labels("rejected").inc()
+                raise
+            self.upstream_stats["attempts"] += 1
+            UPSTREAM_IN_FLIGHT.inc()
+            try:
+                async with asyncio.timeout(max(0.0, min(openai_config.request_timeout, deadline - time.monotonic()))):
+                    content = await self._request_once(messages, stop_at, prompt_tokens, estimated_tokens)
+            except asyncio.CancelledError:
+                self.breaker.probing = False
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                wait = retry_after(e)
+                if wait is not None and getattr(e, "status_code", None) == 429:
+                    self.limiter.block(wait)
+                delay = wait if wait is not None else backoff(attempt, openai_config.backoff_base, openai_config.backoff_max)
+                if not retryable or attempt >= openai_config.max_retries or time.monotonic() + delay >= deadline:
+                    self.upstream_stats["failures"] += 1
+                    UPSTREAM_ATTEMPTS.labels("error").inc()
+                    logger.error("Error in OpenAI completion",
+                                 extra={"fields": {"error": repr(e), "attempts": attempt + 1}})
+                    raise UpstreamError(f"Error in OpenAI completion: {e!r}", retry_after=wait) from e
+                self.upstream_stats["retries"] += 1
+                UPSTREAM_ATTEMPTS.labels("retry").inc()
+                logger.warning("Retrying OpenAI completion",
+                               extra={"fields": {"error": repr(e), "attempt": attempt + 1, "delay_s": round(delay, 3)}})
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                UPSTREAM_IN_FLIGHT.dec()
+            self.breaker.record_success()
+            UPSTREAM_ATTEMPTS.labels("ok").inc()
+            return content
+
+    def count_usage(self, usage, estimated_tokens: int):
+        """
+        Counts the usage reported for a completion in the token totals and metrics, and corrects the
+        rate limiter by the difference to the estimated tokens.
         """
+        if usage is None:
+            return
+        record_usage(usage)
+        self.limiter.record_usage(estimated_tokens, usage.total_tokens)
+        self.token_stats["prompt"] += usage.prompt_tokens or 0
+        self.token_stats["cached_prompt"] += cached_tokens(usage)
+        self.token_stats["completion"] += usage.completion_tokens or 0
 
+    async def _request_once(self, messages: list, stop_at: Optional[str], prompt_tokens: int, estimated_tokens: int) -> str:
+        """
+        Requests one completion from the backend pool and returns its content. Its usage is counted once the API reports it.
+        """
+        if self.config.model_config.stream:
+            return await self.backends.request(
+                lambda backend: self._request_streamed_completion(backend, messages, stop_at, prompt_tokens, estimated_tokens))
+        return await self.backends.request(lambda backend: self._request_backend_completion(backend, messages, estimated_tokens))
+
+    async def _request_backend_completion(self, backend: Backend, messages: list, estimated_tokens: int) -> str:
+        completion = await backend.client.chat.completions.create(
+                    model=backend.config.model_name,
+                    messages=messages,
+                    temperature=self.config.model_config.temperature,
+                    frequency_penalty=self.config.model_config.frequency_penalty,
+                    presence_penalty=self.config.model_config.presence_penalty
+                    )
+        self.count_usage(completion.usage, estimated_tokens)
+        return completion.choices[0].message.content or ""
+
+    def stats(self) -> dict:
+        tokens = dict(self.token_stats,
+                      cached_prompt_ratio=round(self.token_stats["cached_prompt"] / max(1, self.token_stats["prompt"]), 4))
+        return dict(self.upstream_stats, breaker=self.breaker.state, rejected=self.breaker.rejected, tokens=tokens,
+                    **self.backends.stats())
+
+    async def close(self):
+        for task in self.draining:
+            task.cancel()
+        await self.backends.close()
+
+    async def _request_streamed_completion(self, backend: Backend, messages: list, stop_at: Optional[str],
+                                           prompt_tokens: int, estimated_tokens: int) -> str:
+        """
+        Reads a streamed completion until it ends or stop_at appears, recording the time to the
+        first token and to stop_at, and closes the stream so the model stops generating. The rate
+        limiter is charged with the estimated tokens of the content read.
+
+        With stream_usage, the API is asked to send the usage in a final chunk instead; after a cut
+        off at stop_at, the rest of the stream is read in the background for it, so the content is
+        returned without waiting.
+        """
+        stream_usage = self.config.model_config.stream_usage
+        start = time.perf_counter()
+        first_token = None
+        end_tag = None
+        content = ""
+        stream = await backend.client.chat.completions.create(
+                    model=backend.config.model_name,
+                    messages=messages,
+                    temperature=self.config.model_config.temperature,
+                    frequency_penalty=self.config.model_config.frequency_penalty,
+                    presence_penalty=self.config.model_config.presence_penalty,
+                    stream=True,
+                    **({"stream_options": {"include_usage": True}} if stream_usage else {})
+                    )
         try:
-            completion = self.client.chat.completions.create(
-                        model=self.config.openai_config.model_name,
-                        messages=self.chat_history.chat_history,
-                        temperature=self.config.model_config.temperature,
-                        frequency_penalty=self.config.model_config.frequency_penalty,
-                        presence_penalty=self.config.model_config.presence_penalty
-                        )
-        except Exception as e:
-            print(f"Error in OpenAI completion. Error: {e}")
-            return e
-        return completion.choices[0].message.content
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    self.count_usage(chunk.usage, estimated_tokens)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                searched_from = max(0, len(content) - len(stop_at) + 1) if stop_at else 0
+                content += delta
+                if stop_at and stop_at in content[searched_from:]:
+                    end_tag = time.perf_counter() - start
+                    content = content[:content.index(stop_at, searched_from) + len(stop_at)]
+                    if stream_usage:
+                        task = asyncio.ensure_future(self._drain_usage(stream, estimated_tokens))
+                        self.draining.add(task)
+                        task.add_done_callback(self.draining.discard)
+                        stream = None
+                    break
+        finally:
+            if stream is not None:
+                await stream.close()
+        if not stream_usage:
+            self.limiter.record_usage(estimated_tokens, prompt_tokens + estimate_tokens(content))
+        self.stream_stats["requests"] += 1
+        self.stream_stats["first_token_s"] += first_token or 0.0
+        if end_tag is not None:
+            self.stream_stats["cut_off"] += 1
+            self.stream_stats["end_tag_s"] += end_tag
+        return content
 
-    def reset_history(self):
+    async def _drain_usage(self, stream, estimated_tokens: int):
         """
-        Resets the chat history.
+        Reads a stream cut off at the end tag up to its final usage chunk, within request_timeout.
         """
-        self.chat_history.reset_history()
-        if self.prompt.system_prompt.use_system_prompt:
-            self.chat_history.add_system_prompt(self.prompt.system_prompt.system_prompt)
-        self.chat_history.add_user_content(self.prompt.template.task_template)
-        self.chat_history.set_src_lang("")
-        self.chat_history.set_tgt_lang("")
-
-    def apply_latest_translations(self, records: list[TranslationRecord]):
-        records.reverse()
-        for record in records:
-            self.chat_history.add_user_content(record.src_text)
-            self.chat_history.add_assistant_content(record.tgt_text) 
-
-    def set_language_targets(self, src_lang: str, tgt_lang: str):
-        self.chat_history.set_src_lang(src_lang)
-        self.chat_history.set_tgt_lang(tgt_lang)
-        if self.prompt.template.specify_language:
-            self.chat_history.add_user_content(self.prompt.template.get_language_target_prompt(src_lang, tgt_lang))
+        try:
+            async with asyncio.timeout(self.config.openai_config.request_timeout):
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        self.count_usage(chunk.usage, estimated_tokens)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("Reading the usage of a streamed completion failed", extra={"fields": {"error": repr(e)}})
+        finally:
+            await stream.close()
 
 @dataclass
 class Prompt:
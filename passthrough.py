@@ -0,0 +1,108 @@
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config import PassthroughConfig
+from metrics import PASSTHROUGH
+from normalize import VALUE_REGEX
+
+# Letters of each script, as regular expression character ranges (including their fullwidth forms).
+SCRIPT_CHARS = {
+    "latin": "A-Za-z\u00aa\u00ba\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u024f\u1e00-\u1eff\uff21-\uff3a\uff41-\uff5a",
+    "greek": "\u0370-\u03ff\u1f00-\u1fff",
+    "cyrillic": "\u0400-\u052f",
+    "hebrew": "\u0590-\u05ff",
+    "arabic": "\u0600-\u06ff\u0750-\u077f",
+    "devanagari": "\u0900-\u097f",
+    "thai": "\u0e00-\u0e7f",
+    "hangul": "\u1100-\u11ff\u3130-\u318f\uac00-\ud7af\uffa0-\uffdc",
+    "hiragana": "\u3041-\u309f",
+    "katakana": "\u30a0-\u30ff\u31f0-\u31ff\uff66-\uff9f",
+    "han": "\u3005-\u3007\u3021-\u3029\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0003134f",
+}
+
+# Scripts written in each language, by language code without region.
+LANGUAGE_SCRIPTS = {
+    **{lang: ["latin"] for lang in ("en", "fr", "de", "es", "it", "pt", "nl", "pl", "sv", "da", "no", "nb", "fi", "cs",
+                                    "sk", "hu", "ro", "hr", "sl", "tr", "vi", "id", "ms", "tl", "ca", "et", "lv", "lt")},
+    **{lang: ["cyrillic"] for lang in ("ru", "uk", "be", "bg", "mk", "kk")},
+    "el": ["greek"],
+    "he": ["hebrew"],
+    "ar": ["arabic"],
+    "fa": ["arabic"],
+    "hi": ["devanagari"],
+    "th": ["thai"],
+    "ko": ["hangul"],
+    "ja": ["hiragana", "katakana", "han"],
+    "zh": ["han"],
+}
+
+LETTER_REGEX = re.compile(r"[^\W\d_]")
+
+
+@dataclass
+class Passthrough:
+    """
+    Recognizes texts that need no translation, so they are returned as they are without a completion.
+
+    A text needs no translation if it has no letters once rich-text tags, placeholders and numbers are
+    removed, e.g. "00:12", "100%" or "★". With detect_script, it also needs none if all its letters are in
+    the script of the target language while the source language is written in other scripts, e.g. "HP"
+    in a Japanese game translated to English.
+
+    Attributes:
+        config (PassthroughConfig): Passthrough configuration.
+        scripts (dict): Script names by language code.
+        patterns (dict): Per (src_lang, tgt_lang), a regular expression matching letters outside the
+            target scripts, or None if script detection doesn't apply to the pair.
+        counts (dict): Texts returned as they are, by reason.
+    """
+    config: PassthroughConfig
+    scripts: dict = field(default_factory=lambda: dict(LANGUAGE_SCRIPTS))
+    patterns: dict = field(default_factory=dict)
+    counts: dict = field(default_factory=lambda: {"no_letters": 0, "target_script": 0})
+
+    @classmethod
+    def from_config(cls, config: PassthroughConfig):
+        scripts = dict(LANGUAGE_SCRIPTS, **{lang.lower(): names for lang, names in config.scripts.items()})
+        for lang, names in scripts.items():
+            unknown = [name for name in names if name not in SCRIPT_CHARS]
+            if unknown:
+                raise ValueError(f"Unknown scripts {unknown} for language {lang}, expected some of {list(SCRIPT_CHARS)}")
+        return cls(config=config, scripts=scripts)
+
+    def scripts_of(self, lang: str) -> list:
+        lang = lang.lower()
+        return self.scripts.get(lang) or self.scripts.get(re.split(r"[-_]", lang)[0], [])
+
+    def foreign_letters(self, src_lang: str, tgt_lang: str) -> Optional[re.Pattern]:
+        key = (src_lang, tgt_lang)
+        if key not in self.patterns:
+            src_scripts = self.scripts_of(src_lang)
+            tgt_scripts = self.scripts_of(tgt_lang)
+            pattern = None
+            if src_scripts and tgt_scripts and not set(src_scripts) & set(tgt_scripts):
+                pattern = re.compile(r"[^\W\d_" + "".join(SCRIPT_CHARS[name] for name in tgt_scripts) + "]")
+            self.patterns[key] = pattern
+        return self.patterns[key]
+
+    def check(self, src_lang: str, tgt_lang: str, text: str) -> Optional[str]:
+        """
+        Returns why a text needs no translation, "no_letters" or "target_script", or None if it needs one.
+        """
+        if not self.config.use_passthrough:
+            return None
+        stripped = VALUE_REGEX.sub("", text)
+        if LETTER_REGEX.search(stripped) is None:
+            reason = "no_letters"
+        elif self.config.detect_script and (pattern := self.foreign_letters(src_lang, tgt_lang)) is not None \
+                and pattern.search(stripped) is None:
+            reason = "target_script"
+        else:
+            return None
+        self.counts[reason] += 1
+        PASSTHROUGH.labels(reason).inc()
+        return reason
+
+    def stats(self) -> dict:
+        return dict(self.counts)
@@ -1,6 +1,9 @@
 from dataclasses import dataclass, field
+import logging
 import re
 
+logger = logging.getLogger("xunity.translation")
+
 @dataclass
 class Tag:
     """
@@ -43,15 +46,21 @@ class Template:
         specify_language (bool): Indicates whether language specification is required.
         language_template (str): The template for specifying the source and target languages.
         tag (Tag): An instance of the Tag class containing start and end tags.
+        batch_template (str): The instruction sent in front of a batch of indexed source sections.
+        glossary_template (str): The instruction in front of the glossary terms found in the source text, with a {terms} field.
         src_prompt (str): The formatted source prompt using the source tags.
         tgt_regex (re.Pattern): A regular expression pattern to extract the target text using the target tags.
+        batch_tgt_regex (re.Pattern): A regular expression pattern to extract indexed target texts from a batch completion.
     """
     task_template: str
     specify_language: bool
     language_template: str
     tag: Tag
+    batch_template: str = "Translate each {src_start}{src_end} section below separately. Answer every section with a {tgt_start}{tgt_end} section carrying the same id, in the same order, and nothing else."
+    glossary_template: str = "Use these translations for the following terms:\n{terms}"
     src_prompt: str = field(init=False)
     tgt_regex: re.Pattern = field(init=False)
+    batch_tgt_regex: re.Pattern = field(init=False)
 
     def __post_init__(self):
         """
@@ -59,10 +68,15 @@ class Template:
         """
         self.src_prompt = f"{self.tag.src_start}{{src_text}}{self.tag.src_end}"
         self.tgt_regex = re.compile(f"{self.tag.tgt_start}\\s*(.*?)\\s*{self.tag.tgt_end}", re.DOTALL)
+        self.batch_tgt_regex = re.compile(f"{re.escape(self.tag.tgt_start[:-1])}\\s+id=[\"']?(\\d+)[\"']?>\\s*(.*?)\\s*{re.escape(self.tag.tgt_end)}", re.DOTALL)
         self.task_template = self.task_template.format(src_start=self.tag.src_start,
                                                       src_end=self.tag.src_end,
                                                       tgt_start=self.tag.tgt_start,
                                                       tgt_end=self.tag.tgt_end)
+        self.batch_template = self.batch_template.format(src_start=self._indexed_tag(self.tag.src_start, "N"),
+                                                        src_end=self.tag.src_end,
+                                                        tgt_start=self._indexed_tag(self.tag.tgt_start, "N"),
+                                                        tgt_end=self.tag.tgt_end)
 
     @classmethod
     def from_dict(cls, config_dict: dict):
@@ -78,19 +92,77 @@ class Template:
         return cls(task_template=config_dict['task_template'],
                    specify_language=config_dict['specify_language'],
                    language_template=config_dict['language_template'],
-                   tag=Tag.from_dict(config_dict['tag']))
+                   tag=Tag.from_dict(config_dict['tag']),
+                   batch_template=config_dict.get('batch_template') or cls.batch_template,
+                   glossary_template=config_dict.get('glossary_template') or cls.glossary_template)
+
+    @staticmethod
+    def _indexed_tag(tag: str, index) -> str:
+        """
+        Returns a start tag carrying an id attribute, e.g. <r> becomes <r id=3>.
+        """
+        return f"{tag[:-1]} id={index}>"
     
-    def get_src_filled_prompt(self, src_text: str) -> str:
+    def get_glossary_prompt(self, terms: list[tuple]) -> str:
+        """
+        Returns the glossary instruction filled with one "term = translation" line per term.
+
+        Args:
+            terms (list[tuple]): (term, translation) pairs.
+
+        Returns:
+            str: The formatted glossary prompt.
+        """
+        return self.glossary_template.format(terms="\n".join(f"{term} = {translation}" for term, translation in terms))
+
+    def get_src_filled_prompt(self, src_text: str, terms: list[tuple] = None) -> str:
         """
         Returns the source prompt filled with the provided source text.
 
         Args:
             src_text (str): The source text to be included in the prompt.
+            terms (list[tuple]): Glossary (term, translation) pairs found in the source text, sent in front of it.
 
         Returns:
             str: The formatted source prompt.
         """
-        return self.src_prompt.format(src_text=src_text)
+        src_prompt = self.src_prompt.format(src_text=src_text)
+        if terms:
+            return f"{self.get_glossary_prompt(terms)}\n{src_prompt}"
+        return src_prompt
+
+    def get_batch_src_filled_prompt(self, src_texts: list[str], terms: list[tuple] = None) -> str:
+        """
+        Returns the batch instruction followed by one indexed source section per text.
+
+        Args:
+            src_texts (list[str]): The source texts, indexed by their position.
+            terms (list[tuple]): Glossary (term, translation) pairs found in the source texts, sent in front of them.
+
+        Returns:
+            str: The formatted batch prompt.
+        """
+        sections = "\n".join(f"{self._indexed_tag(self.tag.src_start, index)}{src_text}{self.tag.src_end}"
+                             for index, src_text in enumerate(src_texts))
+        if terms:
+            return f"{self.batch_template}\n{self.get_glossary_prompt(terms)}\n{sections}"
+        return f"{self.batch_template}\n{sections}"
+
+    def get_batch_translated_texts(self, tgt_text: str) -> dict[int, str]:
+        """
+        Extracts the indexed translated texts from a batch completion.
+
+        Args:
+            tgt_text (str): The batch completion.
+
+        Returns:
+            dict[int, str]: Translated texts by index. Missing or empty sections are left out.
+        """
+        translated_texts = {}
+        for index, text in self.batch_tgt_regex.findall(tgt_text):
+            if text:
+                translated_texts.setdefault(int(index), text)
+        return translated_texts
 
     def get_translated_text(self, tgt_text: str) -> str:
         """
@@ -102,7 +174,7 @@ class Template:
         Returns:
             str: The extracted translated text.
         """
-        print(tgt_text)
+        logger.debug("Completion", extra={"fields": {"completion": tgt_text}})
         match = self.tgt_regex.search(tgt_text)
         return match.group(1) if match else ""
 
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Optional
+
+from metrics import RATE_LIMIT_QUEUE_DEPTH, RATE_LIMIT_WAIT_SECONDS
+
+
+class Priority(IntEnum):
+    """
+    Order in which queued completions are sent, lowest first.
+    """
+    UI = 0
+    TEXT = 1
+    BULK = 2
+
+
+# Priority of the completions requested in the current context, set by bulk requests. If unset,
+# the priority is derived from the length of the text.
+request_priority: ContextVar[Optional[Priority]] = ContextVar("request_priority", default=None)
+
+
+@dataclass
+class TokenBucket:
+    """
+    A bucket holding up to per_minute units, refilled continuously at per_minute per minute.
+
+    Attributes:
+        per_minute (float): Capacity and refill rate.
+        level (float): Units available, negative while a request larger than the capacity is paid off.
+        updated (float): Monotonic time of the last refill.
+    """
+    per_minute: float
+    level: float = field(init=False)
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.level = self.per_minute
+
+    def refill(self, now: float):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Returns the seconds until amount units are available. Amounts above the capacity only wait for a full bucket.
+        """
+        self.refill(now)
+        missing = min(amount, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give(self, amount: float):
+        self.level = min(self.per_minute, self.level + amount)
+
+
+@dataclass
+class RateLimiter:
+    """
+    Keeps completions within requests-per-minute and tokens-per-minute limits of the upstream API.
+
+    Completions wait in a priority queue and are released in priority order, first come first served
+    within a priority, as soon as both buckets hold enough for the head of the queue. Token amounts
+    are estimates, corrected with the usage of the completion once it is known.
+
+    Attributes:
+        rpm (int): Requests per minute, 0 for no limit.
+        tpm (int): Tokens per minute, 0 for no limit.
+        requests (TokenBucket): Bucket of the request limit, None without one.
+        tokens (TokenBucket): Bucket of the token limit, None without one.
+        queue (list): Heap of (priority, sequence, tokens, future, enqueued time) of the waiting completions.
+        blocked_until (float): Monotonic time until which nothing is released, after a 429 with Retry-After.
+        timer (asyncio.TimerHandle): Releases the head of the queue once the buckets have refilled.
+        waits (dict): Per priority name, the completions released, the total and the maximum seconds they waited.
+    """
+    rpm: int = 0
+    tpm: int = 0
+    requests: Optional[TokenBucket] = None
+    tokens: Optional[TokenBucket] = None
+    queue: list = field(default_factory=list)
+    sequence: itertools.count = field(default_factory=itertools.count)
+    blocked_until: float = 0.0
+    timer: Optional[asyncio.TimerHandle] = None
+    waits: dict = field(default_factory=lambda: {priority.name.lower(): {"released": 0, "wait_s_total": 0.0, "wait_s_max": 0.0}
+                                                 for priority in Priority})
+
+    def __post_init__(self):
+        if self.rpm > 0:
+            self.requests = TokenBucket(self.rpm)
+        if self.tpm > 0:
+            self.tokens = TokenBucket(self.tpm)
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    async def acquire(self, tokens: int, priority: Priority = Priority.TEXT):
+        """
+        Waits until a completion of an estimated number of tokens may be sent.
+
+        Args:
+            tokens (int): Estimated prompt and completion tokens.
+            priority (Priority): Queue priority of the completion.
+        """
+        if not self.enabled:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self.sequence), tokens, future, time.monotonic()))
+        RATE_LIMIT_QUEUE_DEPTH.labels(priority.name.lower()).inc()
+        self.release()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                RATE_LIMIT_QUEUE_DEPTH.labels(priority.name.lower()).dec()
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Releases queued completions in priority order while the buckets allow, and schedules the next release.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.queue:
+            priority, _, tokens, future, enqueued = self.queue[0]
+            if future.done():
+                heapq.heappop(self.queue)
+                continue
+            now = time.monotonic()
+            wait = self.blocked_until - now
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                self.timer = asyncio.get_running_loop().call_later(wait, self.release)
+                return
+            heapq.heappop(self.queue)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            name = priority.name.lower()
+            waited = now - enqueued
+            stats = self.waits[name]
+            stats["released"] += 1
+            stats["wait_s_total"] += waited
+            stats["wait_s_max"] = max(stats["wait_s_max"], waited)
+            RATE_LIMIT_QUEUE_DEPTH.labels(name).dec()
+            RATE_LIMIT_WAIT_SECONDS.labels(name).observe(waited)
+            future.set_result(None)
+
+    def record_usage(self, estimated: int, actual: int):
+        """
+        Corrects the token bucket by the difference between the estimated and the actual tokens of a completion.
+        """
+        if self.tokens is not None:
+            self.tokens.give(estimated - actual)
+
+    def block(self, seconds: float):
+        """
+        Holds back all queued completions for seconds, e.g. after a 429 response with Retry-After.
+        """
+        if self.enabled:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, _, future, _ in self.queue:
+            if not future.done():
+                queued[priority.name.lower()] += 1
+        return {"queued": queued,
+                "waits": {name: dict(stats, wait_s_total=round(stats["wait_s_total"], 3), wait_s_max=round(stats["wait_s_max"], 3))
+                          for name, stats in self.waits.items()}}
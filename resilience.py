@@ -0,0 +1,122 @@
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import openai
+
+
+class UpstreamError(Exception):
+    """
+    Raised when no completion could be obtained from the upstream API.
+
+    Attributes:
+        retry_after (Optional[float]): Seconds after which the upstream is expected to accept requests again, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    Raised without contacting the upstream API while the circuit breaker is open.
+    """
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed request may succeed when repeated: timeouts, connection errors, 408, 409, 429 and 5xx.
+    """
+    if isinstance(error, (TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the seconds to wait from the retry-after-ms or Retry-After header of an error response, if any.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """
+    Returns a delay with full jitter, drawn from 0 to base * 2 ** attempt capped at maximum.
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Fails requests fast while the upstream API is down.
+
+    The breaker opens after failure_threshold consecutive failed requests. While open, requests are
+    rejected until reset_timeout seconds have passed; then a single probe request is let through,
+    which closes the breaker if it succeeds and opens it again if it fails.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the breaker. 0 disables the breaker.
+        reset_timeout (float): Seconds the breaker stays open before letting a probe through.
+        failures (int): Current number of consecutive failures.
+        opened_at (Optional[float]): Monotonic time the breaker opened, None while closed.
+        probing (bool): Whether a probe request is outstanding.
+        rejected (int): Requests rejected while open.
+    """
+    failure_threshold: int
+    reset_timeout: float
+    failures: int = 0
+    opened_at: Optional[float] = None
+    probing: bool = False
+    rejected: int = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        """
+        Raises CircuitOpenError if the request must not be sent.
+        """
+        if self.opened_at is None:
+            return
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        if remaining > 0 or self.probing:
+            self.rejected += 1
+            raise CircuitOpenError("Upstream API is unavailable, circuit breaker is open",
+                                   retry_after=max(remaining, 0.0))
+        self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+        self.probing = False
@@ -0,0 +1,45 @@
+import re
+
+SEPARATOR_REGEX = {
+    "lines": re.compile(r"\s*\n\s*"),
+    # Line breaks, whitespace after . ! ? (and a closing quote), and the position after 。！？ (and a closing bracket).
+    "sentences": re.compile(r"\s*\n\s*"
+                            r"|(?:(?<=[.!?…])|(?<=[.!?…][\"'”’)]))\s+"
+                            r"|(?:(?<=[。！？])|(?<=[。！？][」』）]))(?![」』）。！？])\s*"),
+}
+
+
+def split_segments(text: str, segment_by: str = "lines") -> tuple:
+    """
+    Splits a text into segments and the whitespace around them, so that
+    join_segments(segments, separators) gives back the text.
+
+    Args:
+        text (str): The text to split.
+        segment_by (str): "lines" to split at line breaks, "sentences" to also split after sentences.
+
+    Returns:
+        tuple: The segments, and the separators in front of, between and after them (one more than segments).
+    """
+    core = text.strip()
+    start = len(text) - len(text.lstrip())
+    separators = [text[:start]]
+    segments = []
+    position = 0
+    for match in SEPARATOR_REGEX[segment_by].finditer(core):
+        if match.start() == 0 or match.end() == len(core):
+            continue
+        segments.append(core[position:match.start()])
+        separators.append(match.group(0))
+        position = match.end()
+    segments.append(core[position:])
+    separators.append(text[start + len(core):])
+    return segments, separators
+
+
+def join_segments(segments: list, separators: list) -> str:
+    parts = [separators[0]]
+    for segment, separator in zip(segments, separators[1:]):
+        parts.append(segment)
+        parts.append(separator)
+    return "".join(parts)
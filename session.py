@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from chat_history import ChatHistory
+from config import Config
+from db import DB, TranslationRecord
+from metrics import forget_history, record_history
+from normalize import is_template
+from tokens import estimate_tokens
+
+logger = logging.getLogger("xunity.session")
+
+
+@dataclass
+class Session:
+    """
+    An independent translation context for one language pair and client.
+
+    Attributes:
+        config (Config): Application configuration, used for the prompt and history settings.
+        src_lang (str): The source language of the session.
+        tgt_lang (str): The target language of the session.
+        session_id (str): Client supplied session id, "" for the default session.
+        chat_history (ChatHistory): The chat history of the session.
+        lock (asyncio.Lock): Guards initialization and updates of the chat history.
+        initialized (bool): Whether the latest translations were loaded into the history.
+        last_used (float): Monotonic time of the last request that used the session.
+    """
+    config: Config
+    src_lang: str
+    tgt_lang: str
+    session_id: str = ""
+    chat_history: ChatHistory = field(default_factory=ChatHistory)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    initialized: bool = False
+    last_used: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        """
+        Sets up the system and task prompts and the language targets in the chat history.
+        """
+        self.chat_history.set_system_prompt(self.config.prompt.system_prompt.system_prompt)
+        self.chat_history.set_task_prompt(self.config.prompt.template.task_template)
+        self.reset_history()
+
+    def reset_history(self):
+        """
+        Resets the chat history to the system prompt, task template and language prompt.
+        """
+        prompt = self.config.prompt
+        self.chat_history.reset_history()
+        if prompt.system_prompt.use_system_prompt:
+            self.chat_history.add_system_prompt(prompt.system_prompt.system_prompt)
+        self.chat_history.add_user_content(prompt.template.task_template)
+        self.chat_history.set_src_lang(self.src_lang)
+        self.chat_history.set_tgt_lang(self.tgt_lang)
+        if prompt.template.specify_language:
+            self.chat_history.add_user_content(prompt.template.get_language_target_prompt(self.src_lang, self.tgt_lang))
+        record_history(self)
+
+    def apply_latest_translations(self, records: list[TranslationRecord]):
+        records.reverse()
+        for record in records:
+            if is_template(record.src_text):
+                continue
+            self.chat_history.add_turn(record.src_text, record.tgt_text)
+        self.trim_history()
+        record_history(self)
+
+    def get_messages(self, src_prompt: str, example_turns: list = ()) -> list:
+        """
+        Returns the messages to send for a source prompt without modifying the chat history.
+
+        Args:
+            src_prompt (str): The filled source prompt.
+            example_turns (list): Few-shot turns from example_turns, sent after the history so its prefix stays cacheable.
+
+        Returns:
+            list: The chat history followed by the example turns and the source prompt.
+        """
+        return self.chat_history.get_messages_with("user", src_prompt, example_turns)
+
+    def prompt_tokens(self, src_prompt: str, example_turns: list = ()) -> int:
+        """
+        Returns the estimated tokens of the messages get_messages returns.
+        """
+        return (self.chat_history.token_count + estimate_tokens(src_prompt)
+                + sum(estimate_tokens(user_content) + estimate_tokens(assistant_content)
+                      for user_content, assistant_content in example_turns))
+
+    def example_turns(self, examples: list) -> list:
+        """
+        Returns (src_prompt, completion) turns of (src_text, tgt_text) examples, leaving out the ones already in the history.
+        """
+        template = self.config.prompt.template
+        in_history = {user_content for user_content, _, _ in self.chat_history.turns}
+        turns = []
+        for src_text, tgt_text in examples:
+            src_prompt = template.get_src_filled_prompt(src_text)
+            if src_prompt not in in_history:
+                turns.append((src_prompt, f"{template.tag.tgt_start}{tgt_text}{template.tag.tgt_end}"))
+        return turns
+
+    def add_turn(self, src_prompt: str, completion: str):
+        """
+        Appends a finished turn to the chat history and trims it to the configured maximum.
+
+        Args:
+            src_prompt (str): The filled source prompt.
+            completion (str): The raw completion of the language model.
+        """
+        self.chat_history.add_turn(src_prompt, completion)
+        self.trim_history()
+        record_history(self)
+
+    def trim_history(self):
+        """
+        Evicts turns while the history exceeds max_history messages or max_history_tokens estimated tokens.
+        The oldest turns are evicted with use_latest_history, otherwise the newest ones are dropped.
+
+        With prefix_stable_history, a full history evicts its oldest turns down to history_keep_ratio of
+        the limits in one go, so the following prompts only append to it and keep a cacheable prefix.
+        """
+        history_config = self.config.history_config
+        if not self.history_exceeds(1.0):
+            return
+        if history_config.use_latest_history and history_config.prefix_stable_history:
+            while self.chat_history.turns and self.history_exceeds(history_config.history_keep_ratio):
+                self.chat_history.pop_oldest_turn()
+            return
+        while self.chat_history.turns and self.history_exceeds(1.0):
+            if history_config.use_latest_history:
+                self.chat_history.pop_oldest_turn()
+            else:
+                self.chat_history.pop_latest_turn()
+
+    def history_exceeds(self, ratio: float) -> bool:
+        """
+        Whether the turns exceed ratio of max_history messages or of max_history_tokens estimated tokens.
+        """
+        history_config = self.config.history_config
+        return ((history_config.max_history > -1 and 2 * len(self.chat_history.turns) > history_config.max_history * ratio)
+                or (history_config.max_history_tokens > -1
+                    and self.chat_history.turn_tokens > history_config.max_history_tokens * ratio))
+
+
+@dataclass
+class SessionManager:
+    """
+    A bounded LRU pool of sessions keyed by source language, target language and session id.
+
+    Attributes:
+        config (Config): Application configuration.
+        db (DB): Database used to load the latest translations into new sessions.
+        sessions (OrderedDict): Sessions ordered from least to most recently used.
+    """
+    config: Config
+    db: DB
+    sessions: OrderedDict = field(default_factory=OrderedDict)
+
+    @classmethod
+    def from_config(cls, config: Config, db: DB):
+        return cls(config=config, db=db)
+
+    async def get_session(self, src_lang: str, tgt_lang: str, session_id: str = "") -> Session:
+        """
+        Returns the session for a language pair and session id, creating and initializing it if needed.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            session_id (str): Optional client supplied session id. Defaults to "".
+
+        Returns:
+            Session: The initialized session.
+        """
+        key = (src_lang, tgt_lang, session_id)
+        now = time.monotonic()
+        self.evict_idle(now)
+        session = self.sessions.get(key)
+        if session is None:
+            session = Session(self.config, src_lang, tgt_lang, session_id)
+            self.sessions[key] = session
+            while len(self.sessions) > self.config.history_config.max_sessions:
+                forget_history(self.sessions.popitem(last=False)[1])
+        else:
+            self.sessions.move_to_end(key)
+        session.last_used = now
+        if not session.initialized:
+            async with session.lock:
+                if not session.initialized:
+                    database_config = self.config.database_config
+                    if database_config.use_latest_records and not self.config.examples_config.use_examples:
+                        translation_records = await self.db.aget_latest_translations(src_lang, tgt_lang, database_config.init_latest_records)
+                        if translation_records:
+                            session.apply_latest_translations(translation_records)
+                            logger.info("Latest translations applied", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang, "records": len(translation_records)}})
+                    session.initialized = True
+        return session
+
+    def apply_translation(self, record: TranslationRecord) -> int:
+        """
+        Adds a translation made elsewhere, e.g. by another worker, to the session it was made in, if
+        that session is open here, so the histories of other sessions stay apart.
+
+        Returns:
+            int: The number of sessions it was added to.
+        """
+        if not self.config.history_config.use_history or is_template(record.src_text):
+            return 0
+        template = self.config.prompt.template
+        src_prompt = template.get_src_filled_prompt(record.src_text)
+        completion = f"{template.tag.tgt_start}{record.tgt_text}{template.tag.tgt_end}"
+        session = self.sessions.get((record.src_lang, record.tgt_lang, record.session_id))
+        if session is None or not session.initialized:
+            return 0
+        session.add_turn(src_prompt, completion)
+        return 1
+
+    def evict_idle(self, now: float):
+        """
+        Drops sessions that have not been used within the idle timeout, starting from the least recently used.
+
+        Args:
+            now (float): The current monotonic time.
+        """
+        idle_timeout = self.config.history_config.session_idle_timeout
+        if idle_timeout < 0:
+            return
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if now - session.last_used < idle_timeout:
+                break
+            del self.sessions[key]
+            forget_history(session)
+
+    def clear(self):
+        for session in self.sessions.values():
+            forget_history(session)
+        self.sessions.clear()
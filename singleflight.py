@@ -0,0 +1,45 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable
+
+
+@dataclass
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one call whose result is shared.
+
+    Attributes:
+        flights (dict): Outstanding calls by key.
+        calls (int): Number of calls that were actually executed.
+        coalesced (int): Number of calls that awaited an outstanding call instead of executing.
+    """
+    flights: dict = field(default_factory=dict)
+    calls: int = 0
+    coalesced: int = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        """
+        Runs func unless a call with the same key is outstanding, in which case its result is awaited.
+
+        The call runs as its own task, so cancelling one of the waiting requests doesn't cancel it
+        for the others.
+
+        Args:
+            key (Hashable): Key identifying identical calls.
+            func (Callable[[], Awaitable]): Coroutine function to run.
+
+        Returns:
+            The result of the call, or raises its exception.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = asyncio.ensure_future(func())
+            self.flights[key] = flight
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.flights)}
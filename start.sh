@@ -6,21 +6,48 @@ ARGS=""
 [ -n "$BASE_URL" ] && ARGS="${ARGS} --base-url $BASE_URL"
 [ -n "$API_KEY" ] && ARGS="${ARGS} --api-key $API_KEY"
 [ -n "$MODEL_NAME" ] && ARGS="${ARGS} --model-name $MODEL_NAME"
+[ -n "$REQUEST_TIMEOUT" ] && ARGS="${ARGS} --request-timeout $REQUEST_TIMEOUT"
+[ -n "$REQUEST_DEADLINE" ] && ARGS="${ARGS} --request-deadline $REQUEST_DEADLINE"
+[ -n "$MAX_RETRIES" ] && ARGS="${ARGS} --max-retries $MAX_RETRIES"
+[ -n "$BACKOFF_BASE" ] && ARGS="${ARGS} --backoff-base $BACKOFF_BASE"
+[ -n "$BACKOFF_MAX" ] && ARGS="${ARGS} --backoff-max $BACKOFF_MAX"
+[ -n "$BREAKER_FAILURES" ] && ARGS="${ARGS} --breaker-failures $BREAKER_FAILURES"
+[ -n "$BREAKER_RESET" ] && ARGS="${ARGS} --breaker-reset $BREAKER_RESET"
+# Space separated list of base_url[,model_name[,weight]]
+for BACKEND in $BACKENDS; do ARGS="${ARGS} --backend $BACKEND"; done
+[ -n "$BALANCER" ] && ARGS="${ARGS} --balancer $BALANCER"
+[ -n "$HEDGE" ] && [ "$HEDGE" != "0" ] && ARGS="${ARGS} --hedge"
+[ -n "$HEDGE_QUANTILE" ] && ARGS="${ARGS} --hedge-quantile $HEDGE_QUANTILE"
+[ -n "$HEDGE_MIN_SAMPLES" ] && ARGS="${ARGS} --hedge-min-samples $HEDGE_MIN_SAMPLES"
+[ -n "$HEALTH_CHECK_INTERVAL" ] && ARGS="${ARGS} --health-check-interval $HEALTH_CHECK_INTERVAL"
 
 # Model Config
 [ -n "$TEMPERATURE" ] && ARGS="${ARGS} --temperature $TEMPERATURE"
 [ -n "$MAX_TOKENS" ] && ARGS="${ARGS} --max-tokens $MAX_TOKENS"
 [ -n "$FREQUENCY_PENALTY" ] && ARGS="${ARGS} --frequency-penalty $FREQUENCY_PENALTY"
 [ -n "$PRESENCE_PENALTY" ] && ARGS="${ARGS} --presence-penalty $PRESENCE_PENALTY"
+[ -n "$STREAM" ] && [ "$STREAM" != "0" ] && ARGS="${ARGS} --stream"
+[ -n "$STREAM_USAGE" ] && [ "$STREAM_USAGE" != "0" ] && ARGS="${ARGS} --stream-usage"
 
 # Server Config
 [ -n "$HOST" ] && ARGS="${ARGS} --host $HOST"
 [ -n "$PORT" ] && ARGS="${ARGS} --port $PORT"
+[ -n "$WORKERS" ] && ARGS="${ARGS} --workers $WORKERS"
+# Several workers share their Prometheus metrics through files in an empty directory.
+if [ -n "$WORKERS" ] && [ "$WORKERS" -gt 1 ] && [ -z "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    export PROMETHEUS_MULTIPROC_DIR="$(mktemp -d)"
+fi
+[ -n "$SYNC_INTERVAL" ] && ARGS="${ARGS} --sync-interval $SYNC_INTERVAL"
 
 # History Config
 [ -n "$USE_HISTORY" ] && [ "$USE_HISTORY" != "0" ] && ARGS="${ARGS} --use-history"
 [ -n "$MAX_HISTORY" ] && ARGS="${ARGS} --max-history $MAX_HISTORY"
+[ -n "$MAX_HISTORY_TOKENS" ] && ARGS="${ARGS} --max-history-tokens $MAX_HISTORY_TOKENS"
 [ "$USE_LATEST_HISTORY" != "0" ] && ARGS="${ARGS} --use-latest-history"
+[ -n "$MAX_SESSIONS" ] && ARGS="${ARGS} --max-sessions $MAX_SESSIONS"
+[ -n "$SESSION_IDLE_TIMEOUT" ] && ARGS="${ARGS} --session-idle-timeout $SESSION_IDLE_TIMEOUT"
+[ -n "$PREFIX_STABLE_HISTORY" ] && [ "$PREFIX_STABLE_HISTORY" != "0" ] && ARGS="${ARGS} --prefix-stable-history"
+[ -n "$HISTORY_KEEP_RATIO" ] && ARGS="${ARGS} --history-keep-ratio $HISTORY_KEEP_RATIO"
 
 # Database Config
 [ -n "$DB_TYPE" ] && ARGS="${ARGS} --db-type $DB_TYPE"
@@ -28,6 +55,16 @@ ARGS=""
 [ "$USE_CACHED_TRANSLATION" != "0" ] && ARGS="${ARGS} --use-cached-translation"
 [ "$USE_LATEST_RECORDS" != "0" ] && ARGS="${ARGS} --use-latest-records"
 [ -n "$INIT_LATEST_RECORDS" ] && ARGS="${ARGS} --init-latest-records $INIT_LATEST_RECORDS"
+[ -n "$MEMORY_CACHE_MB" ] && ARGS="${ARGS} --memory-cache-mb $MEMORY_CACHE_MB"
+[ -n "$MEMORY_CACHE_WARMUP" ] && ARGS="${ARGS} --memory-cache-warmup $MEMORY_CACHE_WARMUP"
+[ "$USE_WRITE_BEHIND" = "0" ] && ARGS="${ARGS} --no-write-behind"
+[ -n "$WRITE_BEHIND_ROWS" ] && ARGS="${ARGS} --write-behind-rows $WRITE_BEHIND_ROWS"
+[ -n "$WRITE_BEHIND_MS" ] && ARGS="${ARGS} --write-behind-ms $WRITE_BEHIND_MS"
+[ -n "$POOL_MIN_SIZE" ] && ARGS="${ARGS} --pool-min-size $POOL_MIN_SIZE"
+[ -n "$POOL_MAX_SIZE" ] && ARGS="${ARGS} --pool-max-size $POOL_MAX_SIZE"
+[ -n "$POOL_TIMEOUT" ] && ARGS="${ARGS} --pool-timeout $POOL_TIMEOUT"
+[ -n "$POOL_MAX_IDLE" ] && ARGS="${ARGS} --pool-max-idle $POOL_MAX_IDLE"
+[ -n "$NORMALIZE_CACHE_KEYS" ] && [ "$NORMALIZE_CACHE_KEYS" != "0" ] && ARGS="${ARGS} --normalize-cache-keys"
 
 # PostgreSQL Config
 [ -n "$POSTGRES_HOST" ] && ARGS="${ARGS} --postgres-host $POSTGRES_HOST"
@@ -39,14 +76,46 @@ ARGS=""
 # SQLite Config
 [ -n "$SQLITE_DB_PATH" ] && ARGS="${ARGS} --sqlite-db-path $SQLITE_DB_PATH"
 
+# Batch Config
+[ -n "$USE_BATCHING" ] && [ "$USE_BATCHING" != "0" ] && ARGS="${ARGS} --use-batching"
+[ -n "$MAX_BATCH_SIZE" ] && ARGS="${ARGS} --max-batch-size $MAX_BATCH_SIZE"
+[ -n "$MAX_BATCH_WAIT_MS" ] && ARGS="${ARGS} --max-batch-wait-ms $MAX_BATCH_WAIT_MS"
+[ -n "$MAX_BATCH_TOKENS" ] && ARGS="${ARGS} --max-batch-tokens $MAX_BATCH_TOKENS"
+[ -n "$BULK_CONCURRENCY" ] && ARGS="${ARGS} --bulk-concurrency $BULK_CONCURRENCY"
+
+# Segment Config
+[ -n "$USE_SEGMENTATION" ] && [ "$USE_SEGMENTATION" != "0" ] && ARGS="${ARGS} --use-segmentation"
+[ -n "$SEGMENT_BY" ] && ARGS="${ARGS} --segment-by $SEGMENT_BY"
+
+# Passthrough Config
+[ "$PASSTHROUGH" = "0" ] && ARGS="${ARGS} --no-passthrough"
+[ "$DETECT_SCRIPT" = "0" ] && ARGS="${ARGS} --no-detect-script"
+
+# Glossary Config
+[ "$USE_GLOSSARY" = "0" ] && ARGS="${ARGS} --no-glossary"
+[ -n "$MAX_GLOSSARY_TERMS" ] && ARGS="${ARGS} --max-glossary-terms $MAX_GLOSSARY_TERMS"
+
+# Examples Config
+[ -n "$USE_EXAMPLES" ] && [ "$USE_EXAMPLES" != "0" ] && ARGS="${ARGS} --use-examples"
+[ -n "$MAX_EXAMPLES" ] && ARGS="${ARGS} --max-examples $MAX_EXAMPLES"
+[ -n "$MIN_EXAMPLE_SIMILARITY" ] && ARGS="${ARGS} --min-example-similarity $MIN_EXAMPLE_SIMILARITY"
+
+# Rate Limit Config
+[ -n "$RPM" ] && ARGS="${ARGS} --rpm $RPM"
+[ -n "$TPM" ] && ARGS="${ARGS} --tpm $TPM"
+[ -n "$UI_MAX_TOKENS" ] && ARGS="${ARGS} --ui-max-tokens $UI_MAX_TOKENS"
+
 # Logging Config
 [ -n "$LOG_FILE" ] && ARGS="${ARGS} --log-file $LOG_FILE"
 [ -n "$LOG_LEVEL" ] && ARGS="${ARGS} --log-level $LOG_LEVEL"
+[ -n "$TEXT_LOG_SAMPLE_RATE" ] && ARGS="${ARGS} --text-log-sample-rate $TEXT_LOG_SAMPLE_RATE"
 
 # Prompt Config
 [ -n "$TASK_TEMPLATE" ] && ARGS="${ARGS} --task-template '$TASK_TEMPLATE'"
 [ "$SPECIFY_LANGUAGE" != "0" ] && ARGS="${ARGS} --specify-language"
 [ -n "$LANGUAGE_TEMPLATE" ] && ARGS="${ARGS} --language-template '$LANGUAGE_TEMPLATE'"
+[ -n "$BATCH_TEMPLATE" ] && ARGS="${ARGS} --batch-template '$BATCH_TEMPLATE'"
+[ -n "$GLOSSARY_TEMPLATE" ] && ARGS="${ARGS} --glossary-template '$GLOSSARY_TEMPLATE'"
 
 # Tag Config
 [ -n "$SRC_START" ] && ARGS="${ARGS} --src-start $SRC_START"
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from cache import TranslationCache
+from db import DB
+from examples import ExampleStore
+from session import SessionManager
+
+logger = logging.getLogger("xunity.sync")
+
+
+@dataclass
+class WorkerSync:
+    """
+    Keeps the memory cache and chat histories of one server process in step with the translations
+    other processes save to the shared database.
+
+    Every interval seconds the rows written since the last seen revision are read. Rows of other
+    origins replace stale translations in the memory cache, are added to the example index, and are
+    added to the chat history of the session they were made in if that session is open in this
+    process, leaving the histories of other sessions alone.
+
+    Attributes:
+        db (DB): The shared database.
+        cache (TranslationCache): Memory cache of this process.
+        sessions (SessionManager): Sessions of this process.
+        examples (ExampleStore): Example index of this process.
+        interval (float): Seconds between polls.
+        revision (int): Latest revision seen.
+        task (asyncio.Task): Background task polling the database.
+        polls (int): Polls done.
+        changes (int): Rows of other processes read.
+        refreshed (int): Memory cache entries replaced.
+        history_turns (int): Turns added to chat histories.
+    """
+    db: DB
+    cache: TranslationCache
+    sessions: SessionManager
+    examples: ExampleStore
+    interval: float
+    revision: int = 0
+    task: Optional[asyncio.Task] = None
+    polls: int = 0
+    changes: int = 0
+    refreshed: int = 0
+    history_turns: int = 0
+
+    async def start(self):
+        self.revision = await self.db.aget_revision()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Polling for changes of other workers failed", extra={"fields": {"error": repr(e)}})
+
+    async def poll(self):
+        """
+        Applies the rows other processes wrote since the latest revision seen.
+        """
+        self.polls += 1
+        for revision, origin, record in await self.db.aget_changes(self.revision):
+            self.revision = max(self.revision, revision)
+            if origin == self.db.origin:
+                continue
+            self.changes += 1
+            if self.cache.refresh(record.src_lang, record.tgt_lang, record.src_text, record.tgt_text):
+                self.refreshed += 1
+            self.history_turns += self.sessions.apply_translation(record)
+            self.examples.add(record.src_lang, record.tgt_lang, record.src_text, record.tgt_text)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def stats(self) -> dict:
+        return {"origin": self.db.origin, "revision": self.revision, "polls": self.polls, "changes": self.changes,
+                "refreshed": self.refreshed, "history_turns": self.history_turns}
@@ -0,0 +1,18 @@
+import unicodedata
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without a tokenizer.
+
+    Latin text averages about four characters per token, while CJK characters usually take
+    at least one token each.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens, at least 1.
+    """
+    wide = sum(1 for char in text if unicodedata.east_asian_width(char) in ("W", "F"))
+    return max(1, wide + (len(text) - wide + 3) // 4)
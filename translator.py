@@ -0,0 +1,306 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from batching import BatchScheduler
+from cache import TranslationCache
+from config import Config
+from db import DB
+from examples import ExampleStore
+from glossary import Glossary
+from log import TRANSLATION_LOGGER
+from metrics import record_cache_lookup, stage
+from openai_client import LLMClient
+from passthrough import Passthrough
+from rate_limit import Priority, request_priority
+from resilience import UpstreamError
+from segment import join_segments, split_segments
+from session import Session, SessionManager
+from singleflight import SingleFlight
+from sync import WorkerSync
+from tokens import estimate_tokens
+
+logger = logging.getLogger(TRANSLATION_LOGGER)
+
+
+@dataclass
+class Translator:
+    """
+    The translation pipeline shared by the request handlers.
+
+    Attributes:
+        config (Config): Application configuration.
+        client (LLMClient): Client used to request completions.
+        db (DB): Database used to cache translations.
+        cache (TranslationCache): In-memory cache tier in front of the database.
+        sessions (SessionManager): Pool of chat histories per language pair and session id.
+        batcher (BatchScheduler): Packs pending translations into one completion when batching is enabled.
+        inflight (SingleFlight): Coalesces concurrent requests for the same text into one completion.
+        passthrough (Passthrough): Recognizes texts that need no translation.
+        glossary (Glossary): Fixed translations of terms, sent with the texts they occur in.
+        examples (ExampleStore): Past translations most similar to a text, sent with it as few-shot examples.
+        sync (WorkerSync): Follows the translations of other workers, None with a single worker.
+    """
+    config: Config
+    client: LLMClient
+    db: DB
+    cache: TranslationCache
+    sessions: SessionManager
+    batcher: BatchScheduler
+    passthrough: Passthrough
+    glossary: Glossary
+    examples: ExampleStore
+    inflight: SingleFlight = field(default_factory=SingleFlight)
+    sync: Optional[WorkerSync] = None
+
+    @classmethod
+    def from_config(cls, config: Config):
+        """
+        Create a Translator and its client, database and session pool from a Config.
+
+        Args:
+            config (Config): Application configuration.
+
+        Returns:
+            Translator: An instance of Translator.
+        """
+        db = DB.from_config(config.database_config)
+        client = LLMClient.from_config(config)
+        cache = TranslationCache.from_config(db)
+        sessions = SessionManager.from_config(config, db)
+        glossary = Glossary.from_db(config.glossary_config, db)
+        examples = ExampleStore.from_db(config.examples_config, db)
+        server_config = config.server_config
+        sync = None
+        if server_config.workers > 1 and server_config.sync_interval > 0:
+            sync = WorkerSync(db=db, cache=cache, sessions=sessions, examples=examples, interval=server_config.sync_interval)
+        return cls(config=config,
+                   client=client,
+                   db=db,
+                   cache=cache,
+                   sessions=sessions,
+                   batcher=BatchScheduler(config, client, glossary, examples),
+                   passthrough=Passthrough.from_config(config.passthrough_config),
+                   glossary=glossary,
+                   examples=examples,
+                   sync=sync)
+
+    async def start(self):
+        """
+        Starts following the translations of other workers, e.g. on startup.
+        """
+        if self.sync is not None:
+            await self.sync.start()
+
+    async def translate(self, src_lang: str, tgt_lang: str, text: str, session_id: str = "") -> str:
+        """
+        Translate a piece of text from a source language to a target language.
+
+        Texts that need no translation, such as numbers or text already in the target script, are
+        returned as they are and not added to the history, and so are the translations of texts that
+        are a glossary term as a whole. Other texts are looked up in the translation cache first.
+        Otherwise a completion is requested with the chat history of the session for the language
+        pair, and the finished turn is added to that history. Identical texts requested concurrently
+        share one completion.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            text (str): The text to be translated.
+            session_id (str): Optional client supplied session id. Defaults to "".
+
+        Returns:
+            str: The translated text.
+        """
+        template = self.config.prompt.template
+        reason = self.passthrough.check(src_lang, tgt_lang, text)
+        if reason is not None:
+            logger.info("Translated", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang, "passthrough": reason,
+                                                        "original": text, "translated": text}})
+            return text
+        translated_text = self.glossary.lookup(src_lang, tgt_lang, text)
+        if translated_text is not None:
+            logger.info("Translated", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang, "glossary": True,
+                                                        "original": text, "translated": translated_text}})
+            return translated_text
+        with stage("session"):
+            session = await self.sessions.get_session(src_lang, tgt_lang, session_id)
+        if self.config.database_config.use_cached_translation:
+            with stage("cache"):
+                translated_text = await self.cache.fetch(src_lang, tgt_lang, text)
+            record_cache_lookup(bool(translated_text))
+            if translated_text:
+                await self.add_history(session, text, f"{template.tag.tgt_start}{translated_text}{template.tag.tgt_end}")
+                logger.info("Translated", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang, "cached": True,
+                                                            "original": text, "translated": translated_text}})
+                return translated_text
+        return await self.translate_uncached(session, src_lang, tgt_lang, text, session_id)
+
+    async def translate_uncached(self, session: Session, src_lang: str, tgt_lang: str, text: str, session_id: str = "") -> str:
+        """
+        Translate a text that isn't cached as a whole.
+
+        With segmentation enabled, a text with several segments is split and its distinct segments are
+        translated concurrently through translate, so each segment is looked up in and saved to the cache
+        on its own, and the translations are joined with the original separators. Otherwise the text is
+        translated in one completion shared by identical concurrent requests.
+
+        Args:
+            session (Session): The session whose chat history is used as context.
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            text (str): The text to be translated.
+            session_id (str): Optional client supplied session id. Defaults to "".
+
+        Returns:
+            str: The translated text.
+        """
+        segment_config = self.config.segment_config
+        if segment_config.use_segmentation:
+            segments, separators = split_segments(text, segment_config.segment_by)
+            if len(segments) > 1:
+                distinct = list(dict.fromkeys(segments))
+                translated = await asyncio.gather(*(self.translate(src_lang, tgt_lang, segment, session_id)
+                                                    for segment in distinct))
+                translations = dict(zip(distinct, translated))
+                return join_segments([translations[segment] for segment in segments], separators)
+        return await self.inflight.do((src_lang, tgt_lang, text),
+                                      lambda: self.request_translation(session, src_lang, tgt_lang, text))
+
+    async def translate_many(self, src_lang: str, tgt_lang: str, texts: list, session_id: str = "") -> AsyncIterator[tuple]:
+        """
+        Translate many texts of one language pair, yielding the results in the order of the texts.
+
+        Texts that need no translation are returned as they are, and glossary terms as their
+        translation. Cache hits are looked up in bulk and are not added to the chat history. The
+        distinct cache misses are translated by bulk_concurrency workers the same way as by translate,
+        so they are batched and coalesced with other requests, and each result is yielded as soon as
+        the texts before it are done.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            texts (list): The texts to be translated.
+            session_id (str): Optional client supplied session id. Defaults to "".
+
+        Yields:
+            tuple: The source text and its translation, or the exception raised translating it.
+        """
+        with stage("session"):
+            session = await self.sessions.get_session(src_lang, tgt_lang, session_id)
+        translations = {}
+        distinct = []
+        for text in dict.fromkeys(texts):
+            if self.passthrough.check(src_lang, tgt_lang, text) is not None:
+                translations[text] = text
+            elif (translated_text := self.glossary.lookup(src_lang, tgt_lang, text)) is not None:
+                translations[text] = translated_text
+            else:
+                distinct.append(text)
+        if self.config.database_config.use_cached_translation:
+            with stage("cache"):
+                translations.update(await self.cache.fetch_many(src_lang, tgt_lang, distinct))
+            for text in distinct:
+                record_cache_lookup(text in translations)
+        misses = deque(text for text in distinct if text not in translations)
+        loop = asyncio.get_running_loop()
+        results = {text: loop.create_future() for text in misses}
+
+        async def worker():
+            request_priority.set(Priority.BULK)
+            while misses:
+                text = misses.popleft()
+                try:
+                    translated_text = await self.translate_uncached(session, src_lang, tgt_lang, text, session_id)
+                    results[text].set_result(translated_text)
+                except Exception as e:
+                    results[text].set_exception(e)
+
+        workers = [asyncio.ensure_future(worker())
+                   for _ in range(min(max(1, self.config.batch_config.bulk_concurrency), len(misses)))]
+        try:
+            for text in texts:
+                if text in translations:
+                    yield text, translations[text]
+                    continue
+                try:
+                    yield text, await asyncio.shield(results[text])
+                except Exception as e:
+                    yield text, e
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def request_translation(self, session: Session, src_lang: str, tgt_lang: str, text: str) -> str:
+        """
+        Request a translation from the language model and record it in the history and the cache.
+
+        With batching enabled the text is sent together with other pending texts of the session,
+        and only falls back to its own completion if the batch answer misses it. Completions are
+        queued for the rate limits as UI strings if the text is short, or at the priority of the
+        context, e.g. bulk for POST /translate/batch. With examples enabled, the most similar past
+        translations are sent as turns between the chat history and the text.
+
+        Args:
+            session (Session): The session whose chat history is used as context.
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            text (str): The text to be translated.
+
+        Returns:
+            str: The translated text.
+
+        Raises:
+            UpstreamError: If no completion was obtained or it holds no translation. Nothing is
+            added to the history or the cache then.
+        """
+        template = self.config.prompt.template
+        priority = request_priority.get()
+        if priority is None:
+            priority = Priority.UI if estimate_tokens(text) <= self.config.rate_limit_config.ui_max_tokens else Priority.TEXT
+        completion_res = None
+        if self.config.batch_config.use_batching:
+            with stage("upstream"):
+                translated_text = await self.batcher.submit(session, text, priority)
+            if translated_text is not None:
+                completion_res = f"{template.tag.tgt_start}{translated_text}{template.tag.tgt_end}"
+        if completion_res is None:
+            with stage("glossary"):
+                terms = self.glossary.match(src_lang, tgt_lang, [text])
+            src_prompt = template.get_src_filled_prompt(text, terms)
+            with stage("examples"):
+                example_turns = session.example_turns(self.examples.search(src_lang, tgt_lang, [text]))
+            with stage("upstream"):
+                completion_res = await self.client.request_completion(
+                    session.get_messages(src_prompt, example_turns), stop_at=template.tag.tgt_end,
+                    prompt_tokens=session.prompt_tokens(src_prompt, example_turns), priority=priority)
+        with stage("extract"):
+            translated_text = template.get_translated_text(completion_res)
+        if not translated_text and text.strip():
+            raise UpstreamError("Completion holds no translation")
+        await self.add_history(session, text, completion_res)
+        if self.config.database_config.cache_translation:
+            with stage("save"):
+                await self.cache.save(src_lang, tgt_lang, text, translated_text, session.session_id)
+                self.examples.add(src_lang, tgt_lang, text, translated_text)
+        logger.info("Translated", extra={"fields": {"src_lang": src_lang, "tgt_lang": tgt_lang, "cached": False,
+                                                    "original": text, "translated": translated_text}})
+        return translated_text
+
+    async def add_history(self, session: Session, text: str, completion: str):
+        if self.config.history_config.use_history:
+            with stage("history"):
+                async with session.lock:
+                    session.add_turn(self.config.prompt.template.get_src_filled_prompt(text), completion)
+
+    async def close(self):
+        """
+        Saves translations that are still queued and closes the upstream clients and the database, e.g. on graceful shutdown.
+        """
+        if self.sync is not None:
+            await self.sync.close()
+        await self.cache.close()
+        await self.client.close()
+        self.db.close()
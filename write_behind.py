@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from db import DB, TranslationRecord
+
+logger = logging.getLogger("xunity.write_behind")
+
+
+@dataclass
+class WriteBehind:
+    """
+    Accumulates new translations and saves them in one transaction every max_rows rows or interval_ms.
+
+    Rows stay visible through get until they are committed.
+
+    Attributes:
+        db (DB): The database the rows are saved to.
+        max_rows (int): Number of pending rows that triggers a flush.
+        interval_ms (float): Milliseconds after the first pending row at which a flush is triggered.
+        pending (dict): TranslationRecords waiting for the next flush by (src_lang, tgt_lang, src_text).
+        flushing (dict): Rows of the flush in progress.
+        lock (asyncio.Lock): Serializes flushes.
+        timer (asyncio.TimerHandle): Triggers the next flush.
+        tasks (set): Flushes that were scheduled and are not done yet.
+        flushes (int): Number of transactions committed.
+        rows_flushed (int): Number of rows committed.
+    """
+    db: DB
+    max_rows: int
+    interval_ms: float
+    pending: dict = field(default_factory=dict)
+    flushing: dict = field(default_factory=dict)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    timer: asyncio.TimerHandle = None
+    tasks: set = field(default_factory=set)
+    flushes: int = 0
+    rows_flushed: int = 0
+
+    @classmethod
+    def from_config(cls, db: DB):
+        return cls(db=db, max_rows=db.db_config.write_behind_rows, interval_ms=db.db_config.write_behind_ms)
+
+    def get(self, src_lang: str, tgt_lang: str, src_text: str) -> Optional[str]:
+        key = (src_lang, tgt_lang, src_text)
+        record = self.pending.get(key, self.flushing.get(key))
+        return record.tgt_text if record is not None else None
+
+    def save(self, src_lang: str, tgt_lang: str, src_text: str, tgt_text: str, session_id: str = ""):
+        """
+        Queues a translation to be saved with the next flush.
+
+        Args:
+            src_lang (str): The source language code.
+            tgt_lang (str): The target language code.
+            src_text (str): The source text.
+            tgt_text (str): The translated text.
+            session_id (str): Session the translation was made in.
+        """
+        self.pending[(src_lang, tgt_lang, src_text)] = TranslationRecord(src_lang, tgt_lang, src_text, tgt_text, session_id)
+        if len(self.pending) >= self.max_rows:
+            self.schedule_flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.interval_ms / 1000, self.schedule_flush)
+
+    def schedule_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        task = asyncio.ensure_future(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        """
+        Saves all pending rows in one transaction. Rows of a failed flush are queued again.
+        """
+        async with self.lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            records = list(self.flushing.values())
+            try:
+                await self.db.asave_translations(records)
+                self.flushes += 1
+                self.rows_flushed += len(records)
+            except Exception as e:
+                logger.warning("Error saving translations, retrying with the next flush", extra={"fields": {"rows": len(records), "error": str(e)}})
+                self.pending = {**self.flushing, **self.pending}
+                if self.timer is None:
+                    self.timer = asyncio.get_running_loop().call_later(self.interval_ms / 1000, self.schedule_flush)
+            finally:
+                self.flushing = {}
+
+    async def close(self):
+        """
+        Flushes the remaining rows, e.g. on graceful shutdown.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        await asyncio.gather(*self.tasks)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending) + len(self.flushing), "flushes": self.flushes, "rows_flushed": self.rows_flushed}
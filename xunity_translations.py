@@ -0,0 +1,136 @@
+import argparse
+import sys
+from typing import Iterator, TextIO
+
+import toml
+
+from config import DatabaseConfig
+from db import DB, TranslationRecord
+from normalize import is_template
+
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+
+
+def unescape(text: str) -> str:
+    r"""
+    Reverts the escaping of XUnity translation files, where \n, \r, \t, \\ and \= stand for the plain characters.
+    """
+    if "\\" not in text:
+        return text
+    chars = []
+    escaped = False
+    for char in text:
+        if escaped:
+            chars.append(ESCAPES.get(char, char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            chars.append(char)
+    if escaped:
+        chars.append("\\")
+    return "".join(chars)
+
+
+def escape(text: str) -> str:
+    text = text.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t").replace("=", "\\=")
+    return "\\/" + text[1:] if text.startswith("//") else text
+
+
+def parse_line(line: str):
+    """
+    Splits a key=value line of an XUnity translation file at the first unescaped '='.
+
+    Returns:
+        tuple: The unescaped source and translated text, or None for empty lines, comments, regex
+        entries (r:/sr:) and lines without a translation.
+    """
+    line = line.rstrip("\r\n")
+    if not line or line.startswith("//") or line.startswith(("r:\"", "sr:\"")):
+        return None
+    index = 0
+    while True:
+        index = line.find("=", index)
+        if index == -1:
+            return None
+        backslashes = len(line[:index]) - len(line[:index].rstrip("\\"))
+        if backslashes % 2 == 0:
+            break
+        index += 1
+    src_text, tgt_text = unescape(line[:index]), unescape(line[index + 1:])
+    if not src_text or not tgt_text:
+        return None
+    return src_text, tgt_text
+
+
+def read_translations(paths: list, src_lang: str, tgt_lang: str) -> list:
+    """
+    Reads XUnity translation files, keeping the last translation of every text like XUnity does.
+    """
+    translations = {}
+    for path in paths:
+        with open(path, encoding="utf-8-sig") as file:
+            for line in file:
+                entry = parse_line(line)
+                if entry is not None:
+                    translations[entry[0]] = entry[1]
+    return [TranslationRecord(src_lang, tgt_lang, src_text, tgt_text) for src_text, tgt_text in translations.items()]
+
+
+def write_translations(records: Iterator, file: TextIO) -> int:
+    count = 0
+    for record in records:
+        if is_template(record.src_text):
+            continue
+        file.write(f"{escape(record.src_text)}={escape(record.tgt_text)}\n")
+        count += 1
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import and export XUnity _AutoGeneratedTranslations.txt files")
+    parser.add_argument("--config", type=str, default="config.toml", help="Path to the config file with the [database] section")
+    parser.add_argument("--from", dest="src_lang", type=str, required=True, help="Source language code")
+    parser.add_argument("--to", dest="tgt_lang", type=str, required=True, help="Target language code")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per transaction or fetch")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Load translation files into the translations table")
+    import_parser.add_argument("files", nargs="+", help="XUnity translation files")
+    import_parser.add_argument("--overwrite", action="store_true", help="Replace translations that exist in the table already")
+
+    glossary_parser = commands.add_parser("glossary", help="Load glossary files (term=translation per line) into the glossary table")
+    glossary_parser.add_argument("files", nargs="+", help="Glossary files in the format of XUnity translation files")
+    glossary_parser.add_argument("--overwrite", action="store_true", help="Replace terms that exist in the table already")
+
+    export_parser = commands.add_parser("export", help="Write the translations table as an XUnity translation file")
+    export_parser.add_argument("file", help="Output file, - for stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db = DB.from_config(DatabaseConfig.from_dict(toml.load(args.config)["database"]))
+    try:
+        if args.command == "import":
+            records = read_translations(args.files, args.src_lang, args.tgt_lang)
+            written = db.import_translations(records, overwrite=args.overwrite, chunk_size=args.batch_size)
+            print(f"Read {len(records)} translations, wrote {written} rows.", file=sys.stderr)
+        elif args.command == "glossary":
+            records = read_translations(args.files, args.src_lang, args.tgt_lang)
+            written = db.import_glossary(records, overwrite=args.overwrite, chunk_size=args.batch_size)
+            print(f"Read {len(records)} terms, wrote {written} rows.", file=sys.stderr)
+        else:
+            records = db.iter_translations(args.src_lang, args.tgt_lang, chunk_size=args.batch_size)
+            if args.file == "-":
+                count = write_translations(records, sys.stdout)
+            else:
+                with open(args.file, "w", encoding="utf-8") as file:
+                    count = write_translations(records, file)
+            print(f"Exported {count} translations.", file=sys.stderr)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()